@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+""" Parsing time and gzip size of OVM-shaped list payloads.
+
+Builds /Vm, /VirtualNic and /VirtualDisk lists shaped like the ones
+OVM Manager 3.4 returns and times parsing and encoding them with the
+json module, next to the compressed size a gzip response would have
+and the time it takes to decompress.
+
+    python bench/bench_codec.py [objects]
+"""
+
+import gzip
+import json
+import sys
+import timeit
+
+
+BASE = 'https://127.0.0.1:7002/ovm/core/wsapi/rest'
+
+
+def ref(object_type, value, name):
+    return {
+        'type': 'com.oracle.ovm.mgr.ws.model.'+object_type,
+        'value': value,
+        'name': name,
+        'uri': BASE+'/'+object_type+'/'+value,
+    }
+
+
+def common(object_type, i, name):
+    return {
+        'id': ref(object_type, '0004fb0000%02d0000%012x' % (len(object_type), i), name),
+        'name': name,
+        'description': '',
+        'generation': 12,
+        'locked': False,
+        'readOnly': False,
+        'userData': [],
+        'resourceGroupIds': [],
+    }
+
+
+def payloads(count):
+    pool = ref('ServerPool', '0004fb0000020000aaaaaaaaaaaa', 'Pool1')
+    repo = ref('Repository', '0004fb0000030000bbbbbbbbbbbb', 'Repo1')
+    vms, vnics, disks = [], [], []
+    for i in range(count):
+        vm = common('Vm', i, 'vm%05d' % i)
+        vm.update(vmRunState='RUNNING', serverPoolId=pool, repositoryId=repo,
+                  cpuCount=2, memory=4096, vmDomainType='XEN_HVM',
+                  virtualNicIds=[ref('VirtualNic', '%012x' % i, 'vm%05d_vnic' % i)],
+                  vmDiskMappingIds=[ref('VmDiskMapping', '%012x' % i, 'map')])
+        vms.append(vm)
+        vnic = common('VirtualNic', i, 'vm%05d_vnic' % i)
+        vnic.update(vmId=vm['id'], macAddress='00:21:f6:%02x:%02x:%02x' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                    networkId=ref('Network', '0a0a0a00', 'Public'),
+                    ipAddresses=[{'address': '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255), 'type': 'IPV4'}])
+        vnics.append(vnic)
+        disk = common('VirtualDisk', i, 'vm%05d_os' % i)
+        disk.update(repositoryId=repo, size=53687091200, onDiskSize=10737418240,
+                    diskType='VIRTUAL_DISK', path='/OVS/Repositories/x/VirtualDisks/%012x.img' % i,
+                    shareable=False)
+        disks.append(disk)
+    return dict(Vm=vms, VirtualNic=vnics, VirtualDisk=disks)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for name, objects in sorted(payloads(count).items()):
+        raw = json.dumps(objects).encode('utf-8')
+        packed = gzip.compress(raw) if hasattr(gzip, 'compress') else raw
+        print('%-12s %6d objects  %7.1f MB raw  %6.2f MB gzip (%.0fx)' % (
+            '/'+name, len(objects), len(raw) / 1e6, len(packed) / 1e6,
+            float(len(raw)) / len(packed)))
+        parse = min(timeit.repeat(lambda: json.loads(raw), number=3, repeat=3)) / 3
+        encode = min(timeit.repeat(lambda: json.dumps(objects), number=3, repeat=3)) / 3
+        print('    json     loads %7.1f ms  dumps %7.1f ms' % (parse * 1000, encode * 1000))
+        unzip = min(timeit.repeat(lambda: gzip.decompress(packed), number=3, repeat=3)) / 3
+        print('    gunzip   %7.1f ms' % (unzip * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+""" Memory and time of the ovm_orphans scan on big lists.
+
+Streams /VirtualDisk, /VmDiskMapping, /VirtualNic and /Vm/id lists
+shaped like the ones OVM Manager 3.4 returns, with every tenth disk and
+every hundredth VNIC orphaned, through orphan_disks() and orphan_vnics()
+and reports the peak memory the scan allocates, next to the peak of
+loading the disk list whole. Needs ansible installed.
+
+    python bench/bench_orphans.py [disks]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+
+from ansible.module_utils.ovm_orphans import orphan_disks, orphan_vnics
+from ansible.module_utils.ovm_stream import project
+
+BASE = 'https://127.0.0.1:7002/ovm/core/wsapi/rest'
+
+
+def ref(object_type, value, name):
+    return {
+        'type': 'com.oracle.ovm.mgr.ws.model.'+object_type,
+        'value': value,
+        'name': name,
+        'uri': BASE+'/'+object_type+'/'+value,
+    }
+
+
+def common(object_type, i, name):
+    return {
+        'id': ref(object_type, '0004fb0000%02d0000%012x' % (len(object_type), i), name),
+        'name': name,
+        'description': '',
+        'generation': 12,
+        'locked': False,
+        'readOnly': False,
+        'userData': [],
+        'resourceGroupIds': [],
+    }
+
+
+class ListClient(object):
+    """ iter_list() over generated objects, one at a time like the
+    streamed download. """
+
+    def __init__(self, count):
+        self.count = count
+        self.repo = ref('Repository', '0004fb0000030000bbbbbbbbbbbb', 'Repo1')
+
+    def vm(self, i):
+        return common('Vm', i, 'vm%06d' % i)['id']
+
+    def disk(self, i):
+        disk = common('VirtualDisk', i, 'vm%06d_os' % i)
+        disk.update(repositoryId=self.repo, size=53687091200, onDiskSize=10737418240,
+                    diskType='VIRTUAL_DISK', shareable=False,
+                    path='/OVS/Repositories/x/VirtualDisks/%012x.img' % i)
+        return disk
+
+    def objects(self, path):
+        vms = self.count // 10 * 9
+        if path == '/Vm/id':
+            for i in range(vms):
+                yield self.vm(i)
+        elif path == '/VirtualDisk':
+            for i in range(self.count):
+                yield self.disk(i)
+        elif path == '/VmDiskMapping':
+            for i in range(self.count):
+                if i % 10:
+                    mapping = common('VmDiskMapping', i, 'map')
+                    mapping.update(vmId=self.vm(i), virtualDiskId=self.disk(i)['id'],
+                                   diskTarget=0)
+                    yield mapping
+        elif path == '/VirtualNic':
+            for i in range(vms):
+                vnic = common('VirtualNic', i, 'vm%06d_vnic' % i)
+                vnic.update(vmId=self.vm(i if i % 100 else vms + i),
+                            macAddress='00:21:f6:00:00:00')
+                yield vnic
+
+    def iter_list(self, path, fields=None):
+        for obj in self.objects(path):
+            yield project(obj, fields)
+
+
+def measure(label, func):
+    tracemalloc.start()
+    started = time.time()
+    result = func()
+    seconds = time.time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-22s %7.2f s  peak %7.1f MB  %d orphans' % (
+        label, seconds, peak / 1e6, len(result)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    client = ListClient(count)
+    print('%d disks' % count)
+    measure('orphan_disks', lambda: orphan_disks(client))
+    measure('orphan_vnics', lambda: orphan_vnics(client))
+    measure('whole /VirtualDisk', lambda: list(client.iter_list('/VirtualDisk')))
+
+
+if __name__ == '__main__':
+    main()
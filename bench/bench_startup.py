@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+""" Time the start-up of every ovm_* module.
+
+Each module is loaded in a fresh interpreter, the way a task runs it,
+and the time to import it (AnsibleModule and the module_utils it pulls
+in) and to build a session with auth() is reported for the stdlib and
+the requests transport. Needs ansible installed.
+
+    python bench/bench_startup.py [runs]
+"""
+
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARY = os.path.join(HERE, '..', 'library')
+MODULE_UTILS = os.path.join(HERE, '..', 'module_utils')
+
+CHILD = r'''
+import sys, time
+started = time.time()
+import ansible.module_utils
+ansible.module_utils.__path__.append(sys.argv[2])
+from ansible.module_utils.basic import AnsibleModule
+basic = time.time()
+namespace = {'__name__': 'bench'}
+path = sys.argv[1]
+exec(compile(open(path).read(), path, 'exec'), namespace)
+loaded = time.time()
+from ansible.module_utils.ovm import auth
+auth('user', 'pass')
+done = time.time()
+print('%f %f %f' % (basic - started, loaded - basic, done - loaded))
+'''
+
+
+def measure(path, transport, runs):
+    env = dict(os.environ, OVM_TRANSPORT=transport)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', CHILD, path, MODULE_UTILS], env=env)
+        samples.append([float(v) for v in out.split()])
+    # Median of each column
+    return [sorted(column)[len(column) // 2] * 1000 for column in zip(*samples)]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    modules = sorted(f for f in os.listdir(LIBRARY)
+                     if f.startswith('ovm_') and f.endswith('.py'))
+    print('%-24s %10s %10s %12s %14s' % (
+        'module', 'basic ms', 'module ms', 'auth http ms', 'auth requests ms'))
+    for name in modules:
+        path = os.path.join(LIBRARY, name)
+        basic, loaded, lean = measure(path, 'http', runs)
+        heavy = measure(path, 'requests', runs)[2]
+        print('%-24s %10.1f %10.1f %12.1f %14.1f' % (
+            name[:-3], basic, loaded, lean, heavy))
+
+
+if __name__ == '__main__':
+    main()
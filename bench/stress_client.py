@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+""" Hammer one shared OVMRestClient from a pool of threads.
+
+Starts a stand-in OVM manager on 127.0.0.1 and runs lookups, list
+downloads, job-creating writes and job polls from many threads
+through a single client, with each transport. Afterwards the client's
+counters are checked against what the server saw and against each
+other, and the connections the server accepted are reported. Needs
+ansible installed.
+
+    python bench/stress_client.py [threads] [operations]
+"""
+
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+
+from ansible.module_utils.ovm import auth, base_uri_for, run_parallel, OVMRestClient
+
+PREFIX = '/ovm/core/wsapi/rest'
+# Jobs finish on their first poll, the client would sleep between polls
+JOB_POLLS = 1
+
+
+class Manager(object):
+    """ Just enough OVM state: VMs and jobs that finish after a few polls. """
+
+    def __init__(self, vms):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.vms = {}
+        self.jobs = {}
+        self.requests = 0
+        self.connections = 0
+        for i in range(vms):
+            self.add_vm('vm%d' % i)
+
+    def ref(self, object_type, name):
+        value = '%s-%d' % (object_type, next(self.ids))
+        return dict(type='com.oracle.ovm.mgr.ws.model.'+object_type,
+                    value=value, name=name, uri=PREFIX+'/'+object_type+'/'+value)
+
+    def add_vm(self, name):
+        vm = dict(id=self.ref('Vm', name), name=name, vmRunState='STOPPED',
+                  description='')
+        self.vms[vm['id']['value']] = vm
+        return vm
+
+    def job(self, result=None):
+        job_id = self.ref('Job', 'job')
+        self.jobs[job_id['value']] = dict(id=job_id, polls=0, resultId=result)
+        return dict(id=job_id)
+
+    def handle(self, method, path, body):
+        parts = path.split('?')[0].strip('/').split('/')
+        with self.lock:
+            self.requests += 1
+            if parts == ['Vm', 'id']:
+                return [vm['id'] for vm in self.vms.values()]
+            if parts == ['Vm'] and method == 'GET':
+                return list(self.vms.values())
+            if parts[0] == 'Vm' and method == 'GET':
+                return self.vms[parts[1]]
+            if parts[0] == 'Vm' and method == 'POST':
+                return self.job(self.add_vm(body['name'])['id'])
+            if parts[0] == 'Vm' and parts[2] in ('start', 'stop'):
+                self.vms[parts[1]]['vmRunState'] = 'RUNNING' if parts[2] == 'start' else 'STOPPED'
+                return self.job()
+            if parts[0] == 'Job':
+                job = self.jobs[parts[1]]
+                job['polls'] += 1
+                done = job['polls'] >= JOB_POLLS
+                return dict(id=job['id'], summaryDone=done,
+                            jobRunState='SUCCESS' if done else 'RUNNING',
+                            resultId=job['resultId'])
+        raise KeyError(path)
+
+
+def serve(manager):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        wbufsize = 65536
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            with manager.lock:
+                manager.connections += 1
+
+        def reply(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            try:
+                out = json.dumps(manager.handle(method, self.path[len(PREFIX):], body)).encode()
+                self.send_response(200)
+            except KeyError:
+                out = b'null'
+                self.send_response(404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self):
+            self.reply('GET')
+
+        def do_POST(self):
+            self.reply('POST')
+
+        def do_PUT(self):
+            self.reply('PUT')
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        request_queue_size = 256
+
+        def handle_error(self, request, client_address):
+            # Lookups that stop reading a list early drop their connection
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+def operation(client, vm_names, n):
+    rand = random.Random(n)
+    kind = rand.choice(('get', 'get', 'find', 'list', 'start', 'create'))
+    if kind == 'get':
+        vm = client.get_id_for_name('Vm', rand.choice(vm_names))
+        return client.get('Vm', vm['value'])['name'] == vm['name']
+    if kind == 'find':
+        return client.get_id_for_name('Vm', rand.choice(vm_names)) is not None
+    if kind == 'list':
+        return len(client.get_ids('Vm', ['vmRunState'])) >= len(vm_names)
+    if kind == 'start':
+        vm = client.get_id_for_name('Vm', rand.choice(vm_names))
+        client.start_vm(vm)
+        return True
+    result = client.create_vm('Vm', {'name': 'new%d' % n})
+    return result['name'] == 'new%d' % n
+
+
+def run(transport, threads, operations):
+    os.environ['OVM_TRANSPORT'] = transport
+    manager = Manager(200)
+    server, url = serve(manager)
+    vm_names = sorted(vm['name'] for vm in manager.vms.values())
+    client = OVMRestClient(base_uri_for(url), auth('user', 'pass', pool_size=threads))
+    started = time.time()
+    results = run_parallel(lambda n: operation(client, vm_names, n),
+                           range(operations), limit=threads)
+    seconds = time.time() - started
+    server.shutdown()
+
+    errors = [error for _, _, error in results if error is not None]
+    wrong = [n for n, ok, error in results if error is None and not ok]
+    stats = client.stats
+    problems = []
+    if errors:
+        problems.append('%d operations raised, first: %r' % (len(errors), errors[0]))
+    if wrong:
+        problems.append('%d operations returned wrong results' % len(wrong))
+    if stats['requests'] != manager.requests:
+        problems.append('client counted %d requests, server saw %d' % (
+            stats['requests'], manager.requests))
+    if sum(counts[0] for counts in stats['endpoints'].values()) != stats['requests']:
+        problems.append('endpoint counts do not add up to the request count')
+    if len(client.jobs) != len(manager.jobs):
+        problems.append('client recorded %d jobs, server ran %d' % (
+            len(client.jobs), len(manager.jobs)))
+    if client.tracker.pending:
+        problems.append('%d jobs still pending' % len(client.tracker.pending))
+
+    print('%-8s %6d ops %6d requests %5d coalesced %4d connections %7.2f s  %s' % (
+        transport, operations, stats['requests'], stats['coalesced'],
+        manager.connections, seconds, 'ok' if not problems else 'FAILED'))
+    for problem in problems:
+        print('    '+problem)
+    return not problems
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    ok = all([run(transport, threads, operations) for transport in ('http', 'requests')])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
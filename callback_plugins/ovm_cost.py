@@ -0,0 +1,120 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: ovm_cost
+    type: aggregate
+    short_description: Rank tasks by the OVM API cost of their ovm_* modules
+    description:
+      - Collects the ovm_stats every ovm_* module returns (requests, bytes,
+        lookup time, job wait time and per endpoint counts) for every task
+        and host, prints the most expensive tasks at the end of the run and
+        writes the full breakdown as JSON.
+    requirements:
+      - enable in configuration, e.g. callback_whitelist = ovm_cost
+    options:
+      output:
+        description: Path of the JSON report.
+        default: ovm_cost.json
+        env:
+          - name: OVM_COST_OUTPUT
+        ini:
+          - section: callback_ovm_cost
+            key: output
+      top:
+        description: Number of tasks shown in the summary.
+        default: 20
+        type: int
+        env:
+          - name: OVM_COST_TOP
+        ini:
+          - section: callback_ovm_cost
+            key: top
+'''
+
+import json
+
+from ansible.plugins.callback import CallbackBase
+
+STAT_FIELDS = ('requests', 'bytes', 'request_seconds', 'lookups',
+               'lookup_seconds', 'coalesced', 'job_polls', 'job_wait_seconds')
+
+
+class CallbackModule(CallbackBase):
+    """ Aggregate ovm_stats per task across a whole playbook. """
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ovm_cost'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.tasks = {}
+        self.order = []
+
+    def _add(self, result):
+        results = result._result.get('results')
+        if results is None:
+            results = [result._result]
+        found = [r['ovm_stats'] for r in results
+                 if isinstance(r, dict) and 'ovm_stats' in r]
+        if not found:
+            return
+        task = result._task
+        key = task._uuid
+        if key not in self.tasks:
+            self.order.append(key)
+            entry = dict(task=task.get_name(), action=task.action,
+                         hosts=[], invocations=0, endpoints={})
+            for field in STAT_FIELDS:
+                entry[field] = 0
+            self.tasks[key] = entry
+        entry = self.tasks[key]
+        host = result._host.get_name()
+        if host not in entry['hosts']:
+            entry['hosts'].append(host)
+        for stats in found:
+            entry['invocations'] += 1
+            for field in STAT_FIELDS:
+                entry[field] += stats.get(field, 0)
+            for endpoint, counts in stats.get('endpoints', {}).items():
+                total = entry['endpoints'].setdefault(endpoint, [0, 0, 0.0])
+                entry['endpoints'][endpoint] = [a + b for a, b in zip(total, counts)]
+
+    def v2_runner_on_ok(self, result):
+        self._add(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._add(result)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.tasks:
+            return
+        try:
+            output = self.get_option('output')
+            top = self.get_option('top')
+        except Exception:
+            output, top = 'ovm_cost.json', 20
+
+        entries = [self.tasks[key] for key in self.order]
+        for entry in entries:
+            entry['cost_seconds'] = entry['request_seconds'] + entry['job_wait_seconds']
+        ranked = sorted(entries, key=lambda e: e['cost_seconds'], reverse=True)
+
+        self._display.banner('OVM API COST')
+        self._display.display('%-40s %8s %10s %9s %9s  %s' % (
+            'task', 'requests', 'MB', 'lookup s', 'job s', 'heaviest endpoint'))
+        for entry in ranked[:top]:
+            heaviest = ''
+            if entry['endpoints']:
+                endpoint = max(entry['endpoints'], key=lambda e: entry['endpoints'][e][1])
+                heaviest = '%s (%.1f MB)' % (endpoint, entry['endpoints'][endpoint][1] / 1048576.0)
+            self._display.display('%-40s %8d %10.1f %9.1f %9.1f  %s' % (
+                entry['task'][:40], entry['requests'], entry['bytes'] / 1048576.0,
+                entry['lookup_seconds'], entry['job_wait_seconds'], heaviest))
+
+        with open(output, 'w') as f:
+            json.dump(dict(tasks=ranked), f, indent=2)
+        self._display.display('OVM API cost report written to %s' % output)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+
+DOCUMENTATION = '''
+---
+module: ovm_apply
+short_description: Apply a declarative topology of VMs to Oracle-VM
+description:
+  - Takes a description of many VMs with their disks, VNICs, server-pool
+    membership and power state. The manager is read once, the differences
+    for the whole topology are computed locally and the resulting jobs are
+    run in parallel.
+  - In check mode only the plan is returned.
+author: "Court Campbell"
+notes:
+    - This module works with OVM 3.3 and 3.4
+    - Set hosts in your playbook to the OVM Manager server
+    - VM, VirtualDisk and VirtualNic names are treated as unique, like
+      the other ovm_* modules do.
+requirements:
+    - requests package, only with OVM_TRANSPORT=requests
+options:
+    ovm_user:
+        description:
+            - The OVM admin-user used to connect to the OVM-Manager.
+        required: True
+    ovm_pass:
+        description:
+            - The password of the OVM admin-user.
+        required: True
+    ovm_host:
+        description:
+            - The base-url for Oracle-VM.
+        default: https://127.0.0.1:7002
+        required: False
+    topology:
+        description:
+            - The topology as a dict with a 'vms' list. Each VM takes
+            - name (required), serverpool, repository, memory,
+            - max_memory, vcpu_cores, max_vcpu_cores, vm_domain_type,
+            - state (present, started, stopped, suspended), disks
+            - (name and size as whole GiB required, sparse, repository)
+            - and networks (name required, network). A topology with
+            - missing or mistyped keys fails before the manager is read.
+            - Mutually exclusive with src.
+        required: False
+    src:
+        description:
+            - Path to a JSON or YAML file holding the topology.
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of jobs running at the same time.
+        default: 4
+        required: False
+    journal:
+        description:
+            - Path of a local job journal, see ovm_create. A failed
+            - apply can be run again and resumes where it stopped.
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each job of the apply. Jobs still
+              running are aborted when it expires.
+        required: False
+    rollback:
+        description:
+            - When the task is cancelled by job_timeout or a signal,
+            - delete the virtual disks and VNICs it created.
+        default: False
+        required: False
+'''
+
+EXAMPLES = '''
+- name: Build the web tier
+  ovm_apply:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    max_parallel: 8
+    topology:
+      vms:
+        - name: 'web1'
+          serverpool: 'Pool1'
+          repository: 'Repo1'
+          memory: 4096
+          vcpu_cores: 2
+          state: started
+          disks:
+            - name: 'web1_os'
+              size: 50
+              sparse: False
+              repository: 'Repo1'
+          networks:
+            - name: 'web1_vnic0'
+              network: 'Public'
+
+- name: Show what would change for a topology file
+  ovm_apply:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    src: '/etc/ovm/topology.yml'
+  check_mode: yes
+'''
+
+RETURN = '''
+plan:
+  description:
+    - The actions needed to reach the topology, one dict per action
+      with vm, action and target.
+summary:
+  description:
+    - Number of planned actions per action type and the number of
+      applied, failed and skipped actions.
+results:
+  description:
+    - The outcome of every planned action when not in check mode.
+'''
+
+WANT_JSON = ''
+
+VM_STATES = {
+    'started': ('RUNNING', 'start_vm'),
+    'stopped': ('STOPPED', 'stop_vm'),
+    'suspended': ('SUSPENDED', 'suspend_vm'),
+}
+
+#==============================================================
+try:
+    import yaml
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
+#==============================================================
+def load_topology(path):
+    with open(path) as f:
+        content = f.read()
+    try:
+        return json.loads(content)
+    except ValueError:
+        if not HAS_YAML:
+            raise Exception("%s is not JSON and PyYAML is not installed" % path)
+        return yaml.safe_load(content)
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_items(spec, key, required, optional):
+    """ Errors in the disks or networks list of one VM. required and
+    optional map the keys of an item to their type. """
+    items = spec.get(key)
+    if items is None:
+        return []
+    if not isinstance(items, list):
+        return ["%s must be a list" % key]
+    errors = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append("%s[%d] must be a dict" % (key, position))
+            continue
+        label = "%s[%d]" % (key, position)
+        if isinstance(item.get('name'), str):
+            label = "%s %s" % (key[:-1], item['name'])
+        for name, check in required.items():
+            if name not in item:
+                errors.append("%s: %s is required" % (label, name))
+            elif not check(item[name]):
+                errors.append("%s: invalid %s %r" % (label, name, item[name]))
+        for name, check in optional.items():
+            if item.get(name) is not None and not check(item[name]):
+                errors.append("%s: invalid %s %r" % (label, name, item[name]))
+    return errors
+
+
+def validate_vm(spec, position):
+    """ Return the errors in the VM at position in the topology, a
+    list of messages starting with the name of the VM. """
+    label = 'vms[%d]' % position
+    if not isinstance(spec, dict):
+        return ["%s: must be a dict" % label]
+    if not isinstance(spec.get('name'), str) or not spec['name']:
+        return ["%s: name is required" % label]
+    errors = []
+    for key in ('serverpool', 'repository', 'vm_domain_type'):
+        if spec.get(key) is not None and not isinstance(spec[key], str):
+            errors.append("invalid %s %r" % (key, spec[key]))
+    for key in ('memory', 'max_memory', 'vcpu_cores', 'max_vcpu_cores'):
+        if spec.get(key) is not None and not is_int(spec[key]):
+            errors.append("%s must be an integer" % key)
+    if not errors:
+        memory = spec.get('memory', 4096)
+        max_memory = spec.get('max_memory') or memory
+        if memory%1024 != 0 or max_memory%1024 != 0:
+            errors.append("memory must be a multitude of 1024")
+        elif max_memory < memory:
+            errors.append("max_memory < memory")
+    if spec.get('state', 'present') not in ('present', 'started', 'stopped', 'suspended'):
+        errors.append("invalid state %s" % spec.get('state'))
+    errors.extend(validate_items(
+        spec, 'disks',
+        required={'name': lambda value: isinstance(value, str) and value != '',
+                  'size': lambda value: is_int(value) and value > 0},
+        optional={'sparse': lambda value: isinstance(value, bool),
+                  'repository': lambda value: isinstance(value, str)}))
+    errors.extend(validate_items(
+        spec, 'networks',
+        required={'name': lambda value: isinstance(value, str) and value != ''},
+        optional={'network': lambda value: isinstance(value, str)}))
+    return ["%s: %s" % (spec['name'], error) for error in errors]
+
+#==============================================================
+class Snapshot:
+    """ One read of every object type the topology refers to. """
+
+    def __init__(self, client, need_disks, need_vnics):
+        self.pools = load_name_index(client, 'ServerPool')
+        self.repositories = load_name_index(client, 'Repository')
+        self.networks = load_name_index(client, 'Network')
+        self.vms = ObjectIndex.load(client, 'Vm').by_name
+        self.disks = {}
+        self.disk_maps = {}
+        self.vnics = {}
+        if need_disks:
+            self.disks = load_name_index(client, 'VirtualDisk')
+            self.disk_maps = ObjectIndex.load(client, 'VmDiskMapping').group_by('vmId')
+        if need_vnics:
+            self.vnics = ObjectIndex.load(client, 'VirtualNic').by_name
+
+
+def plan_vm(spec, snap):
+    """ Return (errors, actions) to bring one VM in line with spec.
+
+    Actions are dicts with vm, action, target and the data needed to
+    run them. The phase decides ordering: VMs and disks are created
+    first, then disks are mapped and VNICs added, then the power
+    state is set.
+    """
+    name = spec['name']
+    errors = []
+    actions = []
+
+    def add(phase, action, target, **data):
+        data.update(vm=name, phase=phase, action=action, target=target)
+        actions.append(data)
+
+    pool = snap.pools.get(spec.get('serverpool'))
+    repository = snap.repositories.get(spec.get('repository'))
+    if spec.get('serverpool') and pool is None:
+        errors.append("%s: unknown serverpool %s" % (name, spec['serverpool']))
+
+    vm = snap.vms.get(name)
+    if vm is None:
+        if pool is None or repository is None:
+            errors.append("%s: serverpool and repository are required to create a VM" % name)
+            return errors, actions
+        memory = spec.get('memory', 4096)
+        vcpu_cores = spec.get('vcpu_cores', 1)
+        add(1, 'create_vm', name, data={
+            'repositoryId': repository,
+            'serverPoolId': pool,
+            'vmDomainType': spec.get('vm_domain_type', 'XEN_HVM'),
+            'name': name,
+            'cpuCount': vcpu_cores,
+            'cpuCountLimit': spec.get('max_vcpu_cores') or vcpu_cores,
+            'memory': memory,
+            'memoryLimit': spec.get('max_memory') or memory
+        })
+        mapped = set()
+        disk_target = 0
+    else:
+        mapped = set(m['virtualDiskId']['value']
+                     for m in snap.disk_maps.get(vm['id']['value'], [])
+                     if m.get('virtualDiskId') is not None)
+        disk_target = len(snap.disk_maps.get(vm['id']['value'], []))
+        current_pool = vm.get('serverPoolId')
+        if pool is not None:
+            if current_pool is None:
+                add(2, 'add_vm', pool['name'], pool=pool)
+            elif current_pool['value'] != pool['value']:
+                add(2, 'remove_vm', current_pool['name'], pool=current_pool)
+                add(2, 'add_vm', pool['name'], pool=pool)
+
+    for disk in spec.get('disks') or []:
+        disk_id = snap.disks.get(disk['name'])
+        if disk_id is None:
+            disk_repository = snap.repositories.get(disk.get('repository'))
+            if disk_repository is None:
+                errors.append("%s: unknown repository %s for disk %s" % (
+                    name, disk.get('repository'), disk['name']))
+                continue
+            add(1, 'create_vdisk', disk['name'],
+                repository=disk_repository,
+                sparse=disk.get('sparse', False),
+                data={
+                    'name': disk['name'],
+                    'size': int(disk['size']) * (2**30)
+                })
+        elif disk_id['value'] in mapped:
+            continue
+        add(2, 'map_vdisk', disk['name'], disk_target=disk_target)
+        disk_target += 1
+
+    for network in spec.get('networks') or []:
+        network_id = None
+        if network.get('network'):
+            network_id = snap.networks.get(network['network'])
+            if network_id is None:
+                errors.append("%s: unknown network %s" % (name, network['network']))
+                continue
+        vnic = snap.vnics.get(network['name'])
+        if vnic is None:
+            add(2, 'create_vnic', network['name'], network=network_id)
+        elif network_id is not None and (vnic.get('networkId') is None or
+                vnic['networkId']['value'] != network_id['value']):
+            add(2, 'add_vnic_to_network', network['name'],
+                network=network_id, vnic=vnic['id'])
+
+    state = spec.get('state', 'present')
+    if state in VM_STATES:
+        run_state, call = VM_STATES[state]
+        if vm is None or vm.get('vmRunState') != run_state:
+            add(3, call, name)
+
+    return errors, actions
+
+#==============================================================
+class Applier:
+    """ Runs planned actions, phase by phase, in parallel groups.
+
+    Within a phase the actions of one VM run in order, different
+    VMs and independent disk creations run side by side.
+    """
+
+    def __init__(self, client_factory, snap, max_parallel):
+        self.client_factory = client_factory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.vm_ids = dict((n, vm['id']) for n, vm in snap.vms.items())
+        self.disk_ids = dict(snap.disks)
+        self.failed_vms = set()
+        self.max_parallel = max_parallel
+        self.results = []
+
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.client_factory()
+        return self.local.client
+
+    def run(self, actions):
+        for phase in sorted(set(a['phase'] for a in actions)):
+            groups = {}
+            for action in actions:
+                if action['phase'] != phase:
+                    continue
+                key = action['vm']
+                if action['action'] == 'create_vdisk':
+                    key = (action['vm'], action['target'])
+                groups.setdefault(key, []).append(action)
+            run_parallel(self.run_group, list(groups.values()), self.max_parallel)
+        return self.results
+
+    def run_group(self, group):
+        for action in group:
+            status, error = 'applied', None
+            if action['vm'] in self.failed_vms:
+                status = 'skipped'
+            else:
+                try:
+                    self.apply(action)
+                except Exception as e:
+                    status, error = 'failed', str(e)
+                    with self.lock:
+                        self.failed_vms.add(action['vm'])
+            with self.lock:
+                self.results.append(dict(
+                    vm=action['vm'], action=action['action'],
+                    target=action['target'], status=status, error=error))
+
+    def apply(self, action):
+        client = self.client()
+        kind = action['action']
+        vm_id = self.vm_ids.get(action['vm'])
+        if kind == 'create_vm':
+            result_id = client.create_vm('Vm', data=action['data'])
+            with self.lock:
+                self.vm_ids[action['vm']] = result_id
+        elif kind == 'create_vdisk':
+            result_id = client.create_vdisk(
+                action['repository'], action['sparse'], data=action['data'])
+            with self.lock:
+                self.disk_ids[action['target']] = result_id
+        elif kind == 'map_vdisk':
+            client.map_vdisk(vm_id, data={
+                'vmId': vm_id,
+                'virtualDiskId': self.disk_ids[action['target']],
+                'diskTarget': action['disk_target']
+            })
+        elif kind == 'create_vnic':
+            vnic_id = client.create_vnic(vm_id, data={'name': action['target']})
+            if action['network'] is not None:
+                client.add_vnic_to_network(action['network'], data=vnic_id)
+        elif kind == 'add_vnic_to_network':
+            client.add_vnic_to_network(action['network'], data=action['vnic'])
+        elif kind == 'add_vm':
+            client.add_vm(action['pool'], data=vm_id)
+        elif kind == 'remove_vm':
+            client.remove_vm(action['pool'], data=vm_id)
+        else:
+            getattr(client, kind)(vm_id)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            ovm_user=dict(required=True),
+            ovm_pass=dict(required=True, no_log=True),
+            ovm_host=dict(
+                default='https://127.0.0.1:7002'),
+            topology=dict(type='dict'),
+            src=dict(type='path'),
+            max_parallel=dict(default=4, type='int'),
+            journal=dict(type='path'),
+            job_timeout=dict(type='int'),
+            rollback=dict(default=False, type='bool'),
+        ),
+        mutually_exclusive=[['topology', 'src']],
+        required_one_of=[['topology', 'src']],
+        supports_check_mode=True
+    )
+    if HAS_TRANSPORT is False:
+        module.fail_json(
+            msg="ovm_apply module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    if module.params['src']:
+        try:
+            topology = load_topology(module.params['src'])
+        except Exception as e:
+            module.fail_json(msg="Error reading topology: %s" % e)
+    else:
+        topology = module.params['topology']
+
+    if not isinstance(topology, dict) or not isinstance(topology.get('vms') or [], list):
+        module.fail_json(msg="Invalid topology",
+                         errors=["the topology must be a dict with a vms list"])
+    vms = topology.get('vms') or []
+
+    errors = []
+    for position, spec in enumerate(vms):
+        errors.extend(validate_vm(spec, position))
+    if errors:
+        module.fail_json(msg="Invalid topology", errors=errors)
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    journal = None
+    if module.params['journal']:
+        journal = JobJournal(module.params['journal'])
+
+    # The workers share one connection pool, a client each keeps
+    # their stats and jobs apart for the results
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    tracker = JobTracker()
+    flight = SingleFlight()
+    waiter = JobWaiter()
+    history = None
+    if os.environ.get('OVM_JOB_HISTORY'):
+        history = JobHistory(os.environ['OVM_JOB_HISTORY'])
+    clients = []
+
+    def client_factory():
+        client = OVMRestClient(base_uri, session, journal, tracker,
+                               job_timeout=module.params['job_timeout'],
+                               history=history, flight=flight, waiter=waiter)
+        clients.append(client)
+        return client
+
+    client = client_factory()
+    client.exit_on_cancel(module, module.params['rollback'])
+    snap = Snapshot(
+        client,
+        need_disks=any(spec.get('disks') for spec in vms),
+        need_vnics=any(spec.get('networks') for spec in vms))
+
+    plan = []
+    for spec in vms:
+        vm_errors, actions = plan_vm(spec, snap)
+        errors.extend(vm_errors)
+        plan.extend(actions)
+    if errors:
+        module.fail_json(msg="Topology does not match the manager", errors=errors)
+
+    summary = {'planned': {}, 'applied': 0, 'failed': 0, 'skipped': 0}
+    for action in plan:
+        summary['planned'][action['action']] = summary['planned'].get(action['action'], 0) + 1
+    result = dict(
+        changed=len(plan) > 0,
+        plan=[dict(vm=a['vm'], action=a['action'], target=a['target']) for a in plan],
+        summary=summary)
+
+    if module.check_mode or not plan:
+        result['ovm_stats'] = client.stats
+        module.exit_json(**result)
+
+    results = Applier(client_factory, snap, module.params['max_parallel']).run(plan)
+    client.fail_if_cancelled()
+    waiter.stop()
+    for entry in results:
+        summary[entry['status']] += 1
+    result['results'] = results
+    result['jobs'] = [job for client in clients for job in client.jobs]
+    result['ovm_stats'] = merge_stats([client.stats for client in clients])
+    if summary['failed']:
+        module.fail_json(msg="%d of %d actions failed" % (summary['failed'], len(plan)), **result)
+    if journal is not None:
+        journal.remove()
+
+    module.exit_json(**result)
+
+# pylint: disable=wrong-import-position
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, run_parallel, merge_stats, JobTracker, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_flight import SingleFlight
+from ansible.module_utils.ovm_waiter import JobWaiter
+from ansible.module_utils.ovm_journal import JobJournal
+from ansible.module_utils.ovm_history import JobHistory
+from ansible.module_utils.ovm_index import ObjectIndex, load_name_index
+import json
+import os
+import threading
+if __name__ == '__main__':
+    main()
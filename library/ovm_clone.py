@@ -12,7 +12,7 @@ boilerplate: "Stephan Arts, @stephanarts"
 notes:
     - This module works with OVM 3.3 and 3.4
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     name:
         description:
@@ -52,6 +52,20 @@ options:
               - template
               - vmCloneDefinition
         required: True
+    journal:
+        description:
+            - Path of a local job journal. Every submitted job is
+            - recorded there; when a run fails halfway, running the
+            - task again with the same journal skips the finished jobs
+            - and waits on the ones still running instead of submitting
+            - them again. The names are still looked up on the rerun.
+            - The journal is removed after a successful run.
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for the clone and rename jobs. The clone
+              is aborted when it takes longer.
+        required: False
 '''
 
 EXAMPLES = '''
@@ -72,109 +86,6 @@ RETURN = '''
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-
-    def clone_vm(self, vmId, name, data):
-	response = self.session.put(
-            self.base_uri+'/Vm/'+vmId['value']+'/clone'+
-                '?serverPoolId='+data['serverPoolId']['value']+
-                '&repositoryId='+data['repositoryId']['value']+
-                '&vmCloneDefinitionId='+data['vmCloneDefinitionId']['value']+
-                '&createTemplate=false'
-        )
-        job = response.json()
-        clone_id = self.monitor_job(job['id']['value'])
-        vm = { 'id': self.get('Vm',clone_id['value'])['id'],
-                 'name': name }
-        response = self.session.put(
-            self.base_uri+'/Vm/'+clone_id['value'],
-            data=json.dumps(vm)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-  
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def get_ids(self, object_type):
-        response = self.session.get(
-            self.base_uri+'/'+object_type
-        )
-        return response.json()
-
-
-    def get_disk_maps(self,vmId):
-        response = self.session.get(
-            self.base_uri+'/Vm/'+vmId['value']+'/VmDiskMapping/id'
-        )
-        return response.json()
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -188,19 +99,30 @@ def main():
                  type='dict'),
             serverpool=dict(required=True),
             repository=dict(required=True),
+            journal=dict(
+                required=False,
+                type='path'),
+            job_timeout=dict(
+                required=False,
+                type='int'),
         )
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_create module requires the 'requests' package")
+            msg="ovm_create module requires the 'requests' package with OVM_TRANSPORT=requests")
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
+    journal = None
+    if module.params['journal']:
+        journal = JobJournal(module.params['journal'])
 
     result = {}
     result['name'] = module.params['name']
 
-    client = OVMRestClient(base_uri, session)
+    client = OVMRestClient(base_uri, session, journal,
+                           job_timeout=module.params['job_timeout'])
+    client.exit_on_cancel(module)
 
     repository_id = client.get_id_for_name(
         'Repository',
@@ -228,15 +150,22 @@ def main():
                           'vmCloneDefinitionId': client.get_id_for_name('VmCloneDefinition',module.params['clone_vm']['vmCloneDefinition'])
                       })
               result['changed'] = True
-          except:
+          except Exception:
               module.fail_json(msg="Error cloning vm from template.")
     else:
       result['changed'] = False
 
+    if journal is not None:
+      result['journal'] = journal.summary()
+      journal.remove()
+
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
     module.exit_json(**result)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_journal import JobJournal
 if __name__ == '__main__':
     main()
@@ -11,7 +11,7 @@ boilerplate: "Stephan Arts, @stephanarts"
 notes:
     - This module works with OVM 3.3 and 3.4
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     name:
         description:
@@ -51,6 +51,41 @@ options:
         required: False
         default: "XEN_HVM"
         choices: [ XEN_HVM, XEN_HVM_PV_DRIVERS, XEN_PVM, LDOMS_PVM, UNKNOWN ]
+    journal:
+        description:
+            - Path of a local job journal. Every submitted job is
+            - recorded there; when a run fails halfway, running the
+            - task again with the same journal skips the finished jobs
+            - and waits on the ones still running instead of submitting
+            - them again. The names are still looked up on the rerun.
+            - Disk jobs are recorded by disk name, so a disk placed
+            - automatically is not created again when the rerun would
+            - place it elsewhere.
+            - The journal is removed after a successful run.
+        required: False
+    disks:
+        description:
+            - Virtual disks to create and map to the Virtual Machine, in
+            - order, each with name, description, size in GiB, sparse and
+            - repository. repository is a repository name, a list of
+            - candidate repositories or auto for any repository.
+            - Candidates are chosen by room for the disk, the disks of
+            - this task already being created there and, with
+            - OVM_JOB_HISTORY, how long creating such a disk there took
+            - before, so the disks of one VM spread over the repositories.
+            - Disks in different repositories are created in parallel.
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each VM, disk, mapping and VNIC job. A
+              job still running then is aborted, see rollback.
+        required: False
+    rollback:
+        description:
+            - When the task is cancelled by job_timeout or a signal,
+            - delete the virtual disks and VNICs it created.
+        default: False
+        required: False
 '''
 
 EXAMPLES = '''
@@ -68,139 +103,69 @@ EXAMPLES = '''
     disks:
       - name: example_host_system.1
         description: '...'
-        size: 50G
+        size: 50
         sparse: False
         repository: 'Repo1'
     boot_order:
       - PXE
+
+- name: Create a Virtual Machine, placing its data disks
+  ovm_create:
+    name: 'example_db'
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    serverpool: 'Madrid'
+    repository: 'Repo1'
+    disks:
+      - name: example_db_system
+        size: 50
+        sparse: False
+        repository: 'Repo1'
+      - name: example_db_data1
+        size: 500
+        sparse: False
+        repository: auto
+      - name: example_db_data2
+        size: 500
+        sparse: False
+        repository: ['Repo2', 'Repo3', 'Repo4']
 '''
 
 RETURN = '''
+disk_placement:
+  description:
+    - Maps the name of every disk created to the repository it was
+      created in.
 '''
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
+def place_disks(module, client, disks):
+    """ Map the name of every disk to the id of the repository to create
+    it in. A disk's repository is a name, a list of candidate names or
+    auto for any repository.
     """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-
-    def create_vm(self, object_type, data):
-        response = self.session.post(
-            self.base_uri+'/'+object_type,
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-    
-    def create_vdisk(self, repositoryId, sparse, data):
-        response = self.session.post(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/VirtualDisk?sparse='+str(sparse),
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-   
- 
-    def create_vnic(self, vmId, data):
-        response = self.session.post(
-            self.base_uri+'/Vm/'+vmId['value']+'/VirtualNic',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-    
-    
-    def map_vdisk(self, vmId, data):
-        response = self.session.post(
-            self.base_uri+'/Vm/'+vmId['value']+'/VmDiskMapping',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-  
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def get_ids(self, object_type):
-        response = self.session.get(
-            self.base_uri+'/'+object_type
-        )
-        return response.json()
-
-
-    def get_disk_maps(self,vmId):
-        response = self.session.get(
-            self.base_uri+'/Vm/'+vmId['value']+'/VmDiskMapping/id'
-        )
-        return response.json()
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
+    repositories = client.get_name_index('Repository')
+    placer = None
+    if [disk for disk in disks if disk.get('repository') == 'auto' or isinstance(disk.get('repository'), list)]:
+        placer = Placer(load_capacity(client), repositories, client.history)
+    placement = {}
+    for disk in disks:
+        repository = disk.get('repository')
+        size = disk['size'] * (2**30)
+        if repository == 'auto' or isinstance(repository, list):
+            repository = placer.place(size, disk['sparse'],
+                                      None if repository == 'auto' else repository)
+            if repository is None:
+                module.fail_json(msg="No repository has room for virtual disk %s." % disk['name'])
+        elif repository not in repositories:
+            module.fail_json(msg="Repository %s of virtual disk %s not found." % (repository, disk['name']))
+        elif placer is not None:
+            placer.take(repository, size, disk['sparse'])
+        placement[disk['name']] = repositories[repository]
+    return placement
 
 def main():
-    changed = False
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(
@@ -240,11 +205,20 @@ def main():
             boot_order=dict(
                 required=False,
                 type='list'),
+            journal=dict(
+                required=False,
+                type='path'),
+            job_timeout=dict(
+                required=False,
+                type='int'),
+            rollback=dict(
+                default=False,
+                type='bool'),
         )
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_create module requires the 'requests' package")
+            msg="ovm_create module requires the 'requests' package with OVM_TRANSPORT=requests")
 
     memory = module.params['memory']
     max_memory = module.params['max_memory']
@@ -269,10 +243,16 @@ def main():
 
     result = {}
     result['name'] = module.params['name']
+    result['changed'] = False
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
+    journal = None
+    if module.params['journal']:
+        journal = JobJournal(module.params['journal'])
+    client = OVMRestClient(base_uri, session, journal,
+                           job_timeout=module.params['job_timeout'])
+    client.exit_on_cancel(module, module.params['rollback'])
 
     repository_id = client.get_id_for_name(
         'Repository',
@@ -289,7 +269,7 @@ def main():
     # Create a new vm if it does not exist
     if vm_id is None:
       try:
-          client.create_vm(
+          vm_id = client.create_vm(
                   'Vm',
                   data = {
                       'repositoryId': repository_id,
@@ -301,52 +281,86 @@ def main():
                       'memory': memory,
                       'memoryLimit': max_memory
                   })
-	  result['changed'] = True
-      except:
+          result['changed'] = True
+      except Exception:
           module.fail_json(msg="Error creating vm.")
-    # If disks are defined, create them
+    # If disks are defined, create them and map them to the vm.
+    # A disk that exists but is not mapped yet (left over from a
+    # run that failed halfway) gets mapped as well.
     if module.params['disks']:
-      try:
-        for disk in module.params['disks']:
-          if client.get_id_for_name('VirtualDisk',disk['name']) is None:
-            client.create_vdisk(
-                 client.get_id_for_name('Repository', disk['repository']),
-                 disk['sparse'],
-                 data = {
-                     'name': disk['name'],
-                     'size': disk['size'] * (2**30)
-                 })
-      except:
-          module.fail_json(msg="Error Creating Virtual Disk.")
-      try:
-        client.map_vdisk(
-           client.get_id_for_name('Vm',module.params['name']),
-           data = {
-             'vmId': client.get_id_for_name('Vm',module.params['name']),
-             'virtualDiskId': client.get_id_for_name('VirtualDisk',disk['name']),
-             'diskTarget': len(client.get_disk_maps(client.get_id_for_name('Vm',module.params['name'])))
-           })
-	     result['changed'] = True
-          else:
-	     result['changed'] = False
-      except:
-        module.fail_json(msg="Error Mapping Disk to VM.")
+      disk_maps = client.get_vm_disk_maps(vm_id)
+      mapped = [m['virtualDiskId']['value'] for m in disk_maps if m.get('virtualDiskId')]
+      disk_target = len(disk_maps)
+      disk_ids = {}
+      for disk in module.params['disks']:
+        disk_ids[disk['name']] = client.get_id_for_name('VirtualDisk', disk['name'])
+      new_disks = [disk for disk in module.params['disks'] if disk_ids[disk['name']] is None]
+      if new_disks:
+        placement = place_disks(module, client, new_disks)
+        result['disk_placement'] = dict((name, repository['name'])
+                                        for name, repository in placement.items())
+
+        def create(disk):
+          return client.create_vdisk(
+               placement[disk['name']],
+               disk['sparse'],
+               data = {
+                   'name': disk['name'],
+                   'size': disk['size'] * (2**30)
+               })
+        # Disks in different repositories are created side by side,
+        # one at a time per repository
+        errors = []
+        for disk, disk_id, error in run_parallel_keyed(
+            create, new_disks, lambda disk: [placement[disk['name']]['value']],
+            1, len(new_disks)):
+          if error is not None:
+            errors.append(dict(name=disk['name'], error=str(error)))
+            continue
+          disk_ids[disk['name']] = disk_id
+          result['changed'] = True
+        client.fail_if_cancelled()
+        if errors:
+          module.fail_json(msg="Error Creating Virtual Disk.", errors=errors,
+                           jobs=client.jobs)
+      for disk in module.params['disks']:
+        disk_id = disk_ids[disk['name']]
+        if disk_id['value'] not in mapped:
+          try:
+            client.map_vdisk(
+               vm_id,
+               data = {
+                 'vmId': vm_id,
+                 'virtualDiskId': disk_id,
+                 'diskTarget': disk_target
+               })
+            disk_target += 1
+            result['changed'] = True
+          except Exception:
+            module.fail_json(msg="Error Mapping Disk to VM.")
     # Create and map networks
     if module.params['networks']:
-      try: 
+      try:
         for network in module.params['networks']:
           if client.get_id_for_name('VirtualNic',network['name']) is None:
             client.create_vnic(vm_id,data = { 'name': network['name'] })
             result['changed'] = True
-          else:
-            result['changed'] = False
-      except:  
+      except Exception:
           module.fail_json(msg="Error Creating Virtual NIC.")
 
+    # Everything is done, a later run must not resume from this journal
+    if journal is not None:
+      result['journal'] = journal.summary()
+      journal.remove()
+
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
     module.exit_json(**result)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, run_parallel_keyed, HAS_TRANSPORT
+from ansible.module_utils.ovm_capacity import load_capacity, Placer
+from ansible.module_utils.ovm_journal import JobJournal
 if __name__ == '__main__':
     main()
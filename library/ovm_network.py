@@ -11,7 +11,7 @@ notes:
     - This module works with OVM 3.3 and 3.4
     - Set hosts in your playbook to the OVM Manager server
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     name:
         description:
@@ -31,6 +31,11 @@ options:
         description:
             - The password of the OVM admin-user.
         required: True
+    job_timeout:
+        description:
+            - Seconds to wait for the VNIC and network jobs before they
+              are aborted.
+        required: False
 '''
 
 EXAMPLES = '''
@@ -51,90 +56,6 @@ name:
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-
-    def add_vnic_to_network(self, networkId, data):
-        response = self.session.put(
-            self.base_uri+'/Network/'+networkId['value']+'/addVirtualNic',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-
-    def get_vm_vnic(self,vmName):
-        for vnic in self.session.get(self.base_uri+'/VirtualNic').json():
-          if vmName in vnic['vmId']['name']:
-            return vnic
-
- 
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
     changed = False
     module = AnsibleModule(
@@ -145,15 +66,20 @@ def main():
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
+            job_timeout=dict(
+                required=False,
+                type='int'),
         )
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'])
+    client.exit_on_cancel(module)
 
     vnic = client.get_vm_vnic(
         module.params['name'])
@@ -174,10 +100,10 @@ def main():
     else:
       module.fail_json(msg="Error getting VNIC or Network info. Check network and name in the playbook. They are case sensitive.")
 
-    module.exit_json(changed=changed)
+    module.exit_json(changed=changed, jobs=client.jobs, ovm_stats=client.stats)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
 if __name__ == '__main__':
     main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+DOCUMENTATION = '''
+---
+module: ovm_orphans
+short_description: Find and delete orphaned OVM virtual disks and VNICs
+description:
+  - Finds virtual disks that are not mapped to any VM and VNICs whose VM
+    does not exist. The VirtualDisk, VmDiskMapping, VirtualNic and Vm
+    lists are streamed and compared as sets of ids, only the orphans
+    are kept in memory.
+  - With delete the orphans are deleted, at most max_parallel jobs at a
+    time. An orphan is only deleted when a second scan right before
+    deleting still finds it orphaned, and when it is not recent: the
+    job that made it is no longer running and started at least min_age
+    seconds ago. This keeps disks another task has just created and
+    not mapped yet.
+author: "Court Campbell"
+notes:
+    - This module works with OVM 3.3 and 3.4
+    - Set hosts in your playbook to the OVM Manager server
+    - Disks of VM templates are mapped to the template and are not
+      orphans.
+    - Disks and VNICs have no creation time, their age is that of the
+      job that made them in the manager's job list. An object whose job
+      is no longer listed counts as old. Use exclude for disks that are
+      kept unmapped on purpose.
+requirements:
+    - requests package, only with OVM_TRANSPORT=requests
+options:
+    ovm_user:
+        description:
+            - The OVM admin-user used to connect to the OVM-Manager.
+        required: True
+    ovm_pass:
+        description:
+            - The password of the OVM admin-user.
+        required: True
+    ovm_host:
+        description:
+            - The base-url for Oracle-VM.
+        default: https://127.0.0.1:7002
+        required: False
+    kinds:
+        description:
+            - What to look for, disks and/or vnics.
+        default: [disks, vnics]
+        required: False
+    disk_types:
+        description:
+            - The diskType values of the virtual disks to consider.
+              ISO images (VIRTUAL_CDROM) are never mapped and left out by
+              default.
+        default: [VIRTUAL_DISK]
+        required: False
+    repositories:
+        description:
+            - Only look for disks in these repositories.
+        required: False
+    exclude:
+        description:
+            - Names or shell patterns of disks and VNICs that are never
+              reported or deleted.
+        required: False
+    delete:
+        description:
+            - Delete the orphans found.
+        default: False
+        required: False
+    min_age:
+        description:
+            - Seconds since the start of the job that made an orphan
+              before it is deleted. Only used with delete.
+        default: 3600
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of delete jobs running at the same time.
+        default: 4
+        required: False
+    max_per_repository:
+        description:
+            - Maximum number of disk delete jobs running at the same time
+              in one repository, at least 1.
+        default: 1
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each delete job before it is aborted.
+              Only used with delete.
+        required: False
+'''
+
+EXAMPLES = '''
+- name: Report orphaned disks and VNICs
+  ovm_orphans:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+  register: orphans
+
+- name: Delete the orphaned disks in Repo1
+  ovm_orphans:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    kinds: [disks]
+    repositories: ['Repo1']
+    exclude: ['*_scratch.img']
+    delete: True
+'''
+
+RETURN = '''
+disks:
+  description:
+    - The orphaned virtual disks with id, name, repository and size.
+vnics:
+  description:
+    - The orphaned VNICs with id, name and the name of their missing VM.
+summary:
+  description:
+    - Number of orphaned disks and VNICs, the bytes the disks are given
+      and, with delete, the number kept, deleted and failed.
+kept:
+  description:
+    - With delete, the orphans that were not deleted because they are
+      recent, with kind, id and name.
+deleted:
+  description:
+    - With delete, the disks and VNICs deleted, with kind, id and name.
+errors:
+  description:
+    - With delete, the deletes that failed, with kind, id, name and
+      error.
+'''
+
+WANT_JSON = ''
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            ovm_user=dict(required=True),
+            ovm_pass=dict(required=True, no_log=True),
+            ovm_host=dict(
+                default='https://127.0.0.1:7002'),
+            kinds=dict(default=['disks', 'vnics'], type='list'),
+            disk_types=dict(default=['VIRTUAL_DISK'], type='list'),
+            repositories=dict(type='list'),
+            exclude=dict(default=[], type='list'),
+            delete=dict(default=False, type='bool'),
+            min_age=dict(default=3600, type='int'),
+            max_parallel=dict(default=4, type='int'),
+            max_per_repository=dict(default=1, type='int'),
+            job_timeout=dict(type='int'),
+        ),
+        supports_check_mode=True
+    )
+    if HAS_TRANSPORT is False:
+        module.fail_json(
+            msg="ovm_orphans module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    kinds = module.params['kinds']
+    exclude = module.params['exclude']
+    unknown = [kind for kind in kinds if kind not in ('disks', 'vnics')]
+    if unknown:
+        module.fail_json(msg="Unknown kinds: %s" % ', '.join(unknown))
+    for name in ('max_parallel', 'max_per_repository'):
+        if module.params[name] < 1:
+            module.fail_json(msg="%s must be at least 1" % name)
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module)
+
+    def scan():
+        disks, vnics = [], []
+        if 'disks' in kinds:
+            disks = orphan_disks(client, module.params['disk_types'],
+                                 module.params['repositories'])
+        if 'vnics' in kinds:
+            vnics = orphan_vnics(client)
+        return excluded(disks, exclude), excluded(vnics, exclude)
+
+    def keep_recent(disks, vnics):
+        """ Move the recent orphans to kept, returns the others. """
+        recent = recent_results(client, module.params['min_age'])
+        disks, new_disks = split_recent(disks, recent)
+        vnics, new_vnics = split_recent(vnics, recent)
+        kept = [dict(kind='disk', id=disk['id'], name=disk['name']) for disk in new_disks]
+        kept.extend(dict(kind='vnic', id=vnic['id'], name=vnic['name']) for vnic in new_vnics)
+        result['kept'] = kept
+        summary['kept'] = len(kept)
+        return disks, vnics
+
+    disks, vnics = scan()
+    summary = dict(disks=len(disks), vnics=len(vnics),
+                   disk_bytes=sum(disk['size'] or 0 for disk in disks))
+    result = dict(
+        changed=False,
+        disks=disks,
+        vnics=vnics,
+        summary=summary)
+    if not module.params['delete'] or not disks and not vnics:
+        module.exit_json(ovm_stats=client.stats, **result)
+    if module.check_mode:
+        old_disks, old_vnics = keep_recent(disks, vnics)
+        result['changed'] = len(old_disks) + len(old_vnics) > 0
+        module.exit_json(ovm_stats=client.stats, **result)
+
+    again_disks, again_vnics = scan()
+    old_disks, old_vnics = keep_recent(confirmed(disks, again_disks),
+                                       confirmed(vnics, again_vnics))
+    deleted, errors = delete_orphans(
+        client, old_disks, old_vnics,
+        module.params['max_parallel'], module.params['max_per_repository'])
+    client.fail_if_cancelled()
+    waiter.stop()
+    summary['deleted'] = len(deleted)
+    summary['failed'] = len(errors)
+    result.update(changed=len(deleted) > 0, deleted=deleted, errors=errors,
+                  jobs=client.jobs, ovm_stats=client.stats)
+    if errors:
+        module.fail_json(msg="%d of %d deletes failed" % (len(errors), len(deleted) + len(errors)),
+                         **result)
+
+    module.exit_json(**result)
+
+# pylint: disable=wrong-import-position
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_orphans import orphan_disks, orphan_vnics, confirmed, delete_orphans, \
+    excluded, recent_results, split_recent
+from ansible.module_utils.ovm_waiter import JobWaiter
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ notes:
     - This module works with OVM 3.3 and 3.4
     - Set hosts in your playbook to the OVM Manager server
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     ovm_user:
         description:
@@ -23,148 +23,213 @@ options:
         required: True
     repository:
         description:
-            - The OVM repository for which you want the device file
-        required: True
+            - The OVM repository whose file system you want to refresh
+            - Mutually exclusive with repositories.
+        required: False
+    repositories:
+        description:
+            - A list of OVM repositories, or 'all' for every repository
+            - with a file system. The refresh jobs run in parallel.
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of refresh jobs running at the same time.
+        default: 4
+        required: False
+    skip_if_refreshed_within:
+        description:
+            - Seconds. File systems refreshed less than this long ago are
+            - skipped, going by the lastRefreshTime the manager reports
+            - and by refresh_record.
+        required: False
+    refresh_record:
+        description:
+            - Path of a local JSON file with the time of the last refresh
+            - of every file system done by this module, for
+            - skip_if_refreshed_within.
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each file system refresh before it is
+              aborted.
+        required: False
 '''
 
 EXAMPLES = '''
-- name: get device file for 'Repo 1'
-  ovm_repo_disk_info:
+- name: refresh the file system of 'Repo1'
+  ovm_refresh_repo_fs:
     ovm_user: 'admin'
     ovm_pass: 'password'
     repository: 'Repo1'
-    register: repo_dev_file
 
+- name: refresh every repository not refreshed in the last hour
+  ovm_refresh_repo_fs:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    repositories: all
+    skip_if_refreshed_within: 3600
+    refresh_record: '/var/tmp/ovm_refresh.json'
 '''
 
 RETURN = '''
 name:
   description:
     - The OVM Manager server you ran commands on
+refreshed:
+  description:
+    - The repositories whose file system was refreshed.
+skipped:
+  description:
+    - The repositories skipped because they were refreshed recently.
+missing:
+  description:
+    - Repositories that do not exist or have no file system.
+errors:
+  description:
+    - The refreshes that failed, with repository and error.
 '''
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-    def get_repo_owner(self, repositoryId):
-        response = self.session.get(
-            self.base_uri+'/Repository/'+repositoryId['value']
-        )
-        return response.json()['managerUuid']
-
-
-    def fileSystem_refresh(self, fileSystemId):
-        response = self.session.put(
-            self.base_uri+'/FileSystem/'+fileSystemId+'/refresh'
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
- 
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
+class RefreshRecord:
+    """ When this module last refreshed each file system, in a JSON file. """
+
+    def __init__(self, path):
+        self.path = path
+        self.times = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def last(self, filesystem_id):
+        return self.times.get(filesystem_id)
+
+    def record(self, filesystem_ids, when):
+        with locked_file(self.path):
+            times = self._load()
+            for filesystem_id in filesystem_ids:
+                times[filesystem_id] = when
+            replace_file(self.path, json.dumps(times, separators=(',', ':')))
+            self.times = times
+
+
+def last_refresh(filesystem, record):
+    """ Seconds since the epoch of the last known refresh, or None. """
+    times = []
+    if filesystem is not None and filesystem.get('lastRefreshTime'):
+        # The manager reports milliseconds
+        times.append(filesystem['lastRefreshTime'] / 1000.0)
+    if record is not None and record.last(filesystem['id']['value']) is not None:
+        times.append(record.last(filesystem['id']['value']))
+    return max(times) if times else None
 
 
 def main():
-    changed = False
     module = AnsibleModule(
         argument_spec=dict(
             ovm_user=dict(required=True),
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
-            repository=dict(required=True),
-        )
+            job_timeout=dict(
+                required=False,
+                type='int'),
+            repository=dict(required=False),
+            repositories=dict(required=False, type='raw'),
+            max_parallel=dict(default=4, type='int'),
+            skip_if_refreshed_within=dict(required=False, type='int'),
+            refresh_record=dict(required=False, type='path'),
+        ),
+        mutually_exclusive=[['repository', 'repositories']],
+        required_one_of=[['repository', 'repositories']],
+        supports_check_mode=True
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
-
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
-    session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
-
-    repositoryId = client.get_id_for_name(
-        'Repository',
-        module.params['repository'])
-   
-    repositoryObj = client.get(
-        'Repository',
-        repositoryId['value'])
-
-    if repositoryObj is not None:
-      client.fileSystem_refresh(repositoryObj['fileSystemId']['value'])
-      changed=True
-    else:
-      changed=False
-
-    module.exit_json(changed=changed)
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    wanted = module.params['repositories']
+    if wanted is None:
+      wanted = [module.params['repository']]
+    elif wanted != 'all' and not isinstance(wanted, list):
+      module.fail_json(msg="repositories must be a list or 'all'")
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module)
+
+    # One list request for the repositories, one for the file systems
+    # when their refresh times are needed
+    repositories = ObjectIndex.load(client, 'Repository', ('fileSystemId', ))
+    if wanted == 'all':
+      wanted = [r.name for r in repositories if r.fileSystemId is not None]
+    window = module.params['skip_if_refreshed_within']
+    record = None
+    if module.params['refresh_record']:
+      record = RefreshRecord(module.params['refresh_record'])
+    filesystems = {}
+    if window is not None:
+      for filesystem in client.get_ids('FileSystem', ['lastRefreshTime']):
+        filesystems[filesystem['id']['value']] = filesystem
+
+    now = time.time()
+    targets, skipped, missing = [], [], []
+    for name in wanted:
+      repository = repositories.find(name)
+      if repository is None or repository.fileSystemId is None:
+        missing.append(name)
+        continue
+      filesystem_id = repository.fileSystemId.value
+      if window is not None:
+        last = last_refresh(filesystems.get(filesystem_id, {'id': {'value': filesystem_id}}), record)
+        if last is not None and now - last < window:
+          skipped.append(name)
+          continue
+      targets.append((name, filesystem_id))
+
+    result = dict(
+        changed=len(targets) > 0,
+        refreshed=[name for name, _ in targets],
+        skipped=skipped,
+        missing=missing,
+        errors=[])
+    if module.check_mode or not targets:
+      module.exit_json(ovm_stats=client.stats, **result)
+
+    results = run_parallel(lambda target: client.fileSystem_refresh(target[1]),
+                           targets, module.params['max_parallel'])
+    client.fail_if_cancelled()
+    waiter.stop()
+    done = [target for target, _, error in results if error is None]
+    result['refreshed'] = [name for name, _ in done]
+    result['errors'] = [dict(repository=target[0], error=str(error))
+                        for target, _, error in results if error is not None]
+    if record is not None and done:
+      record.record([filesystem_id for _, filesystem_id in done], time.time())
+    result['changed'] = len(done) > 0
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
+    if result['errors']:
+      module.fail_json(msg="%d of %d refreshes failed" % (len(result['errors']), len(targets)), **result)
+
+    module.exit_json(**result)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, run_parallel, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_history import locked_file, replace_file
+from ansible.module_utils.ovm_index import ObjectIndex
+from ansible.module_utils.ovm_waiter import JobWaiter
 import json
+import time
 if __name__ == '__main__':
     main()
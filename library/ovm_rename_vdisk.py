@@ -10,7 +10,7 @@ Author: "Court Campbell"
 notes:
     - This module works with OVM 3.3 and 3.4
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     vdisk_name:
         description:
@@ -36,6 +36,10 @@ options:
         description:
             - The password of the OVM admin-user.
         required: True
+    job_timeout:
+        description:
+            - Seconds to wait for the rename job before it is aborted.
+        required: False
 '''
 
 EXAMPLES = '''
@@ -57,91 +61,6 @@ name:
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-
-    def get_vm_vdisk(self,vm,vdiskName):
-        for diskmap in self.session.get(self.base_uri+'/Vm/'+vm['value']+'/VmDiskMapping').json():
-          vdisk = self.session.get(self.base_uri+'/VirtualDisk/'+diskmap['virtualDiskId']['value']).json()
-          if vdisk['diskType'] == "VIRTUAL_DISK":
-            if vdiskName in vdisk['name']:
-              return vdisk
-
-
-    def rename_vdisk(self,vdisk,data):
-        response = self.session.put(
-            self.base_uri+'/VirtualDisk/'+vdisk['id']['value'],
-            data=json.dumps(data) 
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value']) 
- 
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
     changed = False
     module = AnsibleModule(
@@ -153,24 +72,29 @@ def main():
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
+            job_timeout=dict(
+                required=False,
+                type='int'),
         )
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'])
+    client.exit_on_cancel(module)
 
     try: 
       vm = client.get_id_for_name('Vm',module.params['vm_name'])
-    except:
+    except Exception:
       module.fail_json(msg="Error getting VM object. Try checking the vm_name, or ovm_host.")
 
     try:
       vdisk = client.get_vm_vdisk(vm,module.params['vdisk_name'])
-    except:
+    except Exception:
       module.fail_json(msg="Error getting VM VirtualDisk.")
     
     result = {}
@@ -180,7 +104,7 @@ def main():
     if vdisk is None:
       try:
         vdisk = client.get_vm_vdisk(vm,module.params['rename'])
-      except:
+      except Exception:
         module.fail_json(msg="Error getting VM VirtualDisk "+module.params['rename']+".")
     if module.params['vdisk_name'] in vdisk['name']:
       vdisk['name'] = module.params['rename']
@@ -191,10 +115,12 @@ def main():
     else:
       module.fail_json(msg="Error renaming VirtualDisk.")
 
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
     module.exit_json(**result)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
 if __name__ == '__main__':
     main()
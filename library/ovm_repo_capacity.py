@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+DOCUMENTATION = '''
+---
+module: ovm_repo_capacity
+short_description: Report the capacity and allocations of OVM repositories
+description:
+  - Returns, per repository, the size and free space of its file system
+    and the total size given to its virtual disks, split into sparse and
+    non-sparse disks. All repositories are read with one Repository, one
+    FileSystem and one VirtualDisk list request.
+  - With disk_size the repositories that can take such a disk are
+    returned as candidates, most headroom first.
+author: "Court Campbell"
+notes:
+    - This module works with OVM 3.3 and 3.4
+    - Set hosts in your playbook to the OVM Manager server
+    - A disk whose on-disk size is below its size counts as sparse. The
+      headroom of a repository is its free space minus what its sparse
+      disks can still grow by.
+requirements:
+    - requests package, only with OVM_TRANSPORT=requests
+options:
+    ovm_user:
+        description:
+            - The OVM admin-user used to connect to the OVM-Manager.
+        required: True
+    ovm_pass:
+        description:
+            - The password of the OVM admin-user.
+        required: True
+    ovm_host:
+        description:
+            - The base-url for Oracle-VM.
+        default: https://127.0.0.1:7002
+        required: False
+    repositories:
+        description:
+            - A list of OVM repositories to report on, or 'all'.
+        default: all
+        required: False
+    cache:
+        description:
+            - Path of a local JSON file the report is kept in and read
+            - from for cache_ttl seconds.
+        required: False
+    cache_ttl:
+        description:
+            - Seconds the report in cache is used for.
+        default: 600
+        required: False
+    refresh:
+        description:
+            - Repositories to recompute even when the cached report is
+            - fresh, from their own disk list, e.g. after creating disks
+            - in them. 'all' reads everything again.
+        required: False
+    disk_size:
+        description:
+            - Size in GiB of a disk to place. The repositories it fits in
+            - are returned as candidates.
+        required: False
+    sparse:
+        description:
+            - Whether the disk to place is sparse. A sparse disk needs the
+            - free space, a non-sparse one the headroom.
+        default: False
+        required: False
+'''
+
+EXAMPLES = '''
+- name: Find repositories for a 200G disk
+  ovm_repo_capacity:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    cache: '/var/tmp/ovm_capacity.json'
+    disk_size: 200
+  register: capacity
+
+- name: Update the report after creating disks in Repo1
+  ovm_repo_capacity:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    cache: '/var/tmp/ovm_capacity.json'
+    refresh: ['Repo1']
+'''
+
+RETURN = '''
+repositories:
+  description:
+    - Maps every repository name to size, free_size, disks,
+      sparse_allocated, sparse_on_disk, non_sparse_allocated and
+      headroom, in bytes. Also set as the ovm_repo_capacity fact.
+candidates:
+  description:
+    - With disk_size, the repositories the disk fits in, most headroom
+      first.
+cached:
+  description:
+    - Whether the report came from cache.
+missing:
+  description:
+    - Repositories that do not exist or have no file system.
+'''
+
+WANT_JSON = ''
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            ovm_user=dict(required=True),
+            ovm_pass=dict(required=True, no_log=True),
+            ovm_host=dict(
+                default='https://127.0.0.1:7002'),
+            repositories=dict(default='all', type='raw'),
+            cache=dict(type='path'),
+            cache_ttl=dict(default=600, type='int'),
+            refresh=dict(type='raw'),
+            disk_size=dict(type='int'),
+            sparse=dict(default=False, type='bool'),
+        ),
+        supports_check_mode=True
+    )
+    if HAS_TRANSPORT is False:
+        module.fail_json(
+            msg="ovm_repo_capacity module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    wanted = module.params['repositories']
+    refresh = module.params['refresh'] or []
+    for name, value in (('repositories', wanted), ('refresh', refresh)):
+        if value != 'all' and not isinstance(value, list):
+            module.fail_json(msg="%s must be a list or 'all'" % name)
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'])
+    client = OVMRestClient(base_uri, session)
+
+    cache, report = None, None
+    key = 'capacity '+base_uri
+    if module.params['cache']:
+        cache = FactCache(module.params['cache'], module.params['cache_ttl'])
+        if refresh != 'all':
+            report = cache.get(key)
+    cached = report is not None
+    missing = []
+    if report is None:
+        report = load_capacity(client)
+    elif refresh:
+        missing = refresh_capacity(client, report, refresh)
+    if cache is not None and (not cached or refresh):
+        cache.put(key, report)
+
+    if wanted == 'all':
+        wanted = sorted(report)
+    selected = dict((name, report[name]) for name in wanted if name in report)
+    missing.extend(name for name in wanted if name not in report and name not in missing)
+
+    result = dict(
+        changed=False,
+        repositories=selected,
+        cached=cached,
+        missing=missing,
+        ansible_facts=dict(ovm_repo_capacity=selected),
+        ovm_stats=client.stats)
+    if module.params['disk_size'] is not None:
+        result['candidates'] = candidates(
+            selected, module.params['disk_size'] * (2**30), module.params['sparse'])
+    module.exit_json(**result)
+
+# pylint: disable=wrong-import-position
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_cache import FactCache
+from ansible.module_utils.ovm_capacity import load_capacity, refresh_capacity, candidates
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ notes:
     - This module works with OVM 3.3 and 3.4
     - Set hosts in your playbook to the OVM Manager server
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     ovm_user:
         description:
@@ -24,7 +24,26 @@ options:
     repository:
         description:
             - The OVM repository for which you want the device file
-        required: True
+            - Mutually exclusive with repositories. Without cache only
+            - this repository and its file system are read.
+        required: False
+    repositories:
+        description:
+            - A list of OVM repositories, or 'all'. Their path, size and
+            - free space are returned in repositories and as the
+            - ovm_repositories fact. All repositories and file systems
+            - are read with one request each and joined.
+        required: False
+    cache:
+        description:
+            - Path of a local JSON file the repository facts are kept in
+            - and read from for cache_ttl seconds.
+        required: False
+    cache_ttl:
+        description:
+            - Seconds the facts in cache are used for.
+        default: 300
+        required: False
 '''
 
 EXAMPLES = '''
@@ -35,142 +54,139 @@ EXAMPLES = '''
     repository: 'Repo1'
     register: repo_dev_file
 
+- name: get path, size and free space of every repository
+  ovm_repo_disk_info:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    repositories: all
+    cache: '/var/tmp/ovm_repositories.json'
+
+- debug:
+    msg: "{{ ovm_repositories['Repo1'].path }}"
 '''
 
 RETURN = '''
 name:
   description:
     - The OVM Manager server you ran commands on
+stdout:
+  description:
+    - The device file of repository.
+repositories:
+  description:
+    - With repositories, maps every repository name to its path,
+      size and free_size in bytes and its file system. Also set as
+      the ovm_repositories fact.
+missing:
+  description:
+    - Repositories that do not exist or have no file system.
 '''
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-    def get_repo_owner(self, repositoryId):
-        response = self.session.get(
-            self.base_uri+'/Repository/'+repositoryId['value']
-        )
-        return response.json()['managerUuid']
-
-
-    def releaseownership_repo(self, repositoryId):
-        response = self.session.put(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/releaseOwnership'
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
- 
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
+def repository_fact(client, name):
+    """ Path, size and free space of one repository, looked up by id
+    with three small requests. None when it is not found or has no
+    file system. """
+    repository_id = client.get_id_for_name('Repository', name)
+    if repository_id is None:
+      return None
+    repository = client.get('Repository', repository_id['value'])
+    if repository.get('fileSystemId') is None:
+      return None
+    filesystem = client.get('FileSystem', repository['fileSystemId']['value'])
+    return dict(
+        path=filesystem.get('path'),
+        size=filesystem.get('size'),
+        free_size=filesystem.get('freeSize'),
+        filesystem=filesystem.get('name'))
+
+
+def repository_facts(client):
+    """ Path, size and free space of every repository, joined locally
+    from one Repository and one FileSystem list. """
+    repositories = ObjectIndex.load(client, 'Repository', ('fileSystemId', ))
+    filesystems = ObjectIndex.load(client, 'FileSystem', ('path', 'size', 'freeSize'))
+    facts = {}
+    for repository in repositories:
+      if repository.fileSystemId is None:
+        continue
+      filesystem = filesystems.get(repository.fileSystemId.value)
+      if filesystem is None:
+        continue
+      facts[repository.name] = dict(
+          path=filesystem.path,
+          size=filesystem.size,
+          free_size=filesystem.freeSize,
+          filesystem=filesystem.name)
+    return facts
 
 
 def main():
-    changed = False
     module = AnsibleModule(
         argument_spec=dict(
             ovm_user=dict(required=True),
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
-            repository=dict(required=True),
-        )
+            repository=dict(required=False),
+            repositories=dict(required=False, type='raw'),
+            cache=dict(required=False, type='path'),
+            cache_ttl=dict(default=300, type='int'),
+        ),
+        mutually_exclusive=[['repository', 'repositories']],
+        required_one_of=[['repository', 'repositories']],
+        supports_check_mode=True
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    wanted = module.params['repositories']
+    if wanted is not None and wanted != 'all' and not isinstance(wanted, list):
+      module.fail_json(msg="repositories must be a list or 'all'")
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
     client = OVMRestClient(base_uri, session)
 
-    repositoryId = client.get_id_for_name(
-        'Repository',
-        module.params['repository'])
-   
-    repositoryObj = client.get(
-        'Repository',
-        repositoryId['value'])
-
-    fileSystemObj = client.get(
-        'FileSystem',
-        repositoryObj['fileSystemId']['value'])
-    
-    if repositoryId is not None:
-      if fileSystemObj is not None:
-        result = dict(
-            stdout=fileSystemObj['path'],
-            rc=0,
-            changed=True
-        )
-
-    module.exit_json(**result)
+    cache, facts = None, None
+    if module.params['cache']:
+      cache = FactCache(module.params['cache'], module.params['cache_ttl'])
+      facts = cache.get('repositories '+base_uri)
+    if facts is None and wanted is None and cache is None:
+      # One repository is cheaper to look up than to join both lists
+      facts = {}
+      repository = repository_fact(client, module.params['repository'])
+      if repository is not None:
+        facts[module.params['repository']] = repository
+    if facts is None:
+      facts = repository_facts(client)
+      if cache is not None:
+        cache.put('repositories '+base_uri, facts)
+
+    if wanted is None:
+      repository = facts.get(module.params['repository'])
+      if repository is None:
+        module.fail_json(msg="Repository %s not found or without a file system" % module.params['repository'],
+                         ovm_stats=client.stats)
+      module.exit_json(stdout=repository['path'], rc=0, changed=True,
+                       ovm_stats=client.stats)
+
+    if wanted == 'all':
+      wanted = sorted(facts)
+    selected = dict((name, facts[name]) for name in wanted if name in facts)
+    module.exit_json(
+        changed=False,
+        repositories=selected,
+        missing=[name for name in wanted if name not in facts],
+        ansible_facts=dict(ovm_repositories=selected),
+        ovm_stats=client.stats)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_cache import FactCache
+from ansible.module_utils.ovm_index import ObjectIndex
 if __name__ == '__main__':
     main()
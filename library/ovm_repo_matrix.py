@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+DOCUMENTATION = '''
+---
+module: ovm_repo_matrix
+short_description: Reconcile which OVM repositories are presented to which servers
+description:
+  - Takes the servers and server pools every repository should be
+    presented to. All Repository, Server and ServerPool objects are read
+    once, the present and unpresent jobs needed are worked out per
+    repository and run in parallel, throttled per server.
+  - Repositories not in the mapping are left alone.
+  - When a repository, server or server pool in the mapping does not
+    exist the module fails before running any job, and returns the
+    plan for the repositories that could be resolved.
+  - In check mode only the diff is returned.
+author: "Court Campbell"
+notes:
+    - This module works with OVM 3.3 and 3.4
+    - Set hosts in your playbook to the OVM Manager server
+requirements:
+    - requests package, only with OVM_TRANSPORT=requests
+options:
+    ovm_user:
+        description:
+            - The OVM admin-user used to connect to the OVM-Manager.
+        required: True
+    ovm_pass:
+        description:
+            - The password of the OVM admin-user.
+        required: True
+    ovm_host:
+        description:
+            - The base-url for Oracle-VM.
+        default: https://127.0.0.1:7002
+        required: False
+    presentation:
+        description:
+            - Maps a repository name to the servers it should be
+            - presented to, either a list of server names or a dict
+            - with servers and server_pools lists. The servers of a
+            - server pool count as listed.
+        required: True
+    exclusive:
+        description:
+            - Unpresent the repositories from the servers they are not
+            - listed for.
+        default: True
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of present/unpresent jobs running at the
+            - same time.
+        default: 8
+        required: False
+    max_per_server:
+        description:
+            - Maximum number of present/unpresent jobs running at the
+            - same time on one server, at least 1.
+        default: 1
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each present or unpresent job before
+              it is aborted.
+        required: False
+'''
+
+EXAMPLES = '''
+- name: Present the repositories of both pools
+  ovm_repo_matrix:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    presentation:
+      Repo1:
+        server_pools: ['Pool1', 'Pool2']
+      Repo2:
+        server_pools: ['Pool1']
+        servers: ['backup1']
+      Scratch: ['build1', 'build2']
+'''
+
+RETURN = '''
+diff:
+  description:
+    - Per repository that needs changes, the servers it gets
+      presented to (present) and unpresented from (unpresent).
+summary:
+  description:
+    - Number of planned present and unpresent jobs and the number of
+      applied and failed ones.
+errors:
+  description:
+    - The jobs that failed, with action, repository, server and error.
+missing:
+  description:
+    - Repositories, servers and server pools that do not exist on the
+      manager.
+'''
+
+WANT_JSON = ''
+
+def normalize(presentation):
+    """ Turn every mapping value into a dict with servers and
+    server_pools, returns (mapping, errors).
+    """
+    mapping, errors = {}, []
+    for repository, target in presentation.items():
+        if isinstance(target, list):
+            target = dict(servers=target)
+        if not isinstance(target, dict) or set(target) - set(['servers', 'server_pools']):
+            errors.append("%s: expected a list of servers or a dict with "
+                          "servers and server_pools" % repository)
+            continue
+        mapping[repository] = target
+    return mapping, errors
+
+
+def diff_report(actions):
+    diff = {}
+    for action in actions:
+        entry = diff.setdefault(action['repository'], {'present': [], 'unpresent': []})
+        entry[action['action']].append(action['server'])
+    return diff
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            ovm_user=dict(required=True),
+            ovm_pass=dict(required=True, no_log=True),
+            ovm_host=dict(
+                default='https://127.0.0.1:7002'),
+            presentation=dict(required=True, type='dict'),
+            exclusive=dict(default=True, type='bool'),
+            max_parallel=dict(default=8, type='int'),
+            max_per_server=dict(default=1, type='int'),
+            job_timeout=dict(type='int'),
+        ),
+        supports_check_mode=True
+    )
+    if HAS_TRANSPORT is False:
+        module.fail_json(
+            msg="ovm_repo_matrix module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    for name in ('max_parallel', 'max_per_server'):
+        if module.params[name] < 1:
+            module.fail_json(msg="%s must be at least 1" % name)
+
+    mapping, errors = normalize(module.params['presentation'])
+    if errors:
+        module.fail_json(msg="Invalid presentation", errors=errors)
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module)
+
+    presentation = Presentation(client)
+    pools = load_name_index(client, 'ServerPool')
+    actions, missing = presentation.reconcile(
+        mapping, pools, module.params['exclusive'])
+
+    summary = {'present': 0, 'unpresent': 0, 'applied': 0, 'failed': 0}
+    for action in actions:
+        summary[action['action']] += 1
+    result = dict(
+        changed=len(actions) > 0,
+        diff=diff_report(actions),
+        summary=summary,
+        missing=missing,
+        errors=[])
+    if missing:
+        result['changed'] = False
+        module.fail_json(msg="%d repositories, servers or server pools not found" % len(missing),
+                         ovm_stats=client.stats, **result)
+    if module.check_mode or not actions:
+        module.exit_json(ovm_stats=client.stats, **result)
+
+    results = run_actions(client, actions, module.params['max_parallel'],
+                          module.params['max_per_server'])
+    client.fail_if_cancelled()
+    waiter.stop()
+    for entry in results:
+        summary[entry['status']] += 1
+        if entry['status'] == 'failed':
+            result['errors'].append(entry)
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
+    if summary['failed']:
+        module.fail_json(msg="%d of %d jobs failed" % (summary['failed'], len(actions)), **result)
+
+    module.exit_json(**result)
+
+# pylint: disable=wrong-import-position
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_index import load_name_index
+from ansible.module_utils.ovm_present import Presentation, run_actions
+from ansible.module_utils.ovm_waiter import JobWaiter
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+DOCUMENTATION = '''
+---
+module: ovm_repo_onboard
+short_description: Take ownership of, present and refresh OVM repositories in one task
+description:
+  - Brings repositories online. Every repository is owned by the
+    manager, presented to the servers and refreshed, as a pipeline. The
+    presents of a repository start as soon as its ownership job is done
+    and run in parallel, throttled per server. Its file system is
+    refreshed once, after the last present.
+  - All Repository, Server and ServerPool objects are read once and
+    used by every stage.
+  - When a repository, server or server pool does not exist the module
+    fails before running any job, and returns the plan for the names
+    that could be resolved.
+  - In check mode only the plan is returned.
+author: "Court Campbell"
+notes:
+    - This module works with OVM 3.3 and 3.4
+    - Set hosts in your playbook to the OVM Manager server
+    - Repositories that were already owned and presented are not
+      refreshed.
+requirements:
+    - requests package, only with OVM_TRANSPORT=requests
+options:
+    ovm_user:
+        description:
+            - The OVM admin-user used to connect to the OVM-Manager.
+        required: True
+    ovm_pass:
+        description:
+            - The password of the OVM admin-user.
+        required: True
+    ovm_host:
+        description:
+            - The base-url for Oracle-VM.
+        default: https://127.0.0.1:7002
+        required: False
+    ovm_manager:
+        description:
+            - The ovm manager that takes ownership. When no manager has
+              this name the only manager is used.
+        default: OVM Manager
+        required: False
+    repositories:
+        description:
+            - The OVM repositories to bring online.
+        required: True
+    serverpool:
+        description:
+            - The serverpool of which the Repository's OCFS2 FileSystem is
+              associated. Required when a repository is not owned yet.
+        required: False
+    servers:
+        description:
+            - The servers to present the repositories to.
+        required: False
+    server_pools:
+        description:
+            - Server pools whose servers the repositories are presented to.
+        required: False
+    ownership:
+        description:
+            - Take ownership of the repositories the manager does not own.
+        default: True
+        required: False
+    refresh:
+        description:
+            - Refresh the file system of every repository that was taken
+              or presented.
+        default: True
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of jobs running at the same time.
+        default: 8
+        required: False
+    max_per_server:
+        description:
+            - Maximum number of present jobs running at the same time on
+              one server, at least 1.
+        default: 1
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each ownership, present and refresh
+              job before it is aborted.
+        required: False
+'''
+
+EXAMPLES = '''
+- name: Bring the migrated repositories online in Pool1
+  ovm_repo_onboard:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    serverpool: 'Pool1'
+    server_pools: ['Pool1']
+    repositories: ['Repo1', 'Repo2', 'Repo3']
+'''
+
+RETURN = '''
+plan:
+  description:
+    - Per repository whether ownership is taken, the servers it gets
+      presented to and whether its file system is refreshed.
+results:
+  description:
+    - Per repository ownership (applied, unchanged or failed), the
+      servers it was presented to, whether it was refreshed and the
+      errors per stage. Not returned in check mode.
+stages:
+  description:
+    - Per stage (ownership, presentation, refresh) the number of jobs
+      and failures, when the first job started and the last ended, in
+      seconds into the run, and the summed job seconds.
+missing:
+  description:
+    - Repositories, servers and server pools that do not exist on the
+      manager.
+'''
+
+WANT_JSON = ''
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            ovm_user=dict(required=True),
+            ovm_pass=dict(required=True, no_log=True),
+            ovm_host=dict(
+                default='https://127.0.0.1:7002'),
+            ovm_manager=dict(default='OVM Manager'),
+            repositories=dict(required=True, type='list'),
+            serverpool=dict(required=False),
+            servers=dict(default=[], type='list'),
+            server_pools=dict(default=[], type='list'),
+            ownership=dict(default=True, type='bool'),
+            refresh=dict(default=True, type='bool'),
+            max_parallel=dict(default=8, type='int'),
+            max_per_server=dict(default=1, type='int'),
+            job_timeout=dict(type='int'),
+        ),
+        supports_check_mode=True
+    )
+    if HAS_TRANSPORT is False:
+        module.fail_json(
+            msg="ovm_repo_onboard module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    for name in ('max_parallel', 'max_per_server'):
+        if module.params[name] < 1:
+            module.fail_json(msg="%s must be at least 1" % name)
+
+    names = module.params['repositories']
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module)
+
+    # One read of the repositories (with owner and file system) and
+    # servers for all stages
+    presentation = Presentation(client)
+    missing = []
+    servers = set(module.params['servers'])
+    pools = {}
+    if module.params['server_pools'] or module.params['serverpool'] is not None:
+        pools = load_name_index(client, 'ServerPool')
+    if module.params['server_pools']:
+        members = presentation.pool_members()
+        for pool in module.params['server_pools']:
+            if pool not in pools:
+                missing.append(dict(type='server_pool', name=pool))
+            servers |= members.get(pool, set())
+
+    ownership = {}
+    if module.params['ownership']:
+        manager = find_manager(client, module.params['ovm_manager'])
+        if manager is None:
+            module.fail_json(msg="OVM Manager %s not found" % module.params['ovm_manager'])
+        serverpool = None
+        if module.params['serverpool'] is not None:
+            serverpool = pools.get(module.params['serverpool'])
+            if serverpool is None:
+                module.fail_json(msg="ServerPool %s not found" % module.params['serverpool'])
+        actions, _, _ = plan_ownership(presentation.repositories, names, OWNED,
+                                       manager, serverpool)
+        if actions and serverpool is None:
+            module.fail_json(msg="serverpool is required to take ownership of %s"
+                             % ', '.join(action['repository'] for action in actions))
+        ownership = dict((action['repository'], action) for action in actions)
+
+    presents, not_found = presentation.plan(
+        wanted=[(name, server) for name in names for server in sorted(servers)])
+    for entry in not_found:
+        if entry not in missing:
+            missing.append(entry)
+    for name in names:
+        entry = dict(type='repository', name=name)
+        if presentation.repositories.find(name) is None and entry not in missing:
+            missing.append(entry)
+
+    plans = []
+    for name in names:
+        repository = presentation.repositories.find(name)
+        if repository is None:
+            continue
+        filesystem = None
+        if module.params['refresh'] and repository.fileSystemId is not None:
+            filesystem = repository.fileSystemId.value
+        repository_presents = [action for action in presents if action['repository'] == name]
+        if name not in ownership and not repository_presents:
+            continue
+        plans.append(dict(repository=name, ownership=ownership.get(name),
+                          presents=repository_presents, filesystem=filesystem))
+
+    result = dict(
+        changed=len(plans) > 0,
+        plan=[dict(repository=plan['repository'],
+                   ownership=plan['ownership'] is not None,
+                   present=[action['server'] for action in plan['presents']],
+                   refresh=plan['filesystem'] is not None)
+              for plan in plans],
+        missing=missing)
+    if missing:
+        result['changed'] = False
+        module.fail_json(msg="%d repositories, servers or server pools not found" % len(missing),
+                         ovm_stats=client.stats, **result)
+    if module.check_mode or not plans:
+        module.exit_json(ovm_stats=client.stats, **result)
+
+    onboarding = Onboarding(client, plans, module.params['max_parallel'],
+                            module.params['max_per_server'])
+    result['results'] = onboarding.run()
+    client.fail_if_cancelled()
+    waiter.stop()
+    result['stages'] = onboarding.timing()
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
+    failed = sum(timing['failed'] for timing in result['stages'].values())
+    if failed:
+        jobs = sum(timing['jobs'] for timing in result['stages'].values())
+        module.fail_json(msg="%d of %d jobs failed" % (failed, jobs), **result)
+
+    module.exit_json(**result)
+
+# pylint: disable=wrong-import-position
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_index import load_name_index
+from ansible.module_utils.ovm_onboard import Onboarding
+from ansible.module_utils.ovm_ownership import OWNED, find_manager, plan_ownership
+from ansible.module_utils.ovm_present import Presentation
+from ansible.module_utils.ovm_waiter import JobWaiter
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ notes:
     - This module works with OVM 3.3 and 3.4
     - Set hosts in your playbook to the OVM Manager server
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     serverpool:
         description:
@@ -20,7 +20,8 @@ options:
               before you can take ownership
     ovm_manager:
         description:
-            - The ovm manager that will take/release ownership
+            - The ovm manager that will take/release ownership. When no
+              manager has this name the only manager is used.
     ovm_user:
         description:
             - The OVM admin-user used to connect to the OVM-Manager.
@@ -32,7 +33,25 @@ options:
     repository:
         description:
             - The OVM repository you want to take/release ownership of
-        required: True
+        required: False
+    repositories:
+        description:
+            - A list of OVM repositories to take/release ownership of,
+              instead of repository. The manager and server pool are
+              looked up once and the owners of all repositories read
+              with one request.
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of takeOwnership/releaseOwnership jobs
+              running at the same time.
+        default: 8
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each takeOwnership or releaseOwnership
+              job before it is aborted.
+        required: False
 '''
 
 EXAMPLES = '''
@@ -43,109 +62,37 @@ EXAMPLES = '''
     repository: 'Repo1'
     state: 'released'
 
+- name: Take ownership of the migrated repositories
+  ovm_repo_ownership:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    ovm_manager: 'OVM Manager'
+    serverpool: 'Pool1'
+    repositories: ['Repo1', 'Repo2', 'Repo3']
+    max_parallel: 4
+    state: 'owned'
 '''
 
 RETURN = '''
-name:
+plan:
+  description:
+    - The repositories whose ownership changes, with state and the
+      previous owner.
+results:
   description:
-    - The OVM Manager server you ran commands on
+    - Per planned repository the status (applied or failed) and the
+      error if any. Not returned in check mode.
+unchanged:
+  description:
+    - Repositories already in the requested state.
+missing:
+  description:
+    - Repositories that do not exist on the manager.
 '''
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-    def get_repo_owner(self, repositoryId):
-        response = self.session.get(
-            self.base_uri+'/Repository/'+repositoryId['value']
-        )
-        return response.json()['managerUuid']
-
-
-    def releaseownership_repo(self, repositoryId):
-        response = self.session.put(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/releaseOwnership'
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
- 
-    def takeownership_repo(self, repositoryId, serverpoolId):
-        response = self.session.put(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/takeOwnership?serverPoolId='+serverpoolId['value']
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-    
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
-    changed = False
     module = AnsibleModule(
         argument_spec=dict(
             serverpool=dict(required=False),
@@ -156,48 +103,76 @@ def main():
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
-            repository=dict(required=True),
-        )
+            job_timeout=dict(
+                required=False,
+                type='int'),
+            repository=dict(required=False),
+            repositories=dict(required=False, type='list'),
+            max_parallel=dict(default=8, type='int'),
+        ),
+        mutually_exclusive=[['repository', 'repositories']],
+        required_one_of=[['repository', 'repositories']],
+        supports_check_mode=True
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
-
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
-    session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
-
-    repositoryId = client.get_id_for_name(
-        'Repository',
-        module.params['repository'])
-    
-    ovm_manager = client.get_id_for_name(
-        'Manager',
-        'OVM Manager')
-     
-    if repositoryId is not None and ovm_manager is not None:
-      repo_owner = client.get_repo_owner(repositoryId)
-      if module.params['state'] == 'owned':
-        if ovm_manager['value'] == repo_owner:
-          changed = False
-        else:
-          if module.params['serverpool'] is not None:
-            serverpoolId = client.get_id_for_name(
-              'ServerPool',
-              module.params['serverpool'])
-          client.takeownership_repo(repositoryId, serverpoolId)
-          changed = True
-      if module.params['state'] == 'released':
-        if repo_owner is None:
-          changed = False
-        else:
-          client.releaseownership_repo(repositoryId)  
-          changed = True
-
-    module.exit_json(changed=changed)
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    state = module.params['state']
+    names = module.params['repositories'] or [module.params['repository']]
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module)
+
+    # The manager and pool once, the owners of all repositories from
+    # one list request
+    ovm_manager = find_manager(client, module.params['ovm_manager'])
+    if ovm_manager is None:
+      module.fail_json(msg="OVM Manager %s not found" % module.params['ovm_manager'])
+    serverpoolId = None
+    if state == 'owned' and module.params['serverpool'] is not None:
+      serverpoolId = client.get_id_for_name(
+        'ServerPool',
+        module.params['serverpool'])
+      if serverpoolId is None:
+        module.fail_json(msg="ServerPool %s not found" % module.params['serverpool'])
+    repositories = ObjectIndex.load(client, 'Repository', ('managerUuid', ))
+    actions, missing, unchanged = plan_ownership(
+      repositories, names, state, ovm_manager, serverpoolId)
+    if actions and state == 'owned' and serverpoolId is None:
+      module.fail_json(msg="serverpool is required to take ownership of %s"
+                       % ', '.join(action['repository'] for action in actions))
+
+    result = dict(
+        changed=len(actions) > 0,
+        plan=[describe(action) for action in actions],
+        unchanged=unchanged,
+        missing=missing)
+    if module.check_mode or not actions:
+      module.exit_json(ovm_stats=client.stats, **result)
+
+    result['results'] = run_ownership(client, actions, module.params['max_parallel'])
+    client.fail_if_cancelled()
+    waiter.stop()
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
+    failed = [r for r in result['results'] if r['status'] == 'failed']
+    if failed:
+      module.fail_json(msg="%d of %d jobs failed" % (len(failed), len(actions)), **result)
+
+    module.exit_json(**result)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_index import ObjectIndex
+from ansible.module_utils.ovm_ownership import find_manager, plan_ownership, describe, run_ownership
+from ansible.module_utils.ovm_waiter import JobWaiter
 if __name__ == '__main__':
     main()
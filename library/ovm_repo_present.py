@@ -11,12 +11,18 @@ notes:
     - This module works with OVM 3.3 and 3.4
     - Set hosts in your playbook to the OVM Manager server
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     server:
         description:
             - The OVM server to which you want to present/unpresent the repo
-        required: True
+            - Mutually exclusive with servers.
+        required: False
+    servers:
+        description:
+            - A list of OVM servers to present/unpresent the repositories
+            - to/from. Every repository is handled on every server.
+        required: False
     ovm_user:
         description:
             - The OVM admin-user used to connect to the OVM-Manager.
@@ -28,7 +34,29 @@ options:
     repository:
         description:
             - The OVM repository you want to present/unpresent
-        required: True
+            - Mutually exclusive with repositories.
+        required: False
+    repositories:
+        description:
+            - A list of OVM repositories to present/unpresent.
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of present/unpresent jobs running at the
+            - same time.
+        default: 8
+        required: False
+    max_per_server:
+        description:
+            - Maximum number of present/unpresent jobs running at the
+            - same time on one server, at least 1.
+        default: 1
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each present or unpresent job before
+              it is aborted.
+        required: False
 '''
 
 EXAMPLES = '''
@@ -40,173 +68,114 @@ EXAMPLES = '''
     repository: 'Repo1'
     state: 'presented'
 
-- name: Present 'Repo1' to many hosts
+- name: Present 'Repo1' and 'Repo2' to many hosts
   ovm_repo_present:
-    server: {{ item }}
+    servers:
+      - "host 1"
+      - "host 2"
+      - "host 3"
     ovm_user: 'admin'
     ovm_pass: 'password'
-    repository: 'Repo1'
+    repositories:
+      - 'Repo1'
+      - 'Repo2'
     state: 'presented'
-  with_items:
-    - "host 1"
-    - "host 2"
-    - "host 3"
+    max_parallel: 16
 '''
 
 RETURN = '''
 name:
   description:
     - The OVM Manager server you ran commands on
+plan:
+  description:
+    - The present/unpresent jobs needed, one dict per job with
+      action, repository and server.
+results:
+  description:
+    - The outcome of every job in plan when not in check mode.
+missing:
+  description:
+    - Repositories and servers that do not exist on the manager,
+      they are skipped.
 '''
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-
-    def get_presented_servers(self, repositoryId):
-        presented_servers = []
-        response = self.session.get(
-            self.base_uri+'/Repository/'+repositoryId['value']
-        )
-        for server in response.json()['presentedServerIds']:
-            presented_servers.append(server['name'])
-        return presented_servers
-
-    
-    def unpresent_repo(self, repositoryId, data):
-        response = self.session.put(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/unpresent',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
- 
-    def present_repo(self, repositoryId, data):
-        response = self.session.put(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/present',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-    
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
-    changed = False
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(
                 choices=['presented', 'unpresented'],required=True),
-            server=dict(required=True),
+            server=dict(required=False),
+            servers=dict(required=False, type='list'),
             ovm_user=dict(required=True),
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
-            repository=dict(required=True),
-        )
+            job_timeout=dict(
+                required=False,
+                type='int'),
+            repository=dict(required=False),
+            repositories=dict(required=False, type='list'),
+            max_parallel=dict(default=8, type='int'),
+            max_per_server=dict(default=1, type='int'),
+        ),
+        mutually_exclusive=[['server', 'servers'], ['repository', 'repositories']],
+        required_one_of=[['server', 'servers'], ['repository', 'repositories']],
+        supports_check_mode=True
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
-
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
-    session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
-
-    serverId = client.get_id_for_name(
-        'Server',
-        module.params['server'])
-
-    repositoryId = client.get_id_for_name(
-        'Repository',
-        module.params['repository'])
-
-    if serverId is not None and repositoryId is not None:
-      presented_servers = client.get_presented_servers(repositoryId)
-      if module.params['state'] == 'presented':
-        if module.params['server'] in presented_servers:
-          changed = False
-        else:
-          client.present_repo(repositoryId, data = serverId)
-          changed = True
-      if module.params['state'] == 'unpresented':
-        if module.params['server'] not in presented_servers:
-          changed = False
-        else:
-          client.unpresent_repo(repositoryId, data = serverId)  
-          changed = True
-
-    module.exit_json(changed=changed)
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    for name in ('max_parallel', 'max_per_server'):
+        if module.params[name] < 1:
+            module.fail_json(msg="%s must be at least 1" % name)
+
+    servers = module.params['servers'] or [module.params['server']]
+    repositories = module.params['repositories'] or [module.params['repository']]
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module)
+
+    # Every repository against every server, from one read of each
+    presentation = Presentation(client)
+    pairs = [(repository, server) for repository in repositories for server in servers]
+    if module.params['state'] == 'presented':
+      actions, missing = presentation.plan(wanted=pairs)
+    else:
+      actions, missing = presentation.plan(unwanted=pairs)
+
+    result = dict(
+        changed=len(actions) > 0,
+        plan=[describe(action) for action in actions],
+        missing=missing)
+    if module.check_mode or not actions:
+      module.exit_json(ovm_stats=client.stats, **result)
+
+    result['results'] = run_actions(client, actions, module.params['max_parallel'],
+                                    module.params['max_per_server'])
+    client.fail_if_cancelled()
+    waiter.stop()
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
+    failed = [r for r in result['results'] if r['status'] == 'failed']
+    if failed:
+      module.fail_json(msg="%d of %d jobs failed" % (len(failed), len(actions)), **result)
+
+    module.exit_json(**result)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_present import Presentation, describe, run_actions
+from ansible.module_utils.ovm_waiter import JobWaiter
 if __name__ == '__main__':
     main()
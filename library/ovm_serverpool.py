@@ -11,7 +11,7 @@ notes:
     - This module works with OVM 3.3 and 3.4
     - Set hosts in your playbook to the OVM Manager server
 requirements:
-    - requests package
+    - requests package, only with OVM_TRANSPORT=requests
 options:
     name:
         description:
@@ -33,6 +33,11 @@ options:
 	description:
             - present or absent
         required: True
+    job_timeout:
+        description:
+            - Seconds to wait for the addVm or removeVm job before it is
+              aborted.
+        required: False
 '''
 
 EXAMPLES = '''
@@ -54,93 +59,6 @@ name:
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-
-    def add_vm(self, serverpoolId, data):
-        response = self.session.put(
-            self.base_uri+'/ServerPool/'+serverpoolId['value']+'/addVm',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
- 
-    def remove_vm(self, serverpoolId, data):
-        response = self.session.put(
-            self.base_uri+'/ServerPool/'+serverpoolId['value']+'/removeVm',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-    
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
     changed = False
     module = AnsibleModule(
@@ -152,16 +70,21 @@ def main():
             ovm_pass=dict(required=True, no_log=True),
             ovm_host=dict(
                 default='https://127.0.0.1:7002'),
+            job_timeout=dict(
+                required=False,
+                type='int'),
             name=dict(required=True),
         )
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_cmnds module requires the 'requests' package")
+            msg="ovm_cmnds module requires the 'requests' package with OVM_TRANSPORT=requests")
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'])
+    client.exit_on_cancel(module)
 
     serverpoolId = client.get_id_for_name(
         'ServerPool',
@@ -180,7 +103,7 @@ def main():
         if vm['serverPoolId'] is None:
           client.add_vm(serverpoolId, data = vm['id'])
           changed = True
-          module.exit_json(changed=changed)
+          module.exit_json(changed=changed, jobs=client.jobs, ovm_stats=client.stats)
         if vm['serverPoolId']['name'] == module.params['serverpool']:
           changed = False
       if module.params['state'] == 'absent':
@@ -192,10 +115,10 @@ def main():
     else:
       module.fail_json(msg="Invalid serverpool or VM name. Please check that your parameters")
 
-    module.exit_json(changed=changed)
+    module.exit_json(changed=changed, jobs=client.jobs, ovm_stats=client.stats)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
 if __name__ == '__main__':
     main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+DOCUMENTATION = '''
+---
+module: ovm_vdisk_copy
+short_description: Copy or move OVM virtual disks between repositories
+description:
+  - Copies a list of virtual disks to target repositories, in parallel.
+    A copy reads from its source repository and writes to its target,
+    so the number of copies running at once is capped per source and
+    per target repository as well as overall.
+  - The disks and repositories are resolved from one read of each
+    list. A copy whose new name already exists in its target
+    repository is left alone.
+  - With move the source disk is deleted after its copy. Disks mapped
+    to a VM are not moved. When the copy already exists and a single
+    source is left, only the source is deleted, so a rerun finishes a
+    move that stopped between the copy and the delete.
+  - In check mode only the plan is returned.
+author: "Court Campbell"
+notes:
+    - This module works with OVM 3.3 and 3.4
+    - Set hosts in your playbook to the OVM Manager server
+    - Throughput is the on-disk size of the source (its size if that
+      is not known) over the seconds its clone and rename jobs took.
+requirements:
+    - requests package, only with OVM_TRANSPORT=requests
+options:
+    ovm_user:
+        description:
+            - The OVM admin-user used to connect to the OVM-Manager.
+        required: True
+    ovm_pass:
+        description:
+            - The password of the OVM admin-user.
+        required: True
+    ovm_host:
+        description:
+            - The base-url for Oracle-VM.
+        default: https://127.0.0.1:7002
+        required: False
+    disks:
+        description:
+            - The copies to make, each a dict with name (the virtual
+              disk), target (the repository to copy it to) and
+              optionally source (the repository of the disk, when its
+              name is not unique) and new_name (the name of the copy,
+              the disk's name by default).
+        required: True
+    clone_type:
+        description:
+            - How the disks are copied.
+        default: SPARSE_COPY
+        choices: [ SPARSE_COPY, NON_SPARSE_COPY, THIN_CLONE ]
+        required: False
+    move:
+        description:
+            - Delete every source disk after it was copied.
+        default: False
+        required: False
+    max_parallel:
+        description:
+            - Maximum number of copies running at the same time.
+        default: 4
+        required: False
+    max_per_source:
+        description:
+            - Maximum number of copies reading from one repository at
+              the same time, at least 1.
+        default: 1
+        required: False
+    max_per_target:
+        description:
+            - Maximum number of copies writing to one repository at the
+              same time, at least 1.
+        default: 1
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each clone, rename or delete job. A
+              copy still running then is aborted, see rollback.
+        required: False
+    rollback:
+        description:
+            - When the task is cancelled by job_timeout or a signal,
+            - delete the copies it made. With move, a copy whose source
+            - was deleted is kept, it is the only one left.
+        default: False
+        required: False
+'''
+
+EXAMPLES = '''
+- name: Copy the template disks to the new repositories
+  ovm_vdisk_copy:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    max_per_target: 2
+    disks:
+      - name: ol7_system.img
+        target: Repo2
+      - name: ol7_system.img
+        target: Repo3
+      - name: ol8_system.img
+        source: Repo1
+        target: Repo2
+        new_name: ol8_system_copy.img
+
+- name: Move unmapped disks off Repo1
+  ovm_vdisk_copy:
+    ovm_user: 'admin'
+    ovm_pass: 'password'
+    move: True
+    disks: "{{ repo1_disks | map('combine', {'target': 'Repo4'}) | list }}"
+'''
+
+RETURN = '''
+plan:
+  description:
+    - The copies to make, with name, source, target, new_name, the
+      bytes to copy and delete_only, true for a move whose copy exists
+      and whose source is only deleted.
+results:
+  description:
+    - Per copy the status (copied, moved or failed), the seconds it took
+      and its throughput in mb_per_second, or the error. Not returned in
+      check mode.
+unchanged:
+  description:
+    - Copies whose new_name already exists in the target repository.
+errors:
+  description:
+    - Copies that could not be planned or failed, with the error.
+summary:
+  description:
+    - Number of copies made and failed, the bytes copied, the seconds
+      the copies took together and their combined mb_per_second.
+'''
+
+WANT_JSON = ''
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            ovm_user=dict(required=True),
+            ovm_pass=dict(required=True, no_log=True),
+            ovm_host=dict(
+                default='https://127.0.0.1:7002'),
+            disks=dict(required=True, type='list'),
+            clone_type=dict(
+                default='SPARSE_COPY',
+                choices=['SPARSE_COPY', 'NON_SPARSE_COPY', 'THIN_CLONE']),
+            move=dict(default=False, type='bool'),
+            max_parallel=dict(default=4, type='int'),
+            max_per_source=dict(default=1, type='int'),
+            max_per_target=dict(default=1, type='int'),
+            job_timeout=dict(type='int'),
+            rollback=dict(default=False, type='bool'),
+        ),
+        supports_check_mode=True
+    )
+    if HAS_TRANSPORT is False:
+        module.fail_json(
+            msg="ovm_vdisk_copy module requires the 'requests' package with OVM_TRANSPORT=requests")
+
+    for name in ('max_parallel', 'max_per_source', 'max_per_target'):
+        if module.params[name] < 1:
+            module.fail_json(msg="%s must be at least 1" % name)
+
+    copies = module.params['disks']
+    for copy in copies:
+        if not isinstance(copy, dict) or 'name' not in copy or 'target' not in copy:
+            module.fail_json(msg="every entry of disks needs a name and a target")
+
+    base_uri = base_uri_for(module.params['ovm_host'])
+    session = auth(module.params['ovm_user'], module.params['ovm_pass'],
+                   pool_size=module.params['max_parallel'])
+    waiter = JobWaiter()
+    client = OVMRestClient(base_uri, session,
+                           job_timeout=module.params['job_timeout'],
+                           waiter=waiter)
+    client.exit_on_cancel(module, module.params['rollback'])
+
+    repositories = load_name_index(client, 'Repository')
+    actions, unchanged, errors = plan_copies(client, copies, repositories,
+                                             module.params['move'])
+    result = dict(
+        changed=len(actions) > 0,
+        plan=[describe(action) for action in actions],
+        unchanged=unchanged,
+        errors=errors)
+    if module.check_mode or not actions:
+        if errors:
+            module.fail_json(msg="%d of %d copies could not be planned" % (len(errors), len(copies)),
+                             ovm_stats=client.stats, **result)
+        module.exit_json(ovm_stats=client.stats, **result)
+
+    started = time.time()
+    result['results'] = run_copies(
+        client, actions, module.params['clone_type'], module.params['move'],
+        module.params['max_parallel'], module.params['max_per_source'],
+        module.params['max_per_target'])
+    seconds = time.time() - started
+    client.fail_if_cancelled()
+    waiter.stop()
+    done = [entry for entry in result['results'] if entry['status'] != 'failed']
+    copied = sum(entry['bytes'] for entry in done)
+    result['errors'].extend(entry for entry in result['results'] if entry['status'] == 'failed')
+    result['summary'] = dict(
+        copied=len(done),
+        failed=len(actions) - len(done),
+        bytes=copied,
+        seconds=round(seconds, 1),
+        mb_per_second=round(copied / 1e6 / max(seconds, 0.001), 1))
+    result['changed'] = len(done) > 0
+    result['jobs'] = client.jobs
+    result['ovm_stats'] = client.stats
+    if result['errors']:
+        module.fail_json(msg="%d of %d copies failed" % (len(result['errors']), len(copies)),
+                         **result)
+
+    module.exit_json(**result)
+
+# pylint: disable=wrong-import-position
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_copy import plan_copies, run_copies, describe
+from ansible.module_utils.ovm_index import load_name_index
+from ansible.module_utils.ovm_waiter import JobWaiter
+import time
+if __name__ == '__main__':
+    main()
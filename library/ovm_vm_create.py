@@ -53,6 +53,26 @@ options:
         required: False
         default: "XEN_HVM"
         choices: [ XEN_HVM, XEN_HVM_PV_DRIVERS, XEN_PVM, LDOMS_PVM, UNKNOWN ]
+    journal:
+        description:
+            - Path of a local job journal. Every submitted job is
+            - recorded there; when a run fails halfway, running the
+            - task again with the same journal skips the finished jobs
+            - and waits on the ones still running instead of submitting
+            - them again. The names are still looked up on the rerun.
+            - The journal is removed after a successful run.
+        required: False
+    job_timeout:
+        description:
+            - Seconds to wait for each VM, disk, mapping and VNIC job
+              before it is aborted.
+        required: False
+    rollback:
+        description:
+            - When the task is cancelled by job_timeout or a signal,
+            - delete the virtual disks and VNICs it created.
+        default: False
+        required: False
 '''
 
 EXAMPLES = '''
@@ -105,136 +125,6 @@ id:
 
 WANT_JSON = ''
 
-#==============================================================
-try:
-    import requests
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
-#==============================================================
-def auth(ovm_user, ovm_pass):
-    """ Set authentication-credentials.
-
-    Oracle-VM usually generates a self-signed certificate,
-    this is why we disable certificate-validation.
-
-    Set Accept and Content-Type headers to application/json to
-    tell Oracle-VM we want json, not XML.
-    """
-    session = requests.Session()
-    session.auth = (ovm_user, ovm_pass)
-    session.verify = False
-    session.headers.update({
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    })
-    return session
-
-#==============================================================
-class OVMRestClient:
-
-    def __init__(self, base_uri, session):
-        self.session = session
-        self.base_uri = base_uri
-
-    def create_vm(self, object_type, data):
-        response = self.session.post(
-            self.base_uri+'/'+object_type,
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-    
-    def create_vdisk(self, repositoryId, sparse, data):
-        response = self.session.post(
-            self.base_uri+'/Repository/'+repositoryId['value']+'/VirtualDisk?sparse='+str(sparse),
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-    
-    def create_vnic(self, vmId, data):
-        response = self.session.post(
-            self.base_uri+'/Vm/'+vmId['value']+'/VirtualNic',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-    
-    
-    def map_vdisk(self, vmId, data):
-        response = self.session.post(
-            self.base_uri+'/Vm/'+vmId['value']+'/VmDiskMapping',
-            data=json.dumps(data)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-    def clone_vm(self, vmId, name, data):
-	response = self.session.put(
-            self.base_uri+'/Vm/'+vmId['value']+'/clone'+
-                '?serverPoolId='+data['serverPoolId']['value']+
-                '&repositoryId='+data['repositoryId']['value']+
-                '&vmCloneDefinitionId='+data['vmCloneDefinitionId']['value']+
-                '&createTemplate=false'
-        )
-        job = response.json()
-        clone_id = self.monitor_job(job['id']['value'])
-        vm = { 'id': self.get('Vm',clone_id['value'])['id'],
-                 'name': name }
-        response = self.session.put(
-            self.base_uri+'/Vm/'+clone_id['value'],
-            data=json.dumps(vm)
-        )
-        job = response.json()
-        self.monitor_job(job['id']['value'])
-
-    def get(self, object_type, object_id):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/'+object_id
-        )
-        return response.json()
-
-    def get_id_for_name(self, object_type, object_name):
-        response = self.session.get(
-            self.base_uri+'/'+object_type+'/id'
-        )
-        for obj in response.json():
-            if obj['name'] == object_name:
-                return obj
-        return None
-
-    def get_ids(self, object_type):
-        response = self.session.get(
-            self.base_uri+'/'+object_type
-        )
-        return response.json()
-
-    def get_disk_maps(self,vmId):
-        response = self.session.get(
-            self.base_uri+'/Vm/'+vmId['value']+'/VmDiskMapping/id'
-        )
-        return response.json()
-
-    def monitor_job(self, job_id):
-        while True:
-            response = self.session.get(
-                self.base_uri+'/Job/'+job_id)
-            job = response.json()
-            if job['summaryDone']:
-                if job['jobRunState'] == 'FAILURE':
-                    raise Exception('Job failed: %s' % job.error)
-                elif job['jobRunState'] == 'SUCCESS':
-                    if 'resultId' in job.keys():
-                        return job['resultId']
-                    break
-                elif job['jobRunState'] == 'RUNNING':
-                    continue
-                else:
-                    break
-
-
 def main():
     changed = False
     module = AnsibleModule(
@@ -279,11 +169,20 @@ def main():
             boot_order=dict(
                 required=False,
                 type='list'),
+            journal=dict(
+                required=False,
+                type='path'),
+            job_timeout=dict(
+                required=False,
+                type='int'),
+            rollback=dict(
+                default=False,
+                type='bool'),
         )
     )
-    if HAS_REQUESTS is False:
+    if HAS_TRANSPORT is False:
         module.fail_json(
-            msg="ovm_vm module requires the 'requests' package")
+            msg="ovm_vm module requires the 'requests' package with OVM_TRANSPORT=requests")
 
     memory = module.params['memory']
     max_memory = module.params['max_memory']
@@ -306,9 +205,14 @@ def main():
     if max_vcpu_cores is None:
         max_vcpu_cores = vcpu_cores
 
-    base_uri = module.params['ovm_host']+'/ovm/core/wsapi/rest'
+    base_uri = base_uri_for(module.params['ovm_host'])
     session = auth(module.params['ovm_user'], module.params['ovm_pass'])
-    client = OVMRestClient(base_uri, session)
+    journal = None
+    if module.params['journal']:
+        journal = JobJournal(module.params['journal'])
+    client = OVMRestClient(base_uri, session, journal,
+                           job_timeout=module.params['job_timeout'])
+    client.exit_on_cancel(module, module.params['rollback'])
 
     repository_id = client.get_id_for_name(
         'Repository',
@@ -335,9 +239,11 @@ def main():
                         'vmCloneDefinitionId': client.get_id_for_name('VmCloneDefinition',module.params['clone_vm']['vmCloneDefinition'])
                     })
             changed = True
-            module.exit_json(changed=changed)
+            if journal is not None:
+                journal.remove()
+            module.exit_json(changed=changed, jobs=client.jobs, ovm_stats=client.stats)
         
-        client.create_vm(
+        vm_id = client.create_vm(
             'Vm',
             data = {
                 'repositoryId': repository_id,
@@ -350,40 +256,48 @@ def main():
                 'memoryLimit': max_memory
             })
         changed = True
-    # If dissks are defined, create them
+    # If disks are defined, create them and map the ones that are
+    # not mapped to the vm yet
     if module.params['disks']:
+       disk_maps = client.get_vm_disk_maps(vm_id)
+       mapped = [m['virtualDiskId']['value'] for m in disk_maps if m.get('virtualDiskId')]
+       disk_target = len(disk_maps)
        for disk in module.params['disks']:
-           if client.get_id_for_name('VirtualDisk',disk['name']) is None:
-               client.create_vdisk(
+           disk_id = client.get_id_for_name('VirtualDisk',disk['name'])
+           if disk_id is None:
+               disk_id = client.create_vdisk(
                    client.get_id_for_name('Repository', disk['repository']),
                    disk['sparse'],
                    data = {
                        'name': disk['name'],
                        'size': disk['size'] * (2**30)
                    })
+               changed = True
+           if disk_id['value'] not in mapped:
                client.map_vdisk(
-                   client.get_id_for_name('Vm',module.params['name']),
+                   vm_id,
                    data = {
-                       'vmId': client.get_id_for_name('Vm',module.params['name']),
-                       'virtualDiskId': client.get_id_for_name('VirtualDisk',disk['name']),
-                       'diskTarget': len(client.get_disk_maps(client.get_id_for_name('Vm',module.params['name'])))
+                       'vmId': vm_id,
+                       'virtualDiskId': disk_id,
+                       'diskTarget': disk_target
                    })
+               disk_target += 1
                changed = True
-           else:
-               changed = False
     # Create and map networks
     if  module.params['networks']:
         for network in module.params['networks']:
             if client.get_id_for_name('VirtualNic',network['name']) is None:
                 client.create_vnic(vm_id,data = { 'name': network['name'] })
                 changed = True
-	    else:
-	        changed = False
 
-    module.exit_json(changed=changed)
+    if journal is not None:
+        journal.remove()
+
+    module.exit_json(changed=changed, jobs=client.jobs, ovm_stats=client.stats)
 
 # pylint: disable=wrong-import-position
 from ansible.module_utils.basic import AnsibleModule
-import json
+from ansible.module_utils.ovm import auth, base_uri_for, OVMRestClient, HAS_TRANSPORT
+from ansible.module_utils.ovm_journal import JobJournal
 if __name__ == '__main__':
     main()
@@ -0,0 +1,845 @@
+# Shared Oracle-VM REST client for the ovm_* modules.
+#
+# Ansible picks this file up from the module_utils directory next to
+# library/, modules import it with:
+#
+#   from ansible.module_utils.ovm import auth, OVMRestClient
+
+import json
+import os
+import signal
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ansible.module_utils.ovm_journal import step_key
+from ansible.module_utils.ovm_history import JobHistory, operation_key
+from ansible.module_utils.ovm_metrics import get_metrics, endpoint_for, operation_for
+from ansible.module_utils.ovm_stream import iter_json_array, project
+from ansible.module_utils.ovm_index import to_json
+from ansible.module_utils.ovm_flight import SingleFlight
+
+#==============================================================
+# requests is only imported when it is the transport in use, importing
+# it takes longer than most lookups a module makes. OVM_TRANSPORT picks
+# the transport: "http" for the stdlib one in ovm_http, "requests", or
+# "auto" (the default), which uses requests only when a proxy is set in
+# the environment, the stdlib transport does not handle proxies.
+try:
+    from importlib.util import find_spec
+    HAS_REQUESTS = find_spec('requests') is not None
+except ImportError:
+    import imp
+    try:
+        imp.find_module('requests')
+        HAS_REQUESTS = True
+    except ImportError:
+        HAS_REQUESTS = False
+
+PROXY_VARS = ('https_proxy', 'HTTPS_PROXY', 'http_proxy', 'HTTP_PROXY')
+
+
+def transport():
+    name = os.environ.get('OVM_TRANSPORT', 'auto')
+    if name == 'auto':
+        if HAS_REQUESTS and any(os.environ.get(var) for var in PROXY_VARS):
+            return 'requests'
+        return 'http'
+    return name
+
+
+HAS_TRANSPORT = transport() != 'requests' or HAS_REQUESTS
+
+#==============================================================
+def auth(ovm_user, ovm_pass, pool_size=10):
+    """ Set authentication-credentials.
+
+    Oracle-VM usually generates a self-signed certificate,
+    this is why we disable certificate-validation.
+
+    Set Accept and Content-Type headers to application/json to
+    tell Oracle-VM we want json, not XML, and ask for compressed
+    responses, the big list payloads compress very well.
+
+    The session can be shared by up to pool_size threads without
+    opening a new connection per request.
+    """
+    if transport() == 'requests':
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    else:
+        from ansible.module_utils.ovm_http import HTTPSession
+        session = HTTPSession(pool_size)
+    session.auth = (ovm_user, ovm_pass)
+    session.verify = False
+    session.headers.update({
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+        'Content-Type': 'application/json'
+    })
+    return session
+
+
+REST_PATH = '/ovm/core/wsapi/rest'
+
+
+def base_uri_for(ovm_host):
+    return ovm_host+REST_PATH
+
+
+def run_parallel(func, items, limit=4):
+    """ Run func over items with at most limit threads.
+
+    Returns a list of (item, result, error) tuples in the order
+    of items. Errors are collected, not raised, so one failed job
+    does not hide the outcome of the others.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    work = queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = (item, func(item), None)
+            except Exception as e:
+                results[index] = (item, None, e)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(limit, len(items))))]
+    for thread in threads:
+        # Workers must not keep the process alive after a cancel
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_parallel_keyed(func, items, keys, key_limit=1, limit=4):
+    """ run_parallel() with at most key_limit items per key at once.
+
+    keys maps an item to the keys it occupies while it runs, e.g. the
+    servers a job works on. key_limit is a number or a function of the
+    key. Workers take the first waiting item whose keys all have room,
+    so a busy key does not hold up the items behind it. A key_limit
+    below 1 raises ValueError, no item could ever run.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if not callable(key_limit):
+        key_limit = (lambda limit: lambda key: limit)(key_limit)
+    waiting = [(index, item, list(keys(item))) for index, item in enumerate(items)]
+    for _, _, item_keys in waiting:
+        for key in item_keys:
+            if key_limit(key) < 1:
+                raise ValueError('key_limit of %s must be at least 1' % (key, ))
+    busy = {}
+    ready = threading.Condition()
+
+    def take():
+        for position, (index, item, item_keys) in enumerate(waiting):
+            if all(busy.get(key, 0) < key_limit(key) for key in item_keys):
+                del waiting[position]
+                for key in item_keys:
+                    busy[key] = busy.get(key, 0) + 1
+                return index, item, item_keys
+        return None
+
+    def worker():
+        while True:
+            with ready:
+                taken = take()
+                while taken is None:
+                    if not waiting:
+                        return
+                    ready.wait()
+                    taken = take()
+            index, item, item_keys = taken
+            try:
+                results[index] = (item, func(item), None)
+            except Exception as e:
+                results[index] = (item, None, e)
+            with ready:
+                for key in item_keys:
+                    busy[key] -= 1
+                ready.notify_all()
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(limit, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def job_target(method, path, data=None):
+    target = method+' '+path
+    if isinstance(data, dict) and 'name' in data:
+        target += ' '+data['name']
+    return target
+
+
+def new_stats():
+    return dict(requests=0, bytes=0, request_seconds=0.0,
+                lookups=0, lookup_seconds=0.0, coalesced=0,
+                job_polls=0, job_wait_seconds=0.0, endpoints={})
+
+
+def merge_stats(stats_list):
+    """ Add up the stats of several clients working for one task. """
+    merged = new_stats()
+    for stats in stats_list:
+        for name, value in stats.items():
+            if name == 'endpoints':
+                for endpoint, counts in value.items():
+                    total = merged['endpoints'].setdefault(endpoint, [0, 0, 0.0])
+                    merged['endpoints'][endpoint] = [a + b for a, b in zip(total, counts)]
+            else:
+                merged[name] += value
+    return merged
+
+
+def in_main_thread():
+    return threading.current_thread().name == 'MainThread'
+
+#==============================================================
+class JobCancelled(Exception):
+    pass
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class JobTracker:
+    """ Outstanding jobs and the objects created by one run.
+
+    Clients working for the same run share one tracker, so a cancel
+    aborts every job that is still running, whichever client started
+    it, and can remove the disks and VNICs created so far.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.pending = {}
+        self.created = []
+        self.module = None
+        self.rollback = False
+        # Why a worker thread stopped the run, the main thread cancels it
+        self.reason = None
+
+    def started(self, job_id, target):
+        with self.lock:
+            self.pending[job_id] = target
+
+    def finished(self, job_id):
+        with self.lock:
+            self.pending.pop(job_id, None)
+
+    def record_created(self, path):
+        """ Remember the DELETE path of an object created by this run. """
+        with self.lock:
+            self.created.append(path)
+
+    def keep_created(self, path):
+        """ Leave an object created by this run out of a rollback, e.g.
+        a copy that is about to replace its original.
+
+        Returns False when the run is being cancelled, the object may
+        be rolled back already and must not be relied on.
+        """
+        with self.lock:
+            if self.stop.is_set():
+                return False
+            if path in self.created:
+                self.created.remove(path)
+            return True
+
+    def interrupt(self, reason):
+        """ Stop the run from a worker thread, e.g. on a job timeout.
+
+        Only the main thread can fail the task, so the jobs are left
+        to OVMRestClient.fail_if_cancelled() once the workers return.
+        """
+        with self.lock:
+            if self.reason is None:
+                self.reason = reason
+        self.stop.set()
+
+    def cancel(self, client, reason):
+        self.stop.set()
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending = {}
+            created = list(reversed(self.created))
+            self.created = []
+        report = dict(reason=reason, aborted=[], rolled_back=[], cleanup_failed=[])
+        for job_id, target in pending:
+            try:
+                client.abort_job(job_id)
+                report['aborted'].append(target)
+            except Exception:
+                report['cleanup_failed'].append(target)
+            if client.journal is not None:
+                client.journal.abort(job_id)
+        if self.rollback:
+            for path in created:
+                try:
+                    client.monitor_job(
+                        client.submit('DELETE', path),
+                        cancellable=False)
+                    report['rolled_back'].append(path)
+                except Exception:
+                    report['cleanup_failed'].append(path)
+            if client.journal is not None and created:
+                # The recorded results point at deleted objects now
+                client.journal.remove()
+        return report
+
+#==============================================================
+class OVMRestClient:
+    """ Client for the OVM REST API.
+
+    One client can be shared by a pool of threads: the session pools
+    its connections, and stats, the job bookkeeping, the journal,
+    history and metrics each have their own lock.
+    """
+
+    def __init__(self, base_uri, session, journal=None, tracker=None,
+                 job_timeout=None, history=None, metrics=None, flight=None,
+                 waiter=None):
+        self.session = session
+        self.base_uri = base_uri
+        self.journal = journal
+        self.tracker = tracker or JobTracker()
+        self.job_timeout = job_timeout
+        if history is None and os.environ.get('OVM_JOB_HISTORY'):
+            history = JobHistory(os.environ['OVM_JOB_HISTORY'])
+        self.history = history
+        self.metrics = metrics if metrics is not None else get_metrics()
+        # Clients working for one task share it to coalesce lookups
+        self.flight = flight or SingleFlight()
+        # A JobWaiter from ovm_waiter polls the jobs of all clients of
+        # a task in one loop
+        self.waiter = waiter
+        # Per task instrumentation returned as ovm_stats, endpoints
+        # maps an endpoint to [requests, bytes, seconds]
+        self.stats = new_stats()
+        self.stats_lock = threading.Lock()
+        self.jobs_lock = threading.Lock()
+        self.job_keys = {}
+        # One entry per finished job: target, seconds and, when the
+        # history knows the operation, the expected seconds
+        self.jobs = []
+
+
+    def exit_on_cancel(self, module, rollback=False):
+        """ Fail the task cleanly on SIGINT, SIGTERM or a job timeout.
+
+        Outstanding jobs are aborted on the manager so they stop
+        holding repository and server locks. With rollback the
+        disks and VNICs created by this run are deleted again.
+        """
+        self.tracker.module = module
+        self.tracker.rollback = rollback
+
+        def handler(signum, frame):
+            self.fail_cancelled('Interrupted by signal %d' % signum)
+
+        if in_main_thread():
+            signal.signal(signal.SIGINT, handler)
+            signal.signal(signal.SIGTERM, handler)
+
+
+    def fail_cancelled(self, reason):
+        report = self.tracker.cancel(self, reason)
+        if self.tracker.module is not None and in_main_thread():
+            self.tracker.module.fail_json(msg=reason, cancelled=report)
+        raise JobCancelled(reason)
+
+
+    def fail_if_cancelled(self):
+        """ Cancel the run if a worker thread interrupted it. Called
+        by the main thread once run_parallel() returns. """
+        if self.tracker.reason is not None:
+            self.fail_cancelled(self.tracker.reason)
+
+
+    def timed_out(self, reason, cancellable):
+        """ A job of this run did not finish in time.
+
+        Returns True when the run was interrupted, its jobs, the late
+        one included, are then aborted by the main thread. False means
+        the caller aborts the late job itself.
+        """
+        if not cancellable or self.tracker.module is None:
+            return False
+        if in_main_thread():
+            self.fail_cancelled(reason)
+        self.tracker.interrupt(reason)
+        return True
+
+
+    def abort_job(self, job_id):
+        self.request('PUT', '/Job/'+job_id+'/abort')
+        self.tracker.finished(job_id)
+
+
+    def request(self, method, path, data=None, stream=False):
+        """ Send one REST call, path is relative to base_uri.
+
+        With stream the body is left on the socket, the caller reads
+        it and reports the size through count_bytes().
+        """
+        if method != 'GET':
+            self.flight.forget(path)
+        started = time.time()
+        if data is None:
+            response = self.session.request(
+                method, self.base_uri+path, stream=stream)
+        else:
+            response = self.session.request(
+                method,
+                self.base_uri+path,
+                data=json.dumps(data, default=to_json),
+                stream=stream
+            )
+        endpoint = self.account(method, path, time.time() - started,
+                                response.status_code)
+        if not stream:
+            self.count_bytes(endpoint, len(response.content))
+        return response
+
+
+    def account(self, method, path, seconds, status):
+        """ Add one request to stats and metrics, returns its endpoint. """
+        endpoint = method+' '+endpoint_for(path)
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['request_seconds'] += seconds
+            if method == 'GET' and (endpoint.endswith('/id') or endpoint.count('/') == 1):
+                self.stats['lookups'] += 1
+                self.stats['lookup_seconds'] += seconds
+            counts = self.stats['endpoints'].setdefault(endpoint, [0, 0, 0.0])
+            counts[0] += 1
+            counts[2] += seconds
+        if self.metrics is not None:
+            self.metrics.api_request(method, path, seconds, status)
+        return endpoint
+
+
+    def decode(self, response):
+        return json.loads(response.content.decode('utf-8'))
+
+
+    def fetch(self, path):
+        """ GET and decode path, sharing the request with other threads
+        asking for the same path at the same time.
+        """
+        result, shared = self.flight.do(
+            path, lambda: self.decode(self.request('GET', path)))
+        if shared:
+            with self.stats_lock:
+                self.stats['coalesced'] += 1
+        return result
+
+
+    def count_bytes(self, endpoint, size):
+        with self.stats_lock:
+            self.stats['bytes'] += size
+            self.stats['endpoints'][endpoint][1] += size
+
+
+    def iter_list(self, path, fields=None):
+        """ Yield the objects of a list endpoint while it downloads.
+
+        Stopping early closes the connection, so a lookup that finds
+        its object near the start of a big list does not read the
+        rest. fields limits each object to the fields a caller uses.
+        """
+        response = self.request('GET', path, stream=True)
+        size = [0]
+
+        def chunks():
+            for chunk in response.iter_content(65536):
+                size[0] += len(chunk)
+                yield chunk
+        try:
+            for obj in iter_json_array(chunks()):
+                yield project(obj, fields)
+        finally:
+            response.close()
+            self.count_bytes('GET '+endpoint_for(path), size[0])
+
+
+    def submit(self, method, path, data=None):
+        """ Send a job-creating request and return the job id. """
+        response = self.request(method, path, data)
+        job = self.decode(response)
+        target = job_target(method, path, data)
+        self.tracker.started(job['id']['value'], target)
+        with self.jobs_lock:
+            self.job_keys[job['id']['value']] = (
+                operation_key(method, path, data), time.time(), target,
+                operation_for(path))
+        return job['id']['value']
+
+
+    def run_job(self, method, path, data=None, identity=None):
+        """ Submit a job and wait for it, through the journal if any.
+
+        With a journal, a step that already finished returns its
+        recorded result and a step that was still running is waited
+        on again instead of being submitted twice. identity names what
+        the step makes, see step_key().
+        """
+        if self.tracker.stop.is_set():
+            # Nothing new is started once the run is being cancelled
+            raise JobCancelled('%s cancelled' % job_target(method, path, data))
+        if self.journal is None:
+            return self.monitor_job(self.submit(method, path, data))
+        key = step_key(method, path, data, identity)
+        target = job_target(method, path, data)
+        record = self.journal.lookup(key)
+        if record is not None and record['state'] == 'done':
+            return record['result']
+        if record is not None and record['state'] == 'submitted':
+            job_id = record['job_id']
+        else:
+            if record is not None and self.metrics is not None:
+                self.metrics.retry(operation_for(path))
+            job_id = self.submit(method, path, data)
+            self.journal.submitted(key, target, job_id)
+        try:
+            result = self.monitor_job(job_id)
+        except Exception as e:
+            self.journal.failed(key, target, job_id, str(e))
+            raise
+        self.journal.finished(key, target, job_id, result)
+        return result
+
+
+    def create_vm(self, object_type, data):
+        return self.run_job('POST', '/'+object_type, data)
+
+
+    def create_vdisk(self, repositoryId, sparse, data):
+        # Keyed on the name, the modules find disks by name and a rerun
+        # may place the disk in another repository
+        vdiskId = self.run_job(
+            'POST',
+            '/Repository/'+repositoryId['value']+'/VirtualDisk?sparse='+str(sparse),
+            data, identity='create VirtualDisk '+data['name'])
+        if vdiskId is not None:
+            self.tracker.record_created(
+                '/Repository/'+repositoryId['value']+'/VirtualDisk/'+vdiskId['value'])
+        return vdiskId
+
+
+    def create_vnic(self, vmId, data):
+        vnicId = self.run_job(
+            'POST', '/Vm/'+vmId['value']+'/VirtualNic', data)
+        if vnicId is not None:
+            self.tracker.record_created(
+                '/Vm/'+vmId['value']+'/VirtualNic/'+vnicId['value'])
+        return vnicId
+
+
+    def delete_vnic(self, vmId, vnicId):
+        return self.run_job(
+            'DELETE', '/Vm/'+vmId['value']+'/VirtualNic/'+vnicId['value'])
+
+
+    def delete_orphan_vnic(self, vnicId):
+        """ Delete a VNIC that has no VM to delete it through. """
+        return self.run_job('DELETE', '/VirtualNic/'+vnicId['value'])
+
+
+    def delete_vdisk(self, repositoryId, vdiskId):
+        return self.run_job(
+            'DELETE', '/Repository/'+repositoryId['value']+'/VirtualDisk/'+vdiskId['value'])
+
+
+    def map_vdisk(self, vmId, data):
+        return self.run_job(
+            'POST', '/Vm/'+vmId['value']+'/VmDiskMapping', data)
+
+
+    def add_vnic_to_network(self, networkId, data):
+        return self.run_job(
+            'PUT', '/Network/'+networkId['value']+'/addVirtualNic', data)
+
+
+    def add_vm(self, serverpoolId, data):
+        return self.run_job(
+            'PUT', '/ServerPool/'+serverpoolId['value']+'/addVm', data)
+
+
+    def remove_vm(self, serverpoolId, data):
+        return self.run_job(
+            'PUT', '/ServerPool/'+serverpoolId['value']+'/removeVm', data)
+
+
+    def start_vm(self, vmId):
+        return self.run_job(
+            'PUT', '/Vm/'+vmId['value']+'/start')
+
+
+    def stop_vm(self, vmId):
+        return self.run_job(
+            'PUT', '/Vm/'+vmId['value']+'/stop')
+
+
+    def suspend_vm(self, vmId):
+        return self.run_job(
+            'PUT', '/Vm/'+vmId['value']+'/suspend')
+
+
+    def resume_vm(self, vmId):
+        return self.run_job(
+            'PUT', '/Vm/'+vmId['value']+'/resume')
+
+
+    def modify_vm(self, vm):
+        return self.run_job('PUT', '/Vm/'+vm['id']['value'], vm)
+
+
+    def rename_vdisk(self, vdisk, data):
+        return self.run_job('PUT', '/VirtualDisk/'+vdisk['id']['value'], data)
+
+
+    def present_repo(self, repositoryId, data):
+        return self.run_job(
+            'PUT', '/Repository/'+repositoryId['value']+'/present', data)
+
+
+    def unpresent_repo(self, repositoryId, data):
+        return self.run_job(
+            'PUT', '/Repository/'+repositoryId['value']+'/unpresent', data)
+
+
+    def takeownership_repo(self, repositoryId, serverpoolId):
+        return self.run_job(
+            'PUT',
+            '/Repository/'+repositoryId['value']+'/takeOwnership?serverPoolId='+serverpoolId['value'])
+
+
+    def releaseownership_repo(self, repositoryId):
+        return self.run_job(
+            'PUT', '/Repository/'+repositoryId['value']+'/releaseOwnership')
+
+
+    def fileSystem_refresh(self, fileSystemId):
+        return self.run_job('PUT', '/FileSystem/'+fileSystemId+'/refresh')
+
+
+    def clone_vm(self, vmId, name, data):
+        clone_id = self.run_job(
+            'PUT',
+            '/Vm/'+vmId['value']+'/clone'+
+                '?serverPoolId='+data['serverPoolId']['value']+
+                '&repositoryId='+data['repositoryId']['value']+
+                '&vmCloneDefinitionId='+data['vmCloneDefinitionId']['value']+
+                '&createTemplate=false',
+            identity='clone Vm '+vmId['value']+' '+name)
+        vm = { 'id': clone_id,
+                 'name': name }
+        self.run_job('PUT', '/Vm/'+clone_id['value'], vm)
+        return clone_id
+
+
+    def clone_vdisk(self, vdiskId, repositoryId, name, clone_type='SPARSE_COPY'):
+        clone_id = self.run_job(
+            'PUT',
+            '/VirtualDisk/'+vdiskId['value']+'/clone'+
+                '?repositoryId='+repositoryId['value']+
+                '&cloneType='+clone_type,
+            identity='clone VirtualDisk '+vdiskId['value']+' '+repositoryId['value']+' '+name)
+        if clone_id is not None:
+            self.tracker.record_created(
+                '/Repository/'+repositoryId['value']+'/VirtualDisk/'+clone_id['value'])
+            self.run_job('PUT', '/VirtualDisk/'+clone_id['value'],
+                         {'id': clone_id, 'name': name})
+        return clone_id
+
+
+    def get(self, object_type, object_id):
+        return self.fetch('/'+object_type+'/'+object_id)
+
+
+    def get_id_for_name(self, object_type, object_name):
+        for obj in self.iter_list('/'+object_type+'/id'):
+            if obj['name'] == object_name:
+                return obj
+        return None
+
+
+    def get_name_index(self, object_type):
+        """ Map name to id object for all objects of a type. """
+        return dict((obj['name'], obj)
+                    for obj in self.get_list('/'+object_type+'/id'))
+
+
+    def get_ids(self, object_type, fields=None):
+        """ All objects of a type, only fields (plus id and name) if given. """
+        return self.get_list('/'+object_type, fields)
+
+
+    def get_list(self, path, fields=None):
+        """ A whole list endpoint, shared like fetch(). """
+        key = path
+        if fields is not None:
+            key += '?fields='+','.join(fields)
+        result, shared = self.flight.do(
+            key, lambda: list(self.iter_list(path, fields)))
+        if shared:
+            with self.stats_lock:
+                self.stats['coalesced'] += 1
+        return result
+
+
+    def get_disk_maps(self, vmId):
+        return self.fetch('/Vm/'+vmId['value']+'/VmDiskMapping/id')
+
+
+    def get_presented_servers(self, repositoryId):
+        presented_servers = []
+        for server in self.get('Repository', repositoryId['value'])['presentedServerIds']:
+            presented_servers.append(server['name'])
+        return presented_servers
+
+
+    def get_repo_owner(self, repositoryId):
+        return self.get('Repository', repositoryId['value'])['managerUuid']
+
+
+    def get_vm_vnic(self, vmName):
+        for vnic in self.iter_list('/VirtualNic'):
+            if vnic['vmId'] is not None and vmName in vnic['vmId']['name']:
+                return vnic
+        return None
+
+
+    def get_vm_vdisk(self, vm, vdiskName):
+        for diskmap in self.get_vm_disk_maps(vm):
+            if diskmap.get('virtualDiskId') is None:
+                continue
+            vdisk = self.get('VirtualDisk', diskmap['virtualDiskId']['value'])
+            if vdisk['diskType'] == "VIRTUAL_DISK":
+                if vdiskName in vdisk['name']:
+                    return vdisk
+        return None
+
+
+    def get_vm_disk_maps(self, vmId):
+        return self.fetch('/Vm/'+vmId['value']+'/VmDiskMapping')
+
+
+    def job_finished(self, job_id, state):
+        with self.jobs_lock:
+            key, submitted, target, operation = self.job_keys.pop(
+                job_id, (None, None, job_id, None))
+        if submitted is None:
+            return
+        # The job changed the objects, lookups sent while it ran may
+        # be out of date
+        self.flight.forget(target.split(' ')[1])
+        seconds = time.time() - submitted
+        if self.metrics is not None:
+            self.metrics.job_finished(operation, state, seconds)
+        entry = dict(target=target, state=state, seconds=round(seconds, 1))
+        if self.history is not None:
+            entry['expected'] = self.history.expected(key)
+            if state == 'SUCCESS':
+                self.history.record(key, seconds)
+        with self.jobs_lock:
+            self.jobs.append(entry)
+
+
+    def job_schedule(self, job_id, poll_interval=None, timeout=None):
+        """ Operation, poll interval and timeout to wait for a job with. """
+        with self.jobs_lock:
+            key, _, _, operation = self.job_keys.get(job_id, (None, None, None, 'unknown'))
+        if timeout is None:
+            timeout = self.job_timeout
+        if timeout is None and self.history is not None and key is not None:
+            timeout = self.history.timeout(key)
+        if poll_interval is None:
+            poll_interval = 1
+            if self.history is not None and key is not None:
+                poll_interval = self.history.poll_interval(key)
+        return operation, poll_interval, timeout
+
+
+    def job_polled(self, job_id, job, operation, waited):
+        """ Account for one poll of a job.
+
+        Returns (done, result), raises when the job failed.
+        """
+        with self.stats_lock:
+            self.stats['job_polls'] += 1
+            self.stats['job_wait_seconds'] += waited
+        if self.metrics is not None:
+            self.metrics.job_poll(operation)
+        if job['summaryDone']:
+            self.tracker.finished(job_id)
+            self.job_finished(job_id, job['jobRunState'])
+            if job['jobRunState'] == 'FAILURE':
+                raise Exception('Job failed: %s' % job.get('error'))
+            elif job['jobRunState'] == 'SUCCESS':
+                return True, job.get('resultId')
+            elif job['jobRunState'] != 'RUNNING':
+                return True, None
+        return False, None
+
+
+    def job_timed_out(self, job_id, timeout):
+        reason = 'Job %s did not finish within %d seconds' % (
+            self.tracker.pending.get(job_id, job_id), timeout)
+        self.job_finished(job_id, 'TIMEOUT')
+        return reason
+
+
+    def monitor_job(self, job_id, poll_interval=None, timeout=None,
+                    cancellable=True):
+        if self.waiter is not None and poll_interval is None:
+            try:
+                return self.waiter.wait(self, job_id, timeout=timeout,
+                                        cancellable=cancellable)
+            except JobTimeout as e:
+                self.timed_out(str(e), cancellable)
+                raise
+        operation, poll_interval, timeout = self.job_schedule(
+            job_id, poll_interval, timeout)
+        started = polled = time.time()
+        while True:
+            if cancellable and self.tracker.stop.is_set():
+                raise JobCancelled('Job %s cancelled' % job_id)
+            job = self.fetch('/Job/'+job_id)
+            done, result = self.job_polled(job_id, job, operation, time.time() - polled)
+            if done:
+                return result
+            polled = time.time()
+            if timeout is not None and time.time() - started > timeout:
+                reason = self.job_timed_out(job_id, timeout)
+                if not self.timed_out(reason, cancellable):
+                    self.abort_job(job_id)
+                raise JobTimeout(reason)
+            time.sleep(poll_interval)
@@ -0,0 +1,38 @@
+# Local cache of facts read from the manager.
+#
+# Reports such as repository paths and capacity come from big list
+# requests whose answers change slowly. A FactCache keeps them in a JSON
+# file per manager, so tasks run again within ttl seconds, or several
+# hosts of a play asking for the same facts, skip the requests.
+
+import json
+import time
+
+from ansible.module_utils.ovm_history import locked_file, replace_file
+
+
+class FactCache:
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        """ The facts stored under key if younger than ttl, else None. """
+        entry = self._load().get(key)
+        if entry is None or time.time() - entry['time'] >= self.ttl:
+            return None
+        return entry['facts']
+
+    def put(self, key, facts):
+        with locked_file(self.path):
+            entries = self._load()
+            entries[key] = dict(time=time.time(), facts=facts)
+            replace_file(self.path, json.dumps(entries, separators=(',', ':')))
@@ -0,0 +1,139 @@
+# Repository capacity from bulk reads.
+#
+# For every repository: the size and free space of its file system and
+# what its virtual disks have been given, split into sparse disks (their
+# on-disk size is below their size, they can still grow into the free
+# space) and non-sparse ones. All repositories are done from one
+# Repository, one FileSystem and one VirtualDisk list. A few can be
+# brought up to date on their own from their own disk list, to refresh
+# a cached report after disks were added.
+
+from ansible.module_utils.ovm_history import operation_key
+from ansible.module_utils.ovm_index import ObjectIndex
+
+DISK_FIELDS = ('repositoryId', 'size', 'onDiskSize')
+
+
+def new_capacity(filesystem):
+    return dict(
+        size=filesystem['size'] or 0,
+        free_size=filesystem['freeSize'] or 0,
+        disks=0,
+        sparse_allocated=0,
+        sparse_on_disk=0,
+        non_sparse_allocated=0,
+        headroom=filesystem['freeSize'] or 0)
+
+
+def add_disk(capacity, disk):
+    size = disk['size'] or 0
+    on_disk = disk['onDiskSize'] or 0
+    capacity['disks'] += 1
+    if on_disk < size:
+        capacity['sparse_allocated'] += size
+        capacity['sparse_on_disk'] += on_disk
+        # Sparse disks can still grow by the part they have not written
+        capacity['headroom'] -= size - on_disk
+    else:
+        capacity['non_sparse_allocated'] += size
+
+
+def load_capacity(client):
+    """ Capacity of every repository with a file system, by name. """
+    repositories = ObjectIndex.load(client, 'Repository', ('fileSystemId', ))
+    filesystems = ObjectIndex.load(client, 'FileSystem', ('size', 'freeSize'))
+    by_value = {}
+    report = {}
+    for repository in repositories:
+        filesystem = repository.fileSystemId and filesystems.get(repository.fileSystemId.value)
+        if filesystem is None:
+            continue
+        report[repository.name] = by_value[repository.id.value] = new_capacity(filesystem)
+    for disk in client.iter_list('/VirtualDisk', DISK_FIELDS):
+        if disk['repositoryId'] is not None and disk['repositoryId']['value'] in by_value:
+            add_disk(by_value[disk['repositoryId']['value']], disk)
+    return report
+
+
+def refresh_capacity(client, report, names):
+    """ Recompute the repositories in names in report, from their own
+    file system and disk list. Returns the names that were not found.
+    """
+    repositories = ObjectIndex.load(client, 'Repository', ('fileSystemId', ))
+    missing = []
+    for name in names:
+        repository = repositories.find(name)
+        if repository is None or repository.fileSystemId is None:
+            report.pop(name, None)
+            missing.append(name)
+            continue
+        capacity = new_capacity(client.get('FileSystem', repository.fileSystemId.value))
+        for disk in client.iter_list('/Repository/'+repository.id.value+'/VirtualDisk',
+                                     DISK_FIELDS):
+            add_disk(capacity, disk)
+        report[name] = capacity
+    return missing
+
+
+def candidates(report, size, sparse=False, names=None):
+    """ Repositories that can take a disk of size bytes, most headroom
+    first. A sparse disk only needs to fit, a non-sparse one is written
+    out and must fit next to what the sparse disks can still grow by.
+    """
+    fitting = []
+    for name, capacity in report.items():
+        if names is not None and name not in names:
+            continue
+        room = capacity['free_size'] if sparse else capacity['headroom']
+        if room >= size:
+            fitting.append((room, name))
+    return [name for _, name in sorted(fitting, key=lambda item: (-item[0], item[1]))]
+
+
+class Placer(object):
+    """ Chooses the repository for each new disk of a task.
+
+    Among the repositories a disk fits in, the one whose disk creations
+    would be done first wins: the jobs this task already put there plus
+    this one, times the duration the job history expects for a disk of
+    that size there. Free space breaks ties. Every placement is taken
+    off the report, so the disks of one VM spread over the repositories
+    and are created side by side.
+    """
+
+    def __init__(self, report, repositories, history=None):
+        self.report = dict((name, dict(capacity)) for name, capacity in report.items())
+        self.repositories = repositories
+        self.history = history
+        self.in_flight = {}
+
+    def expected(self, name, size):
+        if self.history is None or name not in self.repositories:
+            return None
+        return self.history.expected(operation_key(
+            'POST', '/Repository/'+self.repositories[name]['value']+'/VirtualDisk',
+            {'size': size}))
+
+    def place(self, size, sparse=False, names=None):
+        """ The repository for a disk of size bytes, None if it fits
+        nowhere. names limits the choice to those repositories.
+        """
+        fitting = candidates(self.report, size, sparse, names)
+        if not fitting:
+            return None
+
+        def cost(name):
+            room = self.report[name]['free_size' if sparse else 'headroom']
+            return ((self.in_flight.get(name, 0) + 1) * (self.expected(name, size) or 1), -room)
+        name = min(fitting, key=cost)
+        self.take(name, size, sparse)
+        return name
+
+    def take(self, name, size, sparse=False):
+        """ Count a disk created in repository name by this task. """
+        capacity = self.report.get(name)
+        if capacity is not None:
+            capacity['headroom'] -= size
+            if not sparse:
+                capacity['free_size'] -= size
+        self.in_flight[name] = self.in_flight.get(name, 0) + 1
@@ -0,0 +1,159 @@
+# Virtual disk copies between repositories.
+#
+# A copy reads its source repository and writes its target, so the
+# copies of a batch are throttled per source and per target repository
+# at the same time: every copy occupies a source and a target key in
+# run_parallel_keyed. The disks and repositories are resolved from one
+# read of each list, the jobs are waited on through the client's job
+# waiter, and every copy reports its own throughput.
+#
+# A move deletes the source once its copy is done. From then on the
+# copy is the only one, so it is taken out of the rollback first: a
+# cancelled run must not delete it. A move that stopped between the two
+# is finished by a rerun, which finds the copy and only deletes the
+# source.
+
+import time
+
+from ansible.module_utils.ovm import run_parallel_keyed, JobCancelled
+from ansible.module_utils.ovm_orphans import id_set
+
+DISK_FIELDS = ('repositoryId', 'size', 'onDiskSize')
+
+COPIED = 'copied'
+MOVED = 'moved'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+
+def load_disks(client, names):
+    """ Map each disk name in names to the disks of that name, read
+    from one streamed VirtualDisk list. """
+    disks = {}
+    for disk in client.iter_list('/VirtualDisk', DISK_FIELDS):
+        if disk['name'] in names:
+            disks.setdefault(disk['name'], []).append(disk)
+    return disks
+
+
+def in_repository(disks, repository):
+    return [disk for disk in disks
+            if disk['repositoryId'] is not None and disk['repositoryId']['name'] == repository]
+
+
+def plan_copies(client, copies, repositories, move=False):
+    """ Work out the copy of every entry of copies, a dict with name,
+    target, and optionally source and new_name.
+
+    repositories maps a repository name to its id. Returns (actions,
+    unchanged, errors): a copy whose new_name already exists in its
+    target is unchanged, one whose disk or repository cannot be found,
+    or is ambiguous, is an error. With move, a copy that exists while
+    a single source is left is planned as delete_only.
+    """
+    names = set()
+    for copy in copies:
+        names.add(copy['name'])
+        names.add(copy.get('new_name') or copy['name'])
+    disks = load_disks(client, names)
+    mapped = None
+    if move:
+        mapped = id_set(client.iter_list('/VmDiskMapping', ('virtualDiskId', )), 'virtualDiskId')
+
+    actions, unchanged, errors = [], [], []
+    for copy in copies:
+        name = copy['name']
+        new_name = copy.get('new_name') or name
+        entry = dict(name=name, source=copy.get('source'), target=copy['target'],
+                     new_name=new_name)
+        if copy['target'] not in repositories:
+            errors.append(dict(entry, error="repository %s not found" % copy['target']))
+            continue
+        copied = in_repository(disks.get(new_name, []), copy['target'])
+        sources = disks.get(name, [])
+        if copy.get('source') is not None:
+            sources = in_repository(sources, copy['source'])
+        if copied:
+            copied_ids = set(disk['id']['value'] for disk in copied)
+            left = [disk for disk in sources if disk['id']['value'] not in copied_ids]
+            if not move or len(left) != 1:
+                unchanged.append(entry)
+                continue
+            disk = left[0]
+            entry['source'] = disk['repositoryId']['name']
+            if disk['id']['value'] in mapped:
+                errors.append(dict(entry, error="mapped to a VM, cannot be moved"))
+                continue
+            # The copy was made by a move that stopped before the delete
+            actions.append(dict(entry, disk_id=disk['id'], source_id=disk['repositoryId'],
+                                target_id=repositories[copy['target']],
+                                bytes=0, delete_only=True))
+            continue
+        if len(sources) != 1:
+            errors.append(dict(entry, error="%d virtual disks called %s" % (len(sources), name)))
+            continue
+        disk = sources[0]
+        entry['source'] = disk['repositoryId']['name']
+        if entry['source'] == copy['target'] and new_name == name:
+            errors.append(dict(entry, error="new_name is needed to copy within a repository"))
+            continue
+        if mapped is not None and disk['id']['value'] in mapped:
+            errors.append(dict(entry, error="mapped to a VM, cannot be moved"))
+            continue
+        actions.append(dict(entry, disk_id=disk['id'],
+                            source_id=disk['repositoryId'],
+                            target_id=repositories[copy['target']],
+                            bytes=disk['onDiskSize'] or disk['size'] or 0,
+                            delete_only=False))
+    return actions, unchanged, errors
+
+
+def describe(action):
+    return dict(name=action['name'], source=action['source'], target=action['target'],
+                new_name=action['new_name'], bytes=action['bytes'],
+                delete_only=action['delete_only'])
+
+
+def run_copies(client, actions, clone_type='SPARSE_COPY', move=False,
+               max_parallel=4, max_per_source=1, max_per_target=1):
+    """ Run the copies, with move deleting each source after its copy.
+    Returns one result each with status, seconds, mb_per_second and
+    error.
+    """
+
+    def copy(action):
+        if action['delete_only']:
+            client.delete_vdisk(action['source_id'], action['disk_id'])
+            return 0
+        start = time.time()
+        clone_id = client.clone_vdisk(action['disk_id'], action['target_id'],
+                                      action['new_name'], clone_type)
+        seconds = time.time() - start
+        if move:
+            if clone_id is None:
+                raise Exception('the clone job returned no virtual disk')
+            path = '/Repository/'+action['target_id']['value']+'/VirtualDisk/'+clone_id['value']
+            if not client.tracker.keep_created(path):
+                raise JobCancelled('Move of %s cancelled' % action['name'])
+            client.delete_vdisk(action['source_id'], action['disk_id'])
+        return seconds
+
+    def keys(action):
+        return [('source', action['source_id']['value']),
+                ('target', action['target_id']['value'])]
+
+    def key_limit(key):
+        return max_per_source if key[0] == 'source' else max_per_target
+
+    results = []
+    for action, seconds, error in run_parallel_keyed(copy, actions, keys, key_limit,
+                                                     max_parallel):
+        result = describe(action)
+        if error is not None:
+            result.update(status=FAILED, error=str(error))
+        else:
+            result.update(status=MOVED if move else COPIED, error=None,
+                          seconds=round(seconds, 1),
+                          mb_per_second=round(action['bytes'] / 1e6 / max(seconds, 0.001), 1))
+        results.append(result)
+    return results
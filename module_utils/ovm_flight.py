@@ -0,0 +1,94 @@
+# Single-flight lookups for the OVM REST client.
+#
+# When several workers ask for the same object or list at the same
+# moment, only the first sends the GET, the others wait for it and get
+# a copy of its parsed result. Nothing is kept once the request is
+# done, this only removes concurrent duplicates. A write to an object
+# type detaches the lookups of that type still in flight, callers that
+# arrive after the write send a new request instead of joining one
+# that may have been answered before the write.
+
+import copy
+import re
+import threading
+
+ACTION_TYPE = re.compile(r'[A-Z]\w*$')
+
+
+def object_types(path):
+    """ Object types a request path refers to.
+
+    /Vm/{id}/VirtualNic names Vm and VirtualNic, action segments name
+    the type they change, /Network/{id}/addVirtualNic names Network
+    and VirtualNic.
+    """
+    types = set()
+    for segment in path.split('?')[0].strip('/').split('/'):
+        if segment[:1].isupper():
+            types.add(segment)
+        elif segment[:1].islower():
+            match = ACTION_TYPE.search(segment)
+            if match:
+                types.add(match.group(0))
+    return types
+
+
+class Call(object):
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """ Share one in-flight GET and its result between threads. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, path, func):
+        """ Return func(), or the result of the same call in flight.
+
+        Returns (result, shared), shared is True when the result came
+        from another thread's request.
+        """
+        with self.lock:
+            call = self.calls.get(path)
+            leader = call is None
+            if leader:
+                call = self.calls[path] = Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # Callers change the objects they get before writing them back
+            return copy.deepcopy(call.result), True
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(path) is call:
+                    del self.calls[path]
+            call.done.set()
+        if call.waiters:
+            # The waiters copy the result, keep the caller's own from
+            # being changed under them
+            return copy.deepcopy(call.result), False
+        return call.result, False
+
+    def forget(self, path):
+        """ Detach the lookups of every type a write to path touches. """
+        types = object_types(path)
+        with self.lock:
+            for key in list(self.calls):
+                if object_types(key) & types:
+                    del self.calls[key]
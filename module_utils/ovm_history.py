@@ -0,0 +1,138 @@
+# Job duration history for the ovm_* modules.
+#
+# Completed job durations are kept per operation, repository and size
+# in a small JSON file, only the most recent samples per key. They give
+# the client a poll interval, an expected duration and a default
+# timeout that fit the job at hand instead of one value for all.
+
+import json
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+MAX_SAMPLES = 20
+MIN_SAMPLES = 3
+MIN_TIMEOUT = 300
+TIMEOUT_FACTOR = 5
+MIN_POLL = 1
+MAX_POLL = 30
+
+
+@contextmanager
+def locked_file(path):
+    """ Hold an exclusive lock on path+'.lock' where fcntl exists. """
+    if not HAS_FCNTL:
+        yield
+        return
+    with open(path+'.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def replace_file(path, content):
+    """ Write content to path atomically. """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.'+os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def operation_key(method, path, data=None):
+    """ Key a job by operation, repository and size.
+
+    Ids are dropped from the path, so PUT /Vm/{id}/clone becomes
+    'PUT /Vm/clone'. Sizes are rounded up to a power of two GiB.
+    """
+    parts = path.split('?')[0].strip('/').split('/')
+    operation = method+' /'+'/'.join(parts[0::2])
+    repository = '-'
+    if parts[0] == 'Repository' and len(parts) > 1:
+        repository = parts[1]
+    match = re.search(r'repositoryId=([^&]+)', path)
+    if match:
+        repository = match.group(1)
+    size = '-'
+    if isinstance(data, dict) and data.get('size'):
+        gib = float(data['size']) / 2**30
+        bucket = 1
+        while bucket < gib:
+            bucket *= 2
+        size = '%dG' % bucket
+    return '%s|%s|%s' % (operation, repository, size)
+
+
+class JobHistory:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.samples = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def record(self, key, seconds):
+        """ Add a duration and merge it into the file on disk. """
+        with self.lock:
+            with locked_file(self.path):
+                samples = self._load()
+                durations = samples.get(key, [])
+                durations.append(round(seconds, 1))
+                samples[key] = durations[-MAX_SAMPLES:]
+                replace_file(self.path, json.dumps(samples, separators=(',', ':')))
+                self.samples = samples
+
+    def durations(self, key):
+        """ Samples for key, falling back to the same operation on any
+        repository with the same size, then to any size. """
+        with self.lock:
+            if key in self.samples:
+                return self.samples[key]
+            operation, _, size = key.split('|')
+            same_size = []
+            same_operation = []
+            for other, durations in self.samples.items():
+                if other.startswith(operation+'|'):
+                    same_operation.extend(durations)
+                    if other.endswith('|'+size):
+                        same_size.extend(durations)
+            return same_size or same_operation
+
+    def expected(self, key):
+        durations = sorted(self.durations(key))
+        if len(durations) < MIN_SAMPLES:
+            return None
+        return durations[len(durations) // 2]
+
+    def timeout(self, key):
+        durations = self.durations(key)
+        if len(durations) < MIN_SAMPLES:
+            return None
+        return max(MIN_TIMEOUT, int(TIMEOUT_FACTOR * max(durations)))
+
+    def poll_interval(self, key):
+        expected = self.expected(key)
+        if expected is None:
+            return MIN_POLL
+        return min(MAX_POLL, max(MIN_POLL, expected / 10.0))
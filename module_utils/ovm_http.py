@@ -0,0 +1,220 @@
+# Lean HTTP transport for the OVM REST API.
+#
+# Importing requests pulls in urllib3, idna and a charset detector, which
+# is a large part of the run time of a short ovm_* task. This transport
+# covers what the client needs from a requests.Session (basic auth,
+# default headers, optional certificate checks, gzip and streamed bodies)
+# on top of http.client, keeping connections open between requests.
+#
+# A session can be shared by threads. Every request takes an idle
+# connection from the pool, or opens one, and puts it back once its
+# body has been read; up to pool_size idle connections per host are
+# kept.
+#
+# A request is only sent again when the manager had closed the idle
+# connection before any of it was written. Once the request is out, a
+# timeout or a lost response is raised: a POST that started a job must
+# not start it twice.
+
+import base64
+import errno
+import select
+import socket
+import ssl
+import threading
+import zlib
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+except ImportError:
+    import httplib
+    from urlparse import urlsplit
+
+# Errors reading what is left of a response, the connection is dropped
+READ_ERRORS = (httplib.HTTPException, IOError)
+
+# Errnos of a write to a connection the manager has closed
+CLOSED_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+# Methods sent again on a new connection when an idle one turns out to
+# be closed while writing the request
+RETRY_METHODS = ('GET', 'PUT', 'DELETE')
+
+# A response closed before its body was read is drained when this little
+# is left, reading it is cheaper than opening a new connection
+DRAIN_LIMIT = 65536
+
+
+class Response(object):
+    """ The part of requests.Response the client uses. """
+
+    def __init__(self, session, key, conn, raw):
+        self.session = session
+        self.key = key
+        self.conn = conn
+        self.raw = raw
+        self.status_code = raw.status
+        self.headers = dict((k.lower(), v) for k, v in raw.getheaders())
+        self._content = None
+        self._decoder = None
+        if self.headers.get('content-encoding') in ('gzip', 'deflate'):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS
+                                               if self.headers['content-encoding'] == 'gzip'
+                                               else zlib.MAX_WBITS)
+
+    def iter_content(self, chunk_size=65536):
+        if self._content is not None:
+            yield self._content
+            return
+        while True:
+            chunk = self.raw.read(chunk_size)
+            if not chunk:
+                break
+            if self._decoder is None:
+                yield chunk
+                continue
+            # Bounded, so a caller that stops early does not pay for
+            # inflating the rest of the body
+            data = self._decoder.decompress(chunk, chunk_size)
+            while data:
+                yield data
+                data = self._decoder.decompress(self._decoder.unconsumed_tail, chunk_size)
+        if self._decoder is not None:
+            tail = self._decoder.flush()
+            if tail:
+                yield tail
+        self._release()
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(self.iter_content())
+        return self._content
+
+    def _release(self):
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        if not self.raw.isclosed() and (self.raw.length or DRAIN_LIMIT + 1) <= DRAIN_LIMIT:
+            try:
+                self.raw.read()
+            except READ_ERRORS:
+                pass
+        if self.raw.isclosed() and not self.raw.will_close:
+            self.session._checkin(self.key, conn)
+        else:
+            # Unread body on the socket or the manager closes the
+            # connection, it cannot be reused
+            conn.close()
+
+    def close(self):
+        self._release()
+
+
+class HTTPSession(object):
+    """ A minimal requests.Session replacement on http.client. """
+
+    def __init__(self, pool_size=10):
+        self.auth = None
+        self.verify = True
+        self.headers = {}
+        self.timeout = 300
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            context = ssl.create_default_context()
+            if not self.verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout, context=context)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _checkout(self, key):
+        """ An idle connection to key that is still open, or None. """
+        while True:
+            with self.lock:
+                conns = self.idle.get(key)
+                if not conns:
+                    return None
+                conn = conns.pop()
+            if not dropped(conn):
+                return conn
+            conn.close()
+
+    def _checkin(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.pool_size:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, data=None, stream=False):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path
+        if parts.query:
+            path += '?'+parts.query
+        headers = dict(self.headers)
+        if self.auth is not None:
+            token = base64.b64encode(('%s:%s' % self.auth).encode('utf-8'))
+            headers['Authorization'] = 'Basic '+token.decode('ascii')
+        body = data.encode('utf-8') if isinstance(data, type(u'')) else data
+        if body is None and method in ('POST', 'PUT'):
+            body = b''
+
+        while True:
+            conn = self._checkout(key)
+            fresh = conn is None
+            if fresh:
+                conn = self._connect(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+            except (httplib.HTTPException, IOError) as e:
+                conn.close()
+                if fresh or method not in RETRY_METHODS or not closed_error(e):
+                    raise
+                continue
+            try:
+                raw = conn.getresponse()
+            except BaseException:
+                conn.close()
+                raise
+            break
+        response = Response(self, key, conn, raw)
+        if not stream:
+            response._content = b''.join(response.iter_content())
+        return response
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def dropped(conn):
+    """ Whether the manager closed an idle connection. An idle
+    connection has nothing to read, unless it was closed. """
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, ValueError):
+        return True
+
+
+def closed_error(error):
+    """ Whether error means the request could not be written because
+    the connection was closed, not that it failed on its way. """
+    if isinstance(error, httplib.CannotSendRequest):
+        return True
+    if isinstance(error, socket.timeout):
+        return False
+    return getattr(error, 'errno', None) in CLOSED_ERRNOS
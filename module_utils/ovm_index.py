@@ -0,0 +1,169 @@
+# Compact in-memory indexes over OVM objects.
+#
+# Bulk modes hold thousands of Vm, VirtualNic and VirtualDisk objects at
+# once. As raw JSON dicts each one costs several dicts and a copy of every
+# id string. Here an object keeps only the fields the modules read, in a
+# __slots__ record, id objects become IdRef records and their strings are
+# interned, so the many references to one VM or repository share a
+# single copy.
+#
+# Records and IdRefs support item access (vm['vmRunState'],
+# ref['value']), so code written against the JSON dicts keeps working,
+# and to_json() turns them back into dicts for request bodies.
+
+import sys
+
+try:
+    intern = sys.intern
+except AttributeError:
+    pass
+
+RECORD_FIELDS = {
+    'Vm': ('vmRunState', 'serverPoolId', 'repositoryId'),
+    'VirtualNic': ('vmId', 'networkId', 'ipAddresses'),
+    'VirtualDisk': ('repositoryId', 'size', 'onDiskSize', 'diskType'),
+    'VmDiskMapping': ('vmId', 'virtualDiskId', 'diskTarget'),
+    'Repository': ('fileSystemId', 'presentedServerIds', 'managerUuid'),
+    'Server': ('serverPoolId', ),
+}
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+class IdRef(object):
+    """ An OVM id object: value, name, type and uri. """
+    __slots__ = ('value', 'name', 'type', 'uri')
+
+    def __init__(self, value, name=None, type=None, uri=None):
+        self.value = _intern(value)
+        self.name = _intern(name)
+        self.type = _intern(type)
+        self.uri = _intern(uri)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __eq__(self, other):
+        return isinstance(other, IdRef) and other.value == self.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def as_dict(self):
+        return dict(value=self.value, name=self.name, type=self.type, uri=self.uri)
+
+
+class Record(object):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def as_dict(self):
+        return dict((field, to_json(getattr(self, field))) for field in self.__slots__)
+
+
+_record_classes = {}
+
+
+def record_class(object_type, fields):
+    key = (object_type, tuple(fields))
+    if key not in _record_classes:
+        _record_classes[key] = type(
+            str(object_type+'Record'), (Record, ),
+            {'__slots__': ('id', 'name')+tuple(fields)})
+    return _record_classes[key]
+
+
+def compact(value):
+    """ Turn JSON values into their compact form. """
+    if isinstance(value, dict):
+        if 'value' in value and 'type' in value:
+            return IdRef(value['value'], value.get('name'),
+                         value.get('type'), value.get('uri'))
+        return value
+    if isinstance(value, list):
+        return tuple(compact(item) for item in value)
+    return _intern(value)
+
+
+def make_record(cls, obj):
+    record = cls.__new__(cls)
+    for field in cls.__slots__:
+        setattr(record, field, compact(obj.get(field)))
+    return record
+
+
+def to_json(value):
+    """ json.dumps default= hook for IdRefs and records. """
+    if isinstance(value, (IdRef, Record)):
+        return value.as_dict()
+    if isinstance(value, tuple):
+        return [to_json(item) for item in value]
+    return value
+
+
+class ObjectIndex(object):
+    """ Records of one object type with lookups by id value and name. """
+
+    def __init__(self, object_type, records):
+        self.object_type = object_type
+        self.records = records
+        self.by_value = {}
+        self.by_name = {}
+        for record in records:
+            self.by_value[record.id.value] = record
+            if record.name is not None:
+                self.by_name.setdefault(record.name, record)
+
+    @classmethod
+    def load(cls, client, object_type, fields=None):
+        if fields is None:
+            fields = RECORD_FIELDS.get(object_type, ())
+        record_type = record_class(object_type, fields)
+        records = [make_record(record_type, obj)
+                   for obj in client.iter_list('/'+object_type, fields)]
+        return cls(object_type, records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def get(self, value):
+        return self.by_value.get(value)
+
+    def find(self, name):
+        return self.by_name.get(name)
+
+    def group_by(self, field):
+        """ Map the id value in field to the records referring to it. """
+        groups = {}
+        for record in self.records:
+            ref = getattr(record, field)
+            if ref is not None:
+                groups.setdefault(ref.value, []).append(record)
+        return groups
+
+
+def load_name_index(client, object_type):
+    """ Map name to IdRef from /{object_type}/id. """
+    index = {}
+    for obj in client.get_list('/'+object_type+'/id'):
+        ref = compact(obj)
+        index[ref.name] = ref
+    return index
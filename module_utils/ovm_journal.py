@@ -0,0 +1,97 @@
+# On-disk job journal for resumable ovm_* runs.
+#
+# Every job a client submits is recorded with its id, its target and,
+# once known, its result. When a run fails halfway and is started again
+# with the same journal, finished steps return their recorded result
+# without touching the manager and steps that were still running are
+# picked up again through /Job/{id}.
+#
+# Only the jobs are skipped: a resumed run still makes the lookups of
+# the names it works on, those are what tell it which steps remain.
+
+import hashlib
+import json
+import os
+import threading
+
+from ansible.module_utils.ovm_index import to_json
+
+
+def step_key(method, path, data, identity=None):
+    """ Identify a job-creating request independent of the run.
+
+    identity is what the step makes, e.g. the name of the VM a template
+    is cloned into, for requests that are the same for different
+    objects. When given it replaces the path and body, so a step whose
+    request changes between runs, like a disk placed in another
+    repository, is still found again.
+    """
+    if identity is not None:
+        raw = method+' '+identity
+    else:
+        raw = method+' '+path+' '+json.dumps(data, sort_keys=True, default=to_json)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class JobJournal:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.steps = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a killed run
+                        continue
+                    self.steps[record['key']] = record
+
+    def _append(self, record):
+        with self.lock:
+            self.steps[record['key']] = record
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record)+'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def lookup(self, key):
+        with self.lock:
+            return self.steps.get(key)
+
+    def submitted(self, key, target, job_id):
+        self._append(dict(key=key, target=target, job_id=job_id, state='submitted'))
+
+    def finished(self, key, target, job_id, result):
+        self._append(dict(key=key, target=target, job_id=job_id, state='done', result=result))
+
+    def failed(self, key, target, job_id, error):
+        self._append(dict(key=key, target=target, job_id=job_id, state='failed', error=error))
+
+    def abort(self, job_id):
+        """ Mark a step whose job was aborted as failed, so it is
+        submitted again instead of being waited on. """
+        with self.lock:
+            records = [r for r in self.steps.values()
+                       if r.get('job_id') == job_id and r['state'] == 'submitted']
+        for record in records:
+            self.failed(record['key'], record['target'], job_id, 'aborted')
+
+    def summary(self):
+        counts = {}
+        with self.lock:
+            for record in self.steps.values():
+                counts[record['state']] = counts.get(record['state'], 0) + 1
+        return counts
+
+    def remove(self):
+        """ Drop the journal once the run it belongs to has finished. """
+        with self.lock:
+            self.steps = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
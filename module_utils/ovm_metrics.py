@@ -0,0 +1,173 @@
+# Prometheus textfile metrics for the ovm_* modules.
+#
+# With OVM_METRICS_DIR pointing at a node_exporter textfile directory the
+# client counts API latency per endpoint, job duration, polls and
+# failures per operation. At exit the counts of this run are added to
+# a JSON state file in that directory under a lock, and ovm.prom is
+# rendered from the merged state and replaced atomically. Concurrent
+# runs therefore add up instead of overwriting each other.
+
+import atexit
+import json
+import os
+import threading
+
+from ansible.module_utils.ovm_history import locked_file, replace_file
+
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+PROM_FILE = 'ovm.prom'
+STATE_FILE = '.ovm_metrics.json'
+
+HELP = {
+    'ovm_api_request_seconds': ('histogram', 'OVM REST request latency by endpoint'),
+    'ovm_api_errors_total': ('counter', 'OVM REST responses with an error status'),
+    'ovm_job_seconds': ('histogram', 'OVM job duration by operation'),
+    'ovm_job_polls_total': ('counter', 'Job status polls by operation'),
+    'ovm_job_failures_total': ('counter', 'Jobs that failed, timed out or were aborted'),
+    'ovm_job_retries_total': ('counter', 'Journaled steps submitted again after a failure'),
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def endpoint_for(path):
+    """ /Vm/0004fb.../clone?x=y becomes /Vm/{id}/clone """
+    parts = path.split('?')[0].strip('/').split('/')
+    for index in range(1, len(parts), 2):
+        if parts[index] != 'id':
+            parts[index] = '{id}'
+    return '/'+'/'.join(parts)
+
+
+def operation_for(path):
+    """ The last non-id path element: clone, start, VirtualDisk, ... """
+    parts = path.split('?')[0].strip('/').split('/')
+    if len(parts) % 2 == 0:
+        return parts[-2]
+    return parts[-1]
+
+
+def get_metrics(directory=None):
+    """ One Metrics per directory and process, None when disabled. """
+    directory = directory or os.environ.get('OVM_METRICS_DIR')
+    if not directory:
+        return None
+    with _instances_lock:
+        if directory not in _instances:
+            _instances[directory] = Metrics(directory)
+        return _instances[directory]
+
+
+def _series(name, labels):
+    return name+'|'+','.join('%s=%s' % item for item in sorted(labels.items()))
+
+
+def _labels(series, extra=None):
+    name, _, raw = series.partition('|')
+    pairs = [pair.split('=', 1) for pair in raw.split(',') if pair]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return name, ''
+    return name, '{'+','.join('%s="%s"' % (k, v) for k, v in pairs)+'}'
+
+
+class Metrics:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        atexit.register(self.flush)
+
+    def inc(self, name, labels, value=1):
+        series = _series(name, labels)
+        with self.lock:
+            self.counters[series] = self.counters.get(series, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        series = _series(name, labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                series, dict(le=list(buckets), counts=[0] * len(buckets), sum=0.0, count=0))
+            for index, bound in enumerate(histogram['le']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def api_request(self, method, path, seconds, status):
+        endpoint = endpoint_for(path)
+        self.observe('ovm_api_request_seconds',
+                     dict(method=method, endpoint=endpoint), seconds, API_BUCKETS)
+        if status >= 400:
+            self.inc('ovm_api_errors_total',
+                     dict(method=method, endpoint=endpoint, status=str(status)))
+
+    def job_poll(self, operation):
+        self.inc('ovm_job_polls_total', dict(operation=operation))
+
+    def job_finished(self, operation, state, seconds):
+        self.observe('ovm_job_seconds',
+                     dict(operation=operation, state=state), seconds, JOB_BUCKETS)
+        if state != 'SUCCESS':
+            self.inc('ovm_job_failures_total', dict(operation=operation, state=state))
+
+    def retry(self, operation):
+        self.inc('ovm_job_retries_total', dict(operation=operation))
+
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+        if not counters and not histograms:
+            return
+        state_path = os.path.join(self.directory, STATE_FILE)
+        with locked_file(state_path):
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+            except (IOError, OSError, ValueError):
+                state = dict(counters={}, histograms={})
+            for series, value in counters.items():
+                state['counters'][series] = state['counters'].get(series, 0) + value
+            for series, histogram in histograms.items():
+                merged = state['histograms'].get(series)
+                if merged is None or merged['le'] != histogram['le']:
+                    state['histograms'][series] = histogram
+                    continue
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+                merged['sum'] += histogram['sum']
+                merged['count'] += histogram['count']
+            replace_file(state_path, json.dumps(state, separators=(',', ':')))
+            replace_file(os.path.join(self.directory, PROM_FILE), render(state))
+
+
+def render(state):
+    lines = []
+    seen = set()
+
+    def header(name):
+        if name not in seen and name in HELP:
+            seen.add(name)
+            lines.append('# HELP %s %s' % (name, HELP[name][1]))
+            lines.append('# TYPE %s %s' % (name, HELP[name][0]))
+
+    for series in sorted(state['counters']):
+        name, labels = _labels(series)
+        header(name)
+        lines.append('%s%s %s' % (name, labels, state['counters'][series]))
+    for series in sorted(state['histograms']):
+        histogram = state['histograms'][series]
+        name = series.partition('|')[0]
+        header(name)
+        for bound, count in zip(histogram['le'], histogram['counts']):
+            lines.append('%s_bucket%s %d' % (name, _labels(series, ('le', bound))[1], count))
+        lines.append('%s_bucket%s %d' % (name, _labels(series, ('le', '+Inf'))[1], histogram['count']))
+        lines.append('%s_sum%s %s' % (name, _labels(series)[1], round(histogram['sum'], 3)))
+        lines.append('%s_count%s %d' % (name, _labels(series)[1], histogram['count']))
+    return '\n'.join(lines)+'\n'
@@ -0,0 +1,171 @@
+# Repository onboarding as one pipeline.
+#
+# Bringing a repository online takes ownership of it, presents it to its
+# servers and refreshes its file system. As three tasks every one of
+# them resolves the names again and waits for all its jobs before the
+# next task starts. Here one read of the repositories and servers serves
+# every stage and each repository moves on as soon as its own jobs are
+# done: its presents start when its ownership job finishes, run in
+# parallel with at most max_per_server per server, and its file system
+# is refreshed once after the last of them.
+
+import threading
+import time
+
+OWNERSHIP = 'ownership'
+PRESENTATION = 'presentation'
+REFRESH = 'refresh'
+STAGES = (OWNERSHIP, PRESENTATION, REFRESH)
+
+
+def new_stage():
+    return dict(jobs=0, failed=0, start=None, end=None, job_seconds=0.0)
+
+
+class Onboarding(object):
+    """ Runs the onboarding plans of many repositories.
+
+    A plan is a dict with repository, ownership (a plan_ownership()
+    action or None), presents (present actions of Presentation.plan())
+    and filesystem (the file system id to refresh, or None).
+    """
+
+    def __init__(self, client, plans, max_parallel=8, max_per_server=1):
+        if max_per_server < 1:
+            # No present could ever start
+            raise ValueError('max_per_server must be at least 1')
+        self.client = client
+        self.plans = plans
+        self.max_parallel = max_parallel
+        self.max_per_server = max_per_server
+        self.stages = dict((stage, new_stage()) for stage in STAGES)
+        self.waiting = []
+        self.busy = {}
+        self.running = 0
+        self.ready = threading.Condition()
+        self.started = None
+
+    # The methods below that queue work are called with ready held
+
+    def begin(self, entry):
+        ownership = entry['plan']['ownership']
+        if ownership is not None:
+            self.waiting.append((OWNERSHIP, entry, ownership, []))
+        else:
+            self.queue_presents(entry)
+
+    def queue_presents(self, entry):
+        presents = entry['plan']['presents']
+        entry['pending'] = len(presents)
+        for action in presents:
+            self.waiting.append((PRESENTATION, entry, action, [action['server']]))
+        if not presents:
+            self.queue_refresh(entry)
+
+    def queue_refresh(self, entry):
+        result = entry['result']
+        changed = result['ownership'] == 'applied' or result['presented']
+        if entry['plan']['filesystem'] is not None and changed:
+            self.waiting.append((REFRESH, entry, entry['plan']['filesystem'], []))
+
+    def done(self, stage, entry, action, error):
+        result = entry['result']
+        if error is not None:
+            result['errors'].append(dict(stage=stage, error=str(error)))
+        if stage == OWNERSHIP:
+            result['ownership'] = 'failed' if error is not None else 'applied'
+            if error is None:
+                self.queue_presents(entry)
+        elif stage == PRESENTATION:
+            if error is None:
+                result['presented'].append(action['server'])
+            entry['pending'] -= 1
+            if entry['pending'] == 0:
+                self.queue_refresh(entry)
+        else:
+            result['refreshed'] = error is None
+
+    def take(self):
+        for position, (stage, entry, action, keys) in enumerate(self.waiting):
+            if all(self.busy.get(key, 0) < self.max_per_server for key in keys):
+                del self.waiting[position]
+                for key in keys:
+                    self.busy[key] = self.busy.get(key, 0) + 1
+                self.running += 1
+                return stage, entry, action, keys
+        return None
+
+    def apply(self, stage, action):
+        if stage == OWNERSHIP:
+            self.client.takeownership_repo(action['repository_id'], action['serverpool_id'])
+        elif stage == PRESENTATION:
+            self.client.present_repo(action['repository_id'], data=action['server_id'])
+        else:
+            self.client.fileSystem_refresh(action)
+
+    def worker(self):
+        while True:
+            with self.ready:
+                taken = self.take()
+                while taken is None:
+                    if not self.waiting and self.running == 0:
+                        return
+                    self.ready.wait()
+                    taken = self.take()
+            stage, entry, action, keys = taken
+            start = time.time()
+            error = None
+            try:
+                self.apply(stage, action)
+            except Exception as e:
+                error = e
+            end = time.time()
+            with self.ready:
+                timing = self.stages[stage]
+                timing['jobs'] += 1
+                timing['failed'] += error is not None
+                timing['job_seconds'] += end - start
+                if timing['start'] is None or start - self.started < timing['start']:
+                    timing['start'] = start - self.started
+                timing['end'] = max(timing['end'] or 0.0, end - self.started)
+                for key in keys:
+                    self.busy[key] -= 1
+                self.running -= 1
+                self.done(stage, entry, action, error)
+                self.ready.notify_all()
+
+    def run(self):
+        """ Returns one result per plan, with ownership (applied,
+        unchanged or failed), presented, refreshed and errors.
+        """
+        self.started = time.time()
+        entries = []
+        with self.ready:
+            for plan in self.plans:
+                entry = dict(plan=plan, pending=0, result=dict(
+                    repository=plan['repository'],
+                    ownership='unchanged' if plan['ownership'] is None else None,
+                    presented=[], refreshed=False, errors=[]))
+                entries.append(entry)
+                self.begin(entry)
+        threads = [threading.Thread(target=self.worker)
+                   for _ in range(max(1, self.max_parallel))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [entry['result'] for entry in entries]
+
+    def timing(self):
+        """ Per stage the number of jobs and failures, when the first
+        job started and the last ended (seconds into the run) and the
+        summed job seconds.
+        """
+        report = {}
+        for stage, timing in self.stages.items():
+            report[stage] = dict(timing)
+            for key in ('start', 'end', 'job_seconds'):
+                if report[stage][key] is not None:
+                    report[stage][key] = round(report[stage][key], 3)
+        return report
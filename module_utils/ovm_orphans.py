@@ -0,0 +1,142 @@
+# Orphaned virtual disks and VNICs.
+#
+# A virtual disk no VmDiskMapping points at, or a VirtualNic without a
+# VM or pointing at a VM that no longer exists, is left over from a
+# deleted or half-built VM. They are found with set differences over id
+# strings: the referenced ids are read into a set first, then the
+# disk or VNIC list is streamed and only the objects missing from that
+# set are kept. Nothing else of the big lists stays in memory, so 100k
+# disks cost a set of id strings and the orphans themselves.
+#
+# An unmapped disk is not necessarily left over: another task may have
+# just created it and not mapped it yet. Disks and VNICs carry no
+# creation time, so their age is taken from the job that made them: an
+# object that is the result of a job started less than min_age ago, or
+# of a job still running, is recent and kept.
+
+import fnmatch
+import sys
+import time
+
+from ansible.module_utils.ovm import run_parallel_keyed
+
+try:
+    intern = sys.intern
+except AttributeError:
+    pass
+
+DISK_FIELDS = ('repositoryId', 'size', 'diskType')
+
+
+def id_set(objects, field=None):
+    """ The values of id objects, or of the id objects in field of
+    objects. """
+    ids = set()
+    for obj in objects:
+        ref = obj if field is None else obj[field]
+        if ref is not None:
+            ids.add(intern(str(ref['value'])))
+    return ids
+
+
+def orphan_disks(client, disk_types=('VIRTUAL_DISK', ), repositories=None):
+    """ Virtual disks without a VmDiskMapping, as dicts with id, name,
+    repository, repository_id and size. repositories limits the search
+    to those repository names.
+    """
+    mapped = id_set(client.iter_list('/VmDiskMapping', ('virtualDiskId', )), 'virtualDiskId')
+    orphans = []
+    for disk in client.iter_list('/VirtualDisk', DISK_FIELDS):
+        if disk['diskType'] not in disk_types or disk['id']['value'] in mapped:
+            continue
+        repository = disk['repositoryId']
+        if repositories is not None and (repository is None or repository['name'] not in repositories):
+            continue
+        orphans.append(dict(
+            id=disk['id']['value'], name=disk['name'],
+            repository=repository and repository['name'],
+            repository_id=repository and repository['value'],
+            size=disk['size']))
+    return orphans
+
+
+def orphan_vnics(client):
+    """ VNICs without a VM or whose VM does not exist, as dicts with
+    id, name and vm (the name of the missing VM, if any).
+    """
+    vms = id_set(client.iter_list('/Vm/id'))
+    orphans = []
+    for vnic in client.iter_list('/VirtualNic', ('vmId', )):
+        vm = vnic['vmId']
+        if vm is not None and vm['value'] in vms:
+            continue
+        orphans.append(dict(id=vnic['id']['value'], name=vnic['name'],
+                            vm=vm and vm['name']))
+    return orphans
+
+
+def recent_results(client, min_age, now=None):
+    """ Ids of the objects made by jobs still running or started less
+    than min_age seconds ago, from one streamed read of the job list.
+    """
+    since = ((now or time.time()) - min_age) * 1000
+    ids = set()
+    for job in client.iter_list('/Job', ('startTime', 'resultId', 'summaryDone')):
+        if job['resultId'] is None:
+            continue
+        if not job['summaryDone'] or (job['startTime'] or 0) >= since:
+            ids.add(intern(str(job['resultId']['value'])))
+    return ids
+
+
+def excluded(orphans, patterns):
+    """ The orphans whose name matches none of the shell patterns. """
+    if not patterns:
+        return orphans
+    return [orphan for orphan in orphans
+            if not any(fnmatch.fnmatchcase(orphan['name'] or '', pattern)
+                       for pattern in patterns)]
+
+
+def split_recent(orphans, recent):
+    """ (old, new) orphans, new are those whose id is in recent. """
+    old, new = [], []
+    for orphan in orphans:
+        (new if orphan['id'] in recent else old).append(orphan)
+    return old, new
+
+
+def confirmed(found, again):
+    """ The orphans in found that a second scan still found. """
+    ids = set(orphan['id'] for orphan in again)
+    return [orphan for orphan in found if orphan['id'] in ids]
+
+
+def delete_orphans(client, disks, vnics, max_parallel=4, max_per_repository=1):
+    """ Delete the orphans, at most max_per_repository disks of one
+    repository at a time. Returns (deleted, errors) as lists of dicts
+    with kind, id and name, errors also with error.
+    """
+    items = [('disk', disk) for disk in disks] + [('vnic', vnic) for vnic in vnics]
+
+    def delete(item):
+        kind, orphan = item
+        if kind == 'disk':
+            if orphan['repository_id'] is None:
+                raise Exception('virtual disk has no repository')
+            client.delete_vdisk(dict(value=orphan['repository_id']), dict(value=orphan['id']))
+        else:
+            client.delete_orphan_vnic(dict(value=orphan['id']))
+
+    deleted, errors = [], []
+    for (kind, orphan), _, error in run_parallel_keyed(
+            delete, items,
+            lambda item: [item[1]['repository_id']] if item[0] == 'disk' else [],
+            max_per_repository, max_parallel):
+        entry = dict(kind=kind, id=orphan['id'], name=orphan['name'])
+        if error is not None:
+            entry['error'] = str(error)
+            errors.append(entry)
+        else:
+            deleted.append(entry)
+    return deleted, errors
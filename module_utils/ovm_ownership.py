@@ -0,0 +1,68 @@
+# Repository ownership for many repositories at once.
+#
+# The manager and the server pool are resolved once, the owner of every
+# repository comes from one Repository list request (managerUuid), and
+# the takeOwnership and releaseOwnership jobs needed run in parallel.
+
+from ansible.module_utils.ovm import run_parallel
+
+OWNED = 'owned'
+RELEASED = 'released'
+
+
+def find_manager(client, name=None):
+    """ The id of the manager called name. When there is no such manager
+    but only one manager, as on every OVM Manager, that one.
+    """
+    managers = client.get_list('/Manager/id')
+    for manager in managers:
+        if manager['name'] == name:
+            return manager
+    if len(managers) == 1:
+        return managers[0]
+    return None
+
+
+def plan_ownership(repositories, names, state, manager, serverpool=None):
+    """ Jobs that bring the repositories called names to state.
+
+    repositories is an ObjectIndex of Repository with managerUuid,
+    manager and serverpool are id objects, serverpool is only needed to
+    take ownership. Returns (actions, missing, unchanged).
+    """
+    actions, missing, unchanged = [], [], []
+    for name in names:
+        repository = repositories.find(name)
+        if repository is None:
+            missing.append(name)
+            continue
+        owner = repository.managerUuid
+        if state == OWNED and owner != manager['value'] or state == RELEASED and owner is not None:
+            actions.append(dict(repository=name, state=state, owner=owner,
+                                repository_id=repository.id, serverpool_id=serverpool))
+        else:
+            unchanged.append(name)
+    return actions, missing, unchanged
+
+
+def describe(action):
+    return dict(repository=action['repository'], state=action['state'],
+                owner=action['owner'])
+
+
+def run_ownership(client, actions, max_parallel):
+    """ Run the ownership jobs, returns one result each. """
+
+    def apply(action):
+        if action['state'] == OWNED:
+            client.takeownership_repo(action['repository_id'], action['serverpool_id'])
+        else:
+            client.releaseownership_repo(action['repository_id'])
+
+    results = []
+    for action, _, error in run_parallel(apply, actions, max_parallel):
+        result = describe(action)
+        result['status'] = 'failed' if error is not None else 'applied'
+        result['error'] = str(error) if error is not None else None
+        results.append(result)
+    return results
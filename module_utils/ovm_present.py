@@ -0,0 +1,129 @@
+# Repository presentation for many repositories and servers at once.
+#
+# Presenting a repository to a pool one server per task resolves the
+# names, downloads the Repository and waits for the job every time. Here
+# all Repository and Server objects are read with one list request each,
+# the present and unpresent jobs needed are worked out locally from
+# presentedServerIds, and the jobs run in parallel with a limit per
+# server, the server is the one mounting the repository.
+
+from ansible.module_utils.ovm import run_parallel_keyed
+from ansible.module_utils.ovm_index import ObjectIndex
+
+PRESENT = 'present'
+UNPRESENT = 'unpresent'
+
+
+class Presentation(object):
+    """ Which servers every repository is presented to, read once. """
+
+    def __init__(self, client):
+        self.repositories = ObjectIndex.load(client, 'Repository')
+        self.servers = ObjectIndex.load(client, 'Server')
+
+    def presented(self, repository):
+        """ Names of the servers repository is presented to. """
+        return set(server.name for server in repository.presentedServerIds or ())
+
+    def plan(self, wanted=(), unwanted=()):
+        """ Jobs that present the (repository, server) name pairs in
+        wanted and unpresent those in unwanted.
+
+        Returns (actions, missing), missing lists the repository and
+        server names that do not exist.
+        """
+        actions, missing = [], []
+        for action, pairs in ((PRESENT, wanted), (UNPRESENT, unwanted)):
+            for repository_name, server_name in pairs:
+                repository = self.repositories.find(repository_name)
+                server = self.servers.find(server_name)
+                if repository is None or server is None:
+                    for kind, name, record in (('repository', repository_name, repository),
+                                               ('server', server_name, server)):
+                        if record is None and (kind, name) not in missing:
+                            missing.append((kind, name))
+                    continue
+                if (server_name in self.presented(repository)) == (action == PRESENT):
+                    continue
+                actions.append(dict(action=action, repository=repository_name,
+                                    server=server_name, repository_id=repository.id,
+                                    server_id=server.id))
+        return actions, [dict(type=kind, name=name) for kind, name in missing]
+
+    def pool_members(self):
+        """ Map server pool name to the names of its servers. """
+        members = {}
+        for server in self.servers:
+            if server.serverPoolId is not None:
+                members.setdefault(server.serverPoolId.name, set()).add(server.name)
+        return members
+
+    def reconcile(self, mapping, pools, exclusive=True):
+        """ Jobs that make every repository in mapping presented to
+        exactly its servers.
+
+        mapping maps a repository name to a dict with servers and
+        server_pools lists, the servers of a pool count as listed.
+        pools are the names of the existing server pools. With
+        exclusive the repository is unpresented from the servers not
+        listed. Returns (actions, missing) like plan().
+
+        A repository whose target names a server or server pool that
+        does not exist is left alone: without it the target would be
+        smaller than meant, and exclusive would unpresent the
+        repository from the servers a typo left out.
+        """
+        members = self.pool_members()
+        wanted, unwanted, missing = [], [], []
+        for repository_name in sorted(mapping):
+            target = mapping[repository_name]
+            servers = set(target.get('servers') or ())
+            unknown = [dict(type='server', name=name) for name in sorted(servers)
+                       if self.servers.find(name) is None]
+            for pool in target.get('server_pools') or ():
+                if pool not in pools:
+                    unknown.append(dict(type='server_pool', name=pool))
+                servers |= members.get(pool, set())
+            repository = self.repositories.find(repository_name)
+            if repository is None:
+                unknown.insert(0, dict(type='repository', name=repository_name))
+            if unknown:
+                for entry in unknown:
+                    if entry not in missing:
+                        missing.append(entry)
+                continue
+            presented = self.presented(repository)
+            wanted.extend((repository_name, server) for server in sorted(servers - presented))
+            if exclusive:
+                unwanted.extend((repository_name, server)
+                                for server in sorted(presented - servers))
+        actions, not_found = self.plan(wanted, unwanted)
+        for entry in not_found:
+            if entry not in missing:
+                missing.append(entry)
+        return actions, missing
+
+
+def describe(action):
+    return dict(action=action['action'], repository=action['repository'],
+                server=action['server'])
+
+
+def run_actions(client, actions, max_parallel, max_per_server):
+    """ Run present and unpresent actions, returns one result each. """
+
+    def apply(action):
+        if action['action'] == PRESENT:
+            client.present_repo(action['repository_id'], data=action['server_id'])
+        else:
+            client.unpresent_repo(action['repository_id'], data=action['server_id'])
+
+    results = []
+    for action, _, error in run_parallel_keyed(
+            apply, actions, lambda action: [action['server']],
+            max_per_server, max_parallel):
+        result = describe(action)
+        result['status'] = 'failed' if error is not None else 'applied'
+        result['error'] = str(error) if error is not None else None
+        results.append(result)
+    return results
@@ -0,0 +1,68 @@
+# Incremental parsing of the JSON lists OVM returns for /{Type} and
+# /{Type}/id.
+#
+# The list is decoded element by element while it comes off the socket,
+# so a caller looking for one object can stop reading as soon as it has
+# it, and a caller that needs the whole list can drop the fields it does
+# not use before the next element is parsed.
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks):
+    """ Yield the elements of a JSON array from an iterable of byte chunks. """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    started = False
+    for chunk in chunks:
+        buf += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE+',':
+                if buf[pos] == ',' and not started:
+                    raise ValueError('Expected a JSON array')
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # The element is not complete yet
+                break
+            if buf[end - 1] not in '}]"' and (
+                    end >= len(buf) or buf[end] not in WHITESPACE+',]'):
+                # A bare number or literal may continue in the next
+                # chunk, 2 of 2.5 or tru of true
+                break
+            yield obj
+            pos = end
+        buf = buf[pos:]
+    buf = buf.strip()
+    if buf and buf != ']':
+        obj, end = decoder.raw_decode(buf)
+        if buf[end:].strip() not in ('', ']'):
+            raise ValueError('Extra data after %r' % buf[:end])
+        yield obj
+
+
+def project(obj, fields):
+    """ Keep only fields (and always id and name) of an object. """
+    if fields is None or not isinstance(obj, dict):
+        return obj
+    kept = dict((field, obj.get(field)) for field in fields)
+    kept['id'] = obj.get('id')
+    if 'name' in obj:
+        kept['name'] = obj['name']
+    return kept
@@ -0,0 +1,231 @@
+# One polling loop for all the jobs of a task.
+#
+# Without it every thread waiting for a job runs its own monitor_job
+# loop, N jobs in flight cost N polls per interval. A JobWaiter keeps
+# the outstanding job ids of any number of clients and polls them from
+# one thread:
+#
+# - each job is polled when it is due; its interval starts at what the
+#   job history expects and backs off while the job keeps running, so a
+#   long job costs a few polls instead of one per second;
+# - the more jobs are pending, the longer every interval gets: all of
+#   them together are polled at most POLL_RATE times a second;
+# - when many jobs are due at once the manager's /Job list is read in
+#   one request instead, and only the jobs it shows as done are fetched.
+#   The list holds the manager's job history too, so it is only read
+#   while it has at most LIST_RATIO jobs per job due;
+# - a finished job completes the JobFuture its caller waits on.
+#
+# Polls then scale with the number of jobs finishing, not with jobs
+# times wait time. Clients hand their jobs to it through monitor_job
+# once they were created with waiter=.
+
+import threading
+import time
+
+from ansible.module_utils.ovm import JobCancelled, JobTimeout
+
+# Jobs due in one cycle from which the /Job list is read instead
+LIST_THRESHOLD = 20
+# Jobs in the /Job list per due job up to which reading the list is
+# cheaper than polling the due jobs one by one
+LIST_RATIO = 25
+BACKOFF = 1.5
+MAX_POLL = 30
+# Polls a second for all pending jobs together
+POLL_RATE = 20
+# Jobs due within this part of their interval are polled in the same
+# cycle, so jobs submitted close together are polled together
+EARLY = 0.5
+# Longest sleep, so cancellation and new jobs are seen soon enough
+MAX_SLEEP = 1.0
+
+
+class JobFuture(object):
+    """ The outcome of one job, set by the waiter thread. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def set(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+    def wait(self):
+        # Short waits keep the main thread responsive to signals
+        while not self.done.wait(MAX_SLEEP):
+            pass
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class PendingJob(object):
+    __slots__ = ('client', 'job_id', 'operation', 'interval', 'due',
+                 'started', 'polled', 'timeout', 'cancellable', 'future')
+
+    def __init__(self, client, job_id, operation, interval, timeout, cancellable):
+        self.client = client
+        self.job_id = job_id
+        self.operation = operation
+        self.interval = interval
+        self.started = self.polled = time.time()
+        self.due = self.started + interval
+        self.timeout = timeout
+        self.cancellable = cancellable
+        self.future = JobFuture()
+
+
+class JobWaiter(object):
+    """ Poll the outstanding jobs of many clients from one thread.
+
+    Jobs are accounted for on the client that submitted them, the polls
+    are sent by client if given, else by that same client.
+    """
+
+    def __init__(self, client=None, list_threshold=LIST_THRESHOLD):
+        self.client = client
+        self.list_threshold = list_threshold
+        self.lock = threading.Condition()
+        self.pending = {}
+        self.thread = None
+        self.stopped = False
+        self.cycles = 0
+        # Jobs in the manager's /Job list when it was last read
+        self.list_size = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='ovm-job-waiter')
+                self.thread.daemon = True
+                self.thread.start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify()
+
+    def submit(self, client, job_id, poll_interval=None, timeout=None,
+               cancellable=True):
+        """ Start waiting for job_id, returns its JobFuture. """
+        operation, interval, timeout = client.job_schedule(
+            job_id, poll_interval, timeout)
+        job = PendingJob(client, job_id, operation, interval, timeout, cancellable)
+        self.start()
+        with self.lock:
+            self.pending[job_id] = job
+            job.interval = max(interval, self.min_interval())
+            job.due = job.started + job.interval
+            self.lock.notify()
+        return job.future
+
+    def wait(self, client, job_id, poll_interval=None, timeout=None,
+             cancellable=True):
+        return self.submit(client, job_id, poll_interval, timeout,
+                           cancellable).wait()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.stopped:
+                    return
+                now = time.time()
+                cancelled, due = [], []
+                for job in self.pending.values():
+                    if job.cancellable and job.client.tracker.stop.is_set():
+                        cancelled.append(job)
+                    elif job.due - job.interval * EARLY <= now:
+                        due.append(job)
+                if not due and not cancelled:
+                    wake = min([job.due for job in self.pending.values()] or [now + MAX_SLEEP])
+                    self.lock.wait(min(max(wake - now, 0.01), MAX_SLEEP))
+                    continue
+            for job in cancelled:
+                self.finish(job, error=JobCancelled('Job %s cancelled' % job.job_id))
+            if not due:
+                continue
+            self.cycles += 1
+            try:
+                self.poll(due)
+            except Exception as e:
+                # The job list could not be read, fail the jobs of this
+                # cycle instead of leaving their callers waiting
+                for job in due:
+                    self.finish(job, error=e)
+
+    def min_interval(self):
+        """ Shortest poll interval with the jobs pending now. """
+        return len(self.pending) / float(POLL_RATE)
+
+    def poll(self, due):
+        if len(due) >= max(self.list_threshold, self.list_size / LIST_RATIO):
+            with self.lock:
+                pending = list(self.pending.values())
+            states = self.job_states(self.client or due[0].client,
+                                     set(job.job_id for job in pending))
+            now = time.time()
+            due = set(due)
+            for job in pending:
+                # Only the jobs the list shows as done, or due ones it
+                # does not show at all, are fetched. Those done before
+                # they were due are picked up early.
+                state = states.get(job.job_id)
+                if state or state is None and job in due:
+                    self.poll_one(job)
+                elif job in due:
+                    self.not_done(job, now)
+            return
+        for job in due:
+            self.poll_one(job)
+
+    def job_states(self, client, job_ids):
+        """ Map the ids of job_ids in the manager's job list to their
+        summaryDone. The list is streamed, only these are kept. """
+        states = {}
+        size = 0
+        for job in client.iter_list('/Job', ('summaryDone', )):
+            size += 1
+            if job['id']['value'] in job_ids:
+                states[job['id']['value']] = job.get('summaryDone')
+        self.list_size = size
+        return states
+
+    def poll_one(self, job):
+        now = time.time()
+        try:
+            state = (self.client or job.client).fetch('/Job/'+job.job_id)
+            done, result = job.client.job_polled(
+                job.job_id, state, job.operation, now - job.polled)
+        except Exception as e:
+            self.finish(job, error=e)
+            return
+        if done:
+            self.finish(job, result=result)
+        else:
+            job.polled = now
+            self.not_done(job, now)
+
+    def not_done(self, job, now):
+        if job.timeout is not None and now - job.started > job.timeout:
+            reason = job.client.job_timed_out(job.job_id, job.timeout)
+            if not job.client.timed_out(reason, job.cancellable):
+                try:
+                    job.client.abort_job(job.job_id)
+                except Exception:
+                    pass
+            self.finish(job, error=JobTimeout(reason))
+            return
+        with self.lock:
+            floor = self.min_interval()
+        job.interval = max(min(job.interval * BACKOFF, MAX_POLL), floor)
+        job.due = now + job.interval
+
+    def finish(self, job, result=None, error=None):
+        with self.lock:
+            self.pending.pop(job.job_id, None)
+        job.future.set(result, error)
@@ -0,0 +1,148 @@
+""" A job timeout in a worker thread cancels the whole run.
+
+Needs ansible installed, run from the top of the repository with
+
+    python -m unittest discover tests
+"""
+
+import itertools
+import json
+import os
+import unittest
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+
+from ansible.module_utils.ovm import OVMRestClient, run_parallel, run_parallel_keyed
+from ansible.module_utils.ovm_waiter import JobWaiter
+
+BASE = 'https://127.0.0.1:7002/ovm/core/wsapi/rest'
+
+
+def ref(object_type, value):
+    return {'type': 'com.oracle.ovm.mgr.ws.model.'+object_type,
+            'value': value, 'name': value, 'uri': ''}
+
+
+class Response(object):
+
+    def __init__(self, obj):
+        self.status_code = 200
+        self.headers = {}
+        self.content = json.dumps(obj).encode('utf-8')
+
+
+class Manager(object):
+    """ A session creating disks, the jobs creating the disks named in
+    hung never finish. The disks live in a dict of disk id to
+    repository id. """
+
+    def __init__(self, hung=()):
+        self.hung = set(hung)
+        self.disks = {}
+        self.jobs = {}
+        self.aborted = []
+        self.ids = itertools.count(1)
+
+    def job(self, result=None, done=True):
+        job_id = 'job%d' % next(self.ids)
+        self.jobs[job_id] = (result, done)
+        return Response({'id': ref('Job', job_id)})
+
+    def request(self, method, url, data=None, stream=False):
+        parts = url[len(BASE):].split('?')[0].strip('/').split('/')
+        if method == 'GET' and parts[0] == 'Job':
+            result, done = self.jobs[parts[1]]
+            return Response({'id': ref('Job', parts[1]), 'summaryDone': done,
+                             'jobRunState': 'SUCCESS' if done else 'RUNNING',
+                             'resultId': result})
+        if method == 'PUT' and parts[-1] == 'abort':
+            self.aborted.append(parts[1])
+            return Response(None)
+        if method == 'POST' and parts[-1] == 'VirtualDisk':
+            name = json.loads(data)['name']
+            if name in self.hung:
+                return self.job(done=False)
+            self.disks[name] = parts[1]
+            return self.job(ref('VirtualDisk', name))
+        if method == 'DELETE':
+            del self.disks[parts[-1]]
+            return self.job()
+        raise AssertionError('unexpected %s %s' % (method, url))
+
+
+class Module(object):
+
+    def __init__(self):
+        self.failed = None
+
+    def fail_json(self, **kwargs):
+        self.failed = kwargs
+        raise SystemExit(1)
+
+
+class TimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = Manager(hung=['d2'])
+        self.module = Module()
+        self.waiter = JobWaiter()
+        self.client = OVMRestClient(BASE, self.manager, job_timeout=1,
+                                    waiter=self.waiter)
+        self.client.exit_on_cancel(self.module, rollback=True)
+
+    def tearDown(self):
+        self.waiter.stop()
+
+    def create(self, disk):
+        return self.client.create_vdisk(ref('Repository', disk['repository']), True,
+                                        data={'name': disk['name'], 'size': 2**30})
+
+    def test_timeout_in_worker_rolls_back(self):
+        disks = [dict(name='d1', repository='Repo1'), dict(name='d2', repository='Repo2')]
+        results = run_parallel(self.create, disks, 2)
+        self.assertEqual([error is None for _, _, error in results], [True, False])
+        with self.assertRaises(SystemExit):
+            self.client.fail_if_cancelled()
+        report = self.module.failed['cancelled']
+        self.assertEqual(len(report['aborted']), 1)
+        self.assertTrue(report['aborted'][0].endswith(' d2'))
+        self.assertEqual(report['rolled_back'], ['/Repository/Repo1/VirtualDisk/d1'])
+        self.assertEqual(self.manager.disks, {})
+        self.assertEqual(len(self.manager.aborted), 1)
+
+    def test_nothing_to_cancel(self):
+        self.manager.hung = set()
+        run_parallel(self.create, [dict(name='d1', repository='Repo1')], 2)
+        self.client.fail_if_cancelled()
+        self.assertIsNone(self.module.failed)
+        self.assertEqual(self.manager.disks, {'d1': 'Repo1'})
+
+
+class CreateTimeoutTest(unittest.TestCase):
+    """ ovm_create: disks in two repositories, the job of d2 hangs. """
+
+    def test_timeout_rolls_back_created_disks(self):
+        manager = Manager(hung=['d2'])
+        module = Module()
+        client = OVMRestClient(BASE, manager, job_timeout=1)
+        client.exit_on_cancel(module, rollback=True)
+
+        def create(disk):
+            return client.create_vdisk(ref('Repository', disk['repository']), True,
+                                       data={'name': disk['name'], 'size': 2**30})
+        disks = [dict(name='d1', repository='Repo1'), dict(name='d2', repository='Repo2')]
+        run_parallel_keyed(create, disks, lambda disk: [disk['repository']], 1, 2)
+        with self.assertRaises(SystemExit):
+            client.fail_if_cancelled()
+        report = module.failed['cancelled']
+        self.assertIn('did not finish within 1 seconds', module.failed['msg'])
+        self.assertTrue(report['aborted'][0].endswith(' d2'))
+        self.assertEqual(report['rolled_back'], ['/Repository/Repo1/VirtualDisk/d1'])
+        self.assertEqual(report['cleanup_failed'], [])
+        self.assertEqual(manager.disks, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
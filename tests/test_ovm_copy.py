@@ -0,0 +1,156 @@
+""" Moves that are cancelled halfway, or resumed by a rerun.
+
+Needs ansible installed, run from the top of the repository with
+
+    python -m unittest discover tests
+"""
+
+import itertools
+import json
+import os
+import unittest
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+
+from ansible.module_utils.ovm import OVMRestClient, JobCancelled
+from ansible.module_utils.ovm_copy import plan_copies, run_copies
+
+BASE = 'https://127.0.0.1:7002/ovm/core/wsapi/rest'
+
+
+def ref(object_type, value):
+    return {'type': 'com.oracle.ovm.mgr.ws.model.'+object_type,
+            'value': value, 'name': value, 'uri': ''}
+
+
+class Response(object):
+
+    def __init__(self, obj):
+        self.status_code = 200
+        self.headers = {}
+        self.content = json.dumps(obj).encode('utf-8')
+
+
+class Manager(object):
+    """ A session whose jobs finish at once. The disks live in a dict
+    of disk id to repository id. """
+
+    def __init__(self, disks):
+        self.disks = dict(disks)
+        self.requests = []
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        # Called before a clone of the disk id is made
+        self.before_clone = {}
+
+    def job(self, result=None):
+        job_id = 'job%d' % next(self.ids)
+        self.jobs[job_id] = result
+        return Response({'id': ref('Job', job_id)})
+
+    def request(self, method, url, data=None, stream=False):
+        path = url[len(BASE):].split('?')[0]
+        query = dict(part.split('=') for part in url.partition('?')[2].split('&') if part)
+        self.requests.append((method, path))
+        parts = path.strip('/').split('/')
+        if method == 'GET' and parts[0] == 'Job':
+            result = self.jobs[parts[1]]
+            return Response({'id': ref('Job', parts[1]), 'summaryDone': True,
+                             'jobRunState': 'SUCCESS', 'resultId': result})
+        if method == 'PUT' and parts[-1] == 'clone':
+            if parts[1] in self.before_clone:
+                self.before_clone.pop(parts[1])()
+            clone = 'copy%d' % next(self.ids)
+            self.disks[clone] = query['repositoryId']
+            return self.job(ref('VirtualDisk', clone))
+        if method == 'PUT':
+            return self.job(ref('VirtualDisk', parts[1]))
+        if method == 'DELETE':
+            del self.disks[parts[-1]]
+            return self.job()
+        raise AssertionError('unexpected %s %s' % (method, url))
+
+
+def move(disk, source, target):
+    return dict(name=disk, source=source, target=target, new_name=disk,
+                disk_id=ref('VirtualDisk', disk), source_id=ref('Repository', source),
+                target_id=ref('Repository', target), bytes=2**30, delete_only=False)
+
+
+class ListClient(object):
+    """ iter_list() over the disks of a Manager, none of them mapped. """
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def iter_list(self, path, fields=None):
+        if path == '/VmDiskMapping':
+            return iter([])
+        return iter([dict(id=ref('VirtualDisk', disk), name=name,
+                          repositoryId=ref('Repository', repository),
+                          size=2**30, onDiskSize=None)
+                     for disk, (name, repository) in self.manager.names.items()])
+
+
+class MoveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = Manager({'disk1': 'Repo1', 'disk2': 'Repo1'})
+        self.client = OVMRestClient(BASE, self.manager)
+        self.client.tracker.rollback = True
+        self.actions = [move('disk1', 'Repo1', 'Repo2'), move('disk2', 'Repo1', 'Repo2')]
+
+    def test_move(self):
+        results = run_copies(self.client, self.actions, move=True, max_parallel=1)
+        self.assertEqual([result['status'] for result in results], ['moved', 'moved'])
+        self.assertEqual(sorted(self.manager.disks.values()), ['Repo2', 'Repo2'])
+        self.assertEqual(self.client.tracker.created, [])
+
+    def test_cancel_after_first_move_keeps_its_copy(self):
+        reports = []
+
+        def cancel():
+            reports.append(self.client.tracker.cancel(self.client, 'interrupted'))
+            raise JobCancelled('interrupted')
+        self.manager.before_clone['disk2'] = cancel
+
+        results = run_copies(self.client, self.actions, move=True, max_parallel=1)
+        self.assertEqual([result['status'] for result in results], ['moved', 'failed'])
+        # disk1 now only exists as its copy in Repo2, disk2 was not touched
+        self.assertEqual(sorted(self.manager.disks.items()),
+                         [('copy1', 'Repo2'), ('disk2', 'Repo1')])
+        self.assertEqual(reports[0]['rolled_back'], [])
+
+
+class ResumeTest(unittest.TestCase):
+    """ A rerun after a move failed between its clone and the delete. """
+
+    def setUp(self):
+        self.manager = Manager({'disk1': 'Repo1', 'copy1': 'Repo2'})
+        self.manager.names = {'disk1': ('disk1', 'Repo1'), 'copy1': ('disk1', 'Repo2')}
+        self.repositories = {'Repo1': ref('Repository', 'Repo1'),
+                             'Repo2': ref('Repository', 'Repo2')}
+
+    def plan(self, move):
+        return plan_copies(ListClient(self.manager), [dict(name='disk1', target='Repo2')],
+                           self.repositories, move)
+
+    def test_move_deletes_the_source_left(self):
+        actions, unchanged, errors = self.plan(move=True)
+        self.assertEqual((len(actions), unchanged, errors), (1, [], []))
+        self.assertTrue(actions[0]['delete_only'])
+        self.assertEqual(actions[0]['disk_id']['value'], 'disk1')
+        results = run_copies(OVMRestClient(BASE, self.manager), actions, move=True)
+        self.assertEqual([result['status'] for result in results], ['moved'])
+        self.assertEqual(self.manager.disks, {'copy1': 'Repo2'})
+        self.assertNotIn('PUT', [method for method, _ in self.manager.requests])
+
+    def test_copy_is_unchanged(self):
+        actions, unchanged, errors = self.plan(move=False)
+        self.assertEqual((actions, len(unchanged), errors), ([], 1, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
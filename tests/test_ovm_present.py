@@ -0,0 +1,76 @@
+""" Presentation.reconcile() with names that do not exist.
+
+Needs ansible installed, run from the top of the repository with
+
+    python -m unittest discover tests
+"""
+
+import os
+import unittest
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+
+from ansible.module_utils.ovm_present import Presentation, UNPRESENT
+
+
+def ref(object_type, name):
+    return {'type': 'com.oracle.ovm.mgr.ws.model.'+object_type,
+            'value': object_type+'-'+name, 'name': name, 'uri': ''}
+
+
+class ListClient(object):
+    """ iter_list() over Pool1 with srv1 and srv2, and Repo1 presented
+    to both. """
+
+    def __init__(self):
+        pool = ref('ServerPool', 'Pool1')
+        servers = [dict(id=ref('Server', name), name=name, serverPoolId=pool)
+                   for name in ('srv1', 'srv2')]
+        repository = dict(id=ref('Repository', 'Repo1'), name='Repo1',
+                          presentedServerIds=[server['id'] for server in servers])
+        self.lists = {'/Server': servers, '/Repository': [repository]}
+
+    def iter_list(self, path, fields=None):
+        return iter(self.lists[path])
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.presentation = Presentation(ListClient())
+        self.pools = {'Pool1': ref('ServerPool', 'Pool1')}
+
+    def reconcile(self, mapping):
+        return self.presentation.reconcile(mapping, self.pools, exclusive=True)
+
+    def test_matching_target_plans_nothing(self):
+        actions, missing = self.reconcile({'Repo1': {'server_pools': ['Pool1']}})
+        self.assertEqual(actions, [])
+        self.assertEqual(missing, [])
+
+    def test_missing_pool_leaves_repository_alone(self):
+        actions, missing = self.reconcile({'Repo1': {'server_pools': ['Pool1typo']}})
+        self.assertEqual(actions, [])
+        self.assertEqual(missing, [dict(type='server_pool', name='Pool1typo')])
+
+    def test_missing_server_leaves_repository_alone(self):
+        actions, missing = self.reconcile({'Repo1': {'servers': ['srv1', 'srv2typo']}})
+        self.assertEqual(actions, [])
+        self.assertEqual(missing, [dict(type='server', name='srv2typo')])
+
+    def test_exclusive_unpresents_servers_not_listed(self):
+        actions, missing = self.reconcile({'Repo1': {'servers': ['srv1']}})
+        self.assertEqual([(action['action'], action['server']) for action in actions],
+                         [(UNPRESENT, 'srv2')])
+        self.assertEqual(missing, [])
+
+    def test_missing_repository(self):
+        actions, missing = self.reconcile({'Repo2': {'servers': ['srv1']}})
+        self.assertEqual(actions, [])
+        self.assertEqual(missing, [dict(type='repository', name='Repo2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+""" iter_json_array() over a list cut into chunks at every position.
+
+Needs ansible installed, run from the top of the repository with
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import unittest
+
+import ansible.module_utils
+ansible.module_utils.__path__.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+
+from ansible.module_utils.ovm_stream import iter_json_array
+
+DOCUMENT = json.dumps([
+    {'id': {'value': '0004fb00'}, 'name': 'Repo1', 'size': 2.5e12},
+    2.5, -17, 1e-3, True, False, None, 'café ]}', [1, [2.25]], {}, 10,
+], ensure_ascii=False).encode('utf-8')
+
+
+class ChunkTest(unittest.TestCase):
+
+    def test_one_chunk(self):
+        self.assertEqual(list(iter_json_array([DOCUMENT])), json.loads(DOCUMENT))
+
+    def test_every_split(self):
+        for cut in range(1, len(DOCUMENT)):
+            chunks = [DOCUMENT[:cut], DOCUMENT[cut:]]
+            self.assertEqual(list(iter_json_array(chunks)), json.loads(DOCUMENT),
+                             'split at %d' % cut)
+
+    def test_byte_by_byte(self):
+        chunks = [DOCUMENT[i:i+1] for i in range(len(DOCUMENT))]
+        self.assertEqual(list(iter_json_array(chunks)), json.loads(DOCUMENT))
+
+    def test_number_split_at_the_point(self):
+        self.assertEqual(list(iter_json_array([b'[1, 2.', b'5]'])), [1, 2.5])
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"a": 1}']))
+
+
+if __name__ == '__main__':
+    unittest.main()